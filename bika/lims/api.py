@@ -6,9 +6,15 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 from Acquisition import aq_base
+from AccessControl import getSecurityManager
 from AccessControl.PermissionRole import rolesForPermissionOn
+from BTrees.IIBTree import IISet
+from BTrees.IIBTree import intersection
+from DateTime import DateTime
 
 from Products.CMFPlone.utils import base_hasattr
+from Products.CMFPlone.CatalogTool import CatalogTool
+from Products.CMFCore.permissions import AccessInactivePortalContent
 from Products.CMFCore.interfaces import ISiteRoot
 from Products.CMFCore.interfaces import IFolderish
 from Products.Archetypes.BaseObject import BaseObject
@@ -16,6 +22,7 @@ from Products.ZCatalog.interfaces import ICatalogBrain
 from Products.CMFPlone.utils import _createObjectByType
 from Products.CMFCore.WorkflowCore import WorkflowException
 from Products.CMFCore.utils import getToolByName
+from Products.CMFCore.utils import _checkPermission
 
 from zope import globalrequest
 from zope.event import notify
@@ -599,15 +606,14 @@ def get_parent(brain_or_object, catalog_search=False):
     return get_object(brain_or_object).aq_parent
 
 
-def search(query, catalog=_marker):
-    """Search for objects.
+def get_search_catalog(query, catalog=_marker):
+    """Returns the catalog to be used for the query passed in.
 
     :param query: A suitable search query.
     :type query: dict
     :param catalog: A single catalog id or a list of catalog ids
     :type catalog: str/list
-    :returns: Search results
-    :rtype: List of ZCatalog brains
+    :returns: The catalog tool
     """
 
     # query needs to be a dictionary
@@ -644,7 +650,128 @@ def search(query, catalog=_marker):
     if len(catalogs) > 1:
         fail("Multi Catalog Queries are not supported, please specify a catalog.")
 
-    return catalogs[0](query)
+    return catalogs[0]
+
+
+def search(query, catalog=_marker):
+    """Search for objects.
+
+    :param query: A suitable search query.
+    :type query: dict
+    :param catalog: A single catalog id or a list of catalog ids
+    :type catalog: str/list
+    :returns: Search results
+    :rtype: List of ZCatalog brains
+    """
+    catalog = get_search_catalog(query, catalog)
+
+    # Slow queries are logged. See bika.lims.catalog.query_log
+    from bika.lims.catalog import query_log
+    return query_log.search(catalog, query)
+
+
+def get_result_set(query, catalog):
+    """Returns the set of record ids of the catalog that match the query,
+    computed straight from the indexes: no sorting is done and no brains are
+    created. Plone catalogs are restricted the same way as in a search (roles
+    of the current user and effective range)
+
+    :param query: A suitable search query.
+    :type query: dict
+    :param catalog: The catalog tool
+    :returns: A set of record ids
+    :rtype: IISet/IITreeSet
+    """
+    query = dict(query)
+    if isinstance(catalog, CatalogTool):
+        user = getSecurityManager().getUser()
+        query["allowedRolesAndUsers"] = \
+            catalog._listAllowedRolesAndUsers(user)
+        show_inactive = query.pop("show_inactive", False)
+        if not show_inactive and \
+                not _checkPermission(AccessInactivePortalContent, catalog):
+            query["effectiveRange"] = DateTime()
+
+    _catalog = catalog._catalog
+    result_set = None
+    for name in query.keys():
+        if name not in _catalog.indexes:
+            continue
+        result = _catalog.getIndex(name)._apply_index(query)
+        if result is None:
+            continue
+        if result_set is None:
+            result_set = result[0]
+        else:
+            result_set = intersection(result_set, result[0])
+        if not result_set:
+            return IISet()
+
+    if result_set is None:
+        # No index restricts the query, so all records match
+        return IISet(_catalog.paths.keys())
+    return result_set
+
+
+def count(query, catalog=_marker):
+    """Count the objects that match the query, without creating brains.
+
+    :param query: A suitable search query.
+    :type query: dict
+    :param catalog: A single catalog id or a list of catalog ids
+    :type catalog: str/list
+    :returns: Number of objects that match the query
+    :rtype: int
+    """
+    catalog = get_search_catalog(query, catalog)
+    return len(get_result_set(query, catalog))
+
+
+def group_count(query, index_name, catalog=_marker):
+    """Count the objects that match the query, grouped by the values they
+    have for the index passed in, without creating brains. Only indexes that
+    map values to records (FieldIndex, KeywordIndex, ...) are supported.
+
+    :param query: A suitable search query.
+    :type query: dict
+    :param index_name: The name of the index to group by
+    :type index_name: str
+    :param catalog: A single catalog id or a list of catalog ids
+    :type catalog: str/list
+    :returns: Mapping of index value -> number of objects
+    :rtype: dict
+    """
+    catalog = get_search_catalog(query, catalog)
+    if index_name not in catalog.indexes():
+        fail("Index '{}' not found in {}".format(index_name, catalog.getId()))
+    index = aq_base(catalog._catalog.getIndex(index_name))
+    values_index = getattr(index, "_index", None)
+    records_index = getattr(index, "_unindex", None)
+    if values_index is None or records_index is None:
+        fail("Index '{}' does not support grouping".format(index_name))
+
+    result_set = get_result_set(query, catalog)
+    counts = {}
+    if len(result_set) < index.indexSize():
+        # Less records than values: look up the values of each record
+        for rid in result_set.keys():
+            values = records_index.get(rid, _marker)
+            if values is _marker:
+                continue
+            if not hasattr(values, "__iter__"):
+                values = [values]
+            for value in set(values):
+                counts[value] = counts.get(value, 0) + 1
+        return counts
+
+    # Intersect the records of each value with the records found
+    for value, records in values_index.items():
+        if isinstance(records, int):
+            records = IISet((records, ))
+        num = len(intersection(records, result_set))
+        if num:
+            counts[value] = num
+    return counts
 
 
 def safe_getattr(brain_or_object, attr, default=_marker):
@@ -134,6 +134,13 @@ class AggregatedAnalysesView(AnalysesView):
         # By default, display the analysis
         return True
 
+    def allowed_items_query(self):
+        """Returns the catalog query equivalent to isItemAllowed. The filter
+        bar of this view does not check the items, so the query for the
+        departments from AnalysesView is enough
+        """
+        return AnalysesView.allowed_items_query(self)
+
     def folderitem(self, obj, item, index):
         """
         In this case obj should be a brain
@@ -14,6 +14,7 @@ from bika.lims import logger
 from bika.lims.utils import t, dicts_to_dict, format_supsub
 from bika.lims.utils.analysis import format_uncertainty
 from bika.lims.browser.bika_listing import BikaListingView
+from bika.lims.browser.bika_listing import feeds_columns
 from bika.lims.config import QCANALYSIS_TYPES
 from bika.lims.interfaces import IFieldIcons
 from bika.lims.interfaces import IResultOutOfRange
@@ -29,6 +30,7 @@ from Products.Archetypes.config import REFERENCE_CATALOG
 from Products.ZCatalog.interfaces import ICatalogBrain
 from zope.component import getAdapters
 from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.catalog.service_info import get_service_metadata
 from plone.api.user import has_permission
 import json
 
@@ -269,7 +271,8 @@ class AnalysesView(BikaListingView):
         ret = []
         if analysis:
             # This function returns  a list of tuples as [(UID,Title),(),...]
-            uids = analysis.getAllowedMethodUIDs
+            uids = get_service_metadata(
+                analysis, 'getAllowedMethodUIDs', [])
             # inactive_state is not specified below, because it is not relevant.
             # If the analysis was created with some method, that is the method
             # we want to permit the user select.
@@ -323,7 +326,8 @@ class AnalysesView(BikaListingView):
         if method:
             instruments = method.getInstruments()
         else:
-            i_uids = analysis_brain.getAllowedInstrumentUIDs
+            i_uids = get_service_metadata(
+                analysis_brain, 'getAllowedInstrumentUIDs', [])
             brains = bsc(
                 portal_type='Instrument', UID=i_uids, inactive_state='active')
             instruments = [b.getObject() for b in brains]
@@ -389,6 +393,27 @@ class AnalysesView(BikaListingView):
         deps = self.request.get('filter_by_department_info', '')
         return not depuid or depuid in deps.split(',')
 
+    def allowed_items_query(self):
+        """Returns the catalog query equivalent to isItemAllowed. If filtering
+        by department is enabled, only the analyses without department or
+        assigned to the selected departments are allowed.
+        Returns None if the user cannot view retracted analyses, because
+        folderitem discards them
+        """
+        if not has_permission(ViewRetractedAnalyses, obj=self.context):
+            return None
+        if not self.context.bika_setup.getAllowDepartmentFiltering():
+            return {}
+        deps = self.request.get('filter_by_department_info', '')
+        return self.get_departments_query(deps.split(','))
+
+    def get_departments_query(self, deps):
+        """Returns the catalog query of the analyses without department or
+        assigned to the departments passed in
+        """
+        # Analyses without department are indexed with None
+        return {'getDepartmentUID': filter(None, deps) + ['', None]}
+
     def folderitem(self, obj, item, index):
         """
         Obj should be a brain
@@ -630,32 +655,7 @@ class AnalysesView(BikaListingView):
             self.security_manager.checkPermission(AddAttachment, obj)
         # If the analysis service has the option 'attachment' enabled
         if can_add_attachment or can_view_result:
-            attachments = ""
-            at_uids = obj.getAttachmentUIDs
-            if at_uids:
-                uc = getToolByName(self.context, 'uid_catalog')
-                attachments_objs = [x.getObject() for x in uc(UID=at_uids)]
-                for attachment in attachments_objs:
-                    af = attachment.getAttachmentFile()
-                    icon = af.icon
-                    if callable(icon):
-                        icon = icon()
-                    attachments += \
-                        "<span class='attachment' attachment_uid='%s'>" % \
-                        (attachment.UID())
-                    if icon:
-                        attachments += "<img src='%s/%s'/>" % \
-                                       (self.portal_url, icon)
-                    attachments += \
-                        '<a href="%s/at_download/AttachmentFile"/>%s</a>' % \
-                        (attachment.absolute_url(), af.filename)
-                    if can_edit_analysis:
-                        attachments += "<img class='deleteAttachmentButton' " \
-                                       "attachment_uid='%s' src='%s'/>" % (
-                                           attachment.UID(),
-                                           "++resource++bika.lims.images/delete.png")
-                    attachments += "</br></span>"
-            item['replace']['Attachments'] = attachments[:-12] + "</span>"
+            self._folder_item_attachments(obj, item, can_edit_analysis)
         # TODO-performance: This part gets the full object...
         # Only display data bearing fields if we have ViewResults
         # permission, otherwise just put an icon in Result column.
@@ -931,6 +931,38 @@ class AnalysesView(BikaListingView):
 
         return item
 
+    @feeds_columns('Attachments')
+    def _folder_item_attachments(self, obj, item, can_edit_analysis):
+        """Renders the attachments of the analysis. Attachment objects are
+        woken up, so this is only done if the column is displayed
+        """
+        attachments = ""
+        at_uids = obj.getAttachmentUIDs
+        if at_uids:
+            uc = getToolByName(self.context, 'uid_catalog')
+            attachments_objs = [x.getObject() for x in uc(UID=at_uids)]
+            for attachment in attachments_objs:
+                af = attachment.getAttachmentFile()
+                icon = af.icon
+                if callable(icon):
+                    icon = icon()
+                attachments += \
+                    "<span class='attachment' attachment_uid='%s'>" % \
+                    (attachment.UID())
+                if icon:
+                    attachments += "<img src='%s/%s'/>" % \
+                                   (self.portal_url, icon)
+                attachments += \
+                    '<a href="%s/at_download/AttachmentFile"/>%s</a>' % \
+                    (attachment.absolute_url(), af.filename)
+                if can_edit_analysis:
+                    attachments += "<img class='deleteAttachmentButton' " \
+                                   "attachment_uid='%s' src='%s'/>" % (
+                                       attachment.UID(),
+                                       "++resource++bika.lims.images/delete.png")
+                attachments += "</br></span>"
+        item['replace']['Attachments'] = attachments[:-12] + "</span>"
+
     def _folder_item_fieldicons(self, obj):
         """Resolves if field-specific icons must be displayed for the object
         passed in.
@@ -15,6 +15,7 @@ from bika.lims.interfaces import IAnalysis, IResultOutOfRange, IJSONReadExtender
 from bika.lims.interfaces import IFieldIcons
 from bika.lims.utils import to_utf8
 from bika.lims.utils import dicts_to_dict
+import inspect
 import json
 import plone
 from zExceptions import Forbidden
@@ -22,6 +23,17 @@ from zope.component import adapts, getAdapters
 from zope.interface import implements
 
 
+def accepts_specification(adapter):
+    """Returns whether the IResultOutOfRange adapter passed in accepts the
+    specification to check the result against as a keyword argument
+    """
+    try:
+        argspec = inspect.getargspec(adapter.__call__)
+    except TypeError:
+        return False
+    return "specification" in argspec.args or argspec.keywords is not None
+
+
 class ResultOutOfRangeIcons(object):
     """An icon provider for Analyses: Result field out-of-range alerts
     """
@@ -29,13 +41,16 @@ class ResultOutOfRangeIcons(object):
     def __init__(self, context):
         self.context = context
 
-    def __call__(self, result=None, **kwargs):
+    def __call__(self, result=None, specification=None, **kwargs):
         translate = self.context.translate
         path = '++resource++bika.lims.images'
         alerts = {}
         # We look for IResultOutOfRange adapters for this object
         for name, adapter in getAdapters((self.context, ), IResultOutOfRange):
-            ret = adapter(result)
+            if specification is not None and accepts_specification(adapter):
+                ret = adapter(result, specification=specification)
+            else:
+                ret = adapter(result)
             if not ret:
                 continue
             spec = ret["spec_values"]
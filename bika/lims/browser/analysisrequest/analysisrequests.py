@@ -839,6 +839,24 @@ class AnalysisRequestsView(BikaListingView):
             result = len(matches) > 0
         return result
 
+    def allowed_items_query(self):
+        """Returns the catalog query equivalent to isItemAllowed, if any.
+        Analysis Requests without departments are allowed when filtering by
+        department, but the getDepartmentUIDs index leaves out those with no
+        departments, so the catalog cannot search them: the items are checked
+        one by one with isItemAllowed instead. Neither can the catalog filter
+        by the analysis from the filter bar, that needs the analyses of each
+        request
+        """
+        if self.context.bika_setup.getAllowDepartmentFiltering():
+            # Analysis Requests without departments are not indexed
+            return None
+        if self.filter_bar_enabled:
+            filter_bar = self.get_filter_bar_values() or {}
+            if filter_bar.get('analysis_name', ''):
+                return None
+        return {}
+
     def folderitems(self, full_objects=False, classic=False):
         # We need to get the portal catalog here in roder to save process
         # while iterating over folderitems
@@ -40,6 +40,8 @@ from bika.lims.utils import formatDecimalMark, to_utf8
 from bika.lims.utils.analysis import format_uncertainty
 from bika.lims.vocabularies import getARReportTemplates
 from bika.lims.workflow import wasTransitionPerformed
+from bika.lims.workflow.taskqueue import is_task_queue_enabled
+from bika.lims.workflow.taskqueue import queue_task
 from plone.api.portal import get_registry_record
 from plone.api.portal import set_registry_record
 from plone.app.blob.interfaces import IBlobField
@@ -1499,16 +1501,33 @@ class AnalysisRequestDigester:
         return self.request.form.get('hvisible', '0').lower() in ['true', '1']
 
 
+def digest(ar):
+    """Re-populates the ar.Digest of the AR passed in. Handler of the tasks
+    queued in bika.lims.workflow.taskqueue
+    """
+    AnalysisRequestDigester()(ar, overwrite=True)
+
+
+def _flag_for_digestion(ar):
+    """Flags the AR passed in to be digested. If the task queue is enabled,
+    the digestion is queued, otherwise it is done at the end of the request
+    """
+    if is_task_queue_enabled():
+        queue_task(ar, digest)
+        return
+    request = ar.REQUEST
+    ars_to_digest = set(request.get('ars_to_digest', []))
+    ars_to_digest.add(ar)
+    request['ars_to_digest'] = ars_to_digest
+
+
 def ARModifiedHandler(instance, event):
     """After any modification of an AR that has already been verified,
     re-populate the ar.Digest.
     """
     if IAnalysisRequest.providedBy(instance):
         if wasTransitionPerformed(instance, 'verify'):
-            request = instance.REQUEST
-            ars_to_digest = set(request.get('ars_to_digest', []))
-            ars_to_digest.add(instance)
-            request['ars_to_digest'] = ars_to_digest
+            _flag_for_digestion(instance)
 
 
 def AnalysisAfterTransitionHandler(instance, event):
@@ -1518,11 +1537,7 @@ def AnalysisAfterTransitionHandler(instance, event):
     of the request, regardless of how many children were transitioned.
     """
     if event.transition and event.transition.id == 'verify':
-        request = instance.REQUEST
-        ar = instance.aq_parent
-        ars_to_digest = set(request.get('ars_to_digest', []))
-        ars_to_digest.add(ar)
-        request['ars_to_digest'] = ars_to_digest
+        _flag_for_digestion(instance.aq_parent)
 
 
 def EndRequestHandler(event):
@@ -1531,10 +1546,11 @@ def EndRequestHandler(event):
     """
     request = event.request
     ars_to_digest = set(request.get('ars_to_digest', []))
+    if not ars_to_digest:
+        return
     digester = AnalysisRequestDigester()
-    if ars_to_digest:
-        for ar in ars_to_digest:
-            digester(ar, overwrite=True)
+    for ar in ars_to_digest:
+        digester(ar, overwrite=True)
     # If this commit() is not here, then the data does not appear to be
     # saved.  IEndRequest happens outside the transaction?
     transaction.commit()
@@ -32,6 +32,8 @@ from bika.lims.utils import tmpID
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import wasTransitionPerformed
+from bika.lims.workflow.bulk import do_transitions
+from bika.lims.workflow.skiplist import get_skiplist
 from email.Utils import formataddr
 
 
@@ -245,9 +247,10 @@ class AnalysisRequestWorkflowAction(WorkflowAction):
             ar_state = getCurrentState(ar)
             if wasTransitionPerformed(ar, 'to_be_verified'):
                 # Apply to AR only; we don't want this transition to cascade.
-                ar.REQUEST['workflow_skiplist'].append("retract all analyses")
+                skiplist = get_skiplist(ar.REQUEST)
+                skiplist.append("retract all analyses")
                 workflow.doActionFor(ar, 'retract')
-                ar.REQUEST['workflow_skiplist'].remove("retract all analyses")
+                skiplist.remove("retract all analyses")
                 ar_state = getCurrentState(ar)
             for analysis in new:
                 changeWorkflowState(analysis, 'bika_analysis_workflow', ar_state)
@@ -486,9 +489,9 @@ class AnalysisRequestWorkflowAction(WorkflowAction):
             #             break
             if can_submit and analysis not in submissable:
                 submissable.append(analysis)
-        # and then submit them.
-        for analysis in submissable:
-            doActionFor(analysis, 'submit')
+        # and then submit them, promoting the transition to their worksheets
+        # once all of them have been submitted
+        do_transitions(submissable, 'submit')
 
         # LIMS-2366: Finally, when we are done processing all applicable
         # analyses, we must attempt to initiate the submit transition on the
@@ -5,8 +5,10 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+import base64
 import collections
 import copy
+import inspect
 import json
 import traceback
 
@@ -20,8 +22,7 @@ from bika.lims import PMF, deprecated
 from bika.lims import api
 from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
-from bika.lims.api import get_tool, get_object_by_uid, get_current_user, \
-    get_object, get_transitions_for
+from bika.lims.api import get_tool, get_object_by_uid, get_current_user
 from bika.lims.browser import BrowserView
 from bika.lims.interfaces import IFieldIcons
 from bika.lims.interfaces import ITopRightHTMLComponentsHook
@@ -33,12 +34,57 @@ from bika.lims.utils import t
 from bika.lims.utils import to_utf8
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import skip
+from bika.lims.workflow.bulk import defer_promotions
+from bika.lims.workflow.listing import resolve_transitions
 from plone.app.content.browser import tableview
 from zope.component import getAdapters, getMultiAdapter
 
 DATETIME_EXCEPTIONS = (DateError, TimeError, DateTimeError, SyntaxError)
 
 
+def feeds_columns(*columns):
+    """Decorator for the helper functions of folderitem that only compute the
+    values of the columns passed in. The function is not called if none of
+    these columns is rendered in the listing (see is_column_visible)
+    """
+    def decorator(func):
+        def wrapper(self, *args, **kwargs):
+            if not any(map(self.is_column_visible, columns)):
+                return None
+            return func(self, *args, **kwargs)
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        return wrapper
+    return decorator
+
+
+class ListingItem(dict):
+    """Dictionary with the data of an item of a listing. The values of the
+    columns that are not rendered are only computed if requested, e.g. by a
+    folderitem override
+    """
+
+    def __init__(self, lazy_columns, getter, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._lazy_columns = lazy_columns
+        self._getter = getter
+
+    def __missing__(self, key):
+        if key not in self._lazy_columns:
+            raise KeyError(key)
+        value = self._getter(key)
+        self[key] = value
+        return value
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._lazy_columns
+
+    def get(self, key, default=None):
+        if key in self:
+            return self[key]
+        return default
+
+
 class WorkflowAction:
     """Workflow actions taken in any Bika contextAnalysisRequest context
 
@@ -218,42 +264,48 @@ class WorkflowAction:
         transitioned = []
         workflow = getToolByName(self.context, 'portal_workflow')
 
-        # transition selected items from the bika_listing/Table.
-        for item in items:
-            # the only actions allowed on inactive/cancelled
-            # items are "reinstate" and "activate"
-            if not isActive(item) and action not in ('reinstate', 'activate'):
-                continue
-            if not skip(item, action, peek=True):
-                allowed_transitions = \
-                    [it['id'] for it in workflow.getTransitionsFor(item)]
-                if action in allowed_transitions:
-                    # if action is "verify" and the item is an analysis or
-                    # reference analysis, check if the if the required number
-                    # of verifications done for the analysis is, at least,
-                    # the number of verifications performed previously+1
-                    if (action == 'verify' and
-                            hasattr(item, 'getNumberOfVerifications') and
-                            hasattr(item, 'getNumberOfRequiredVerifications')):
-                        success = True
-                        message = "Unknown error while submitting."
-                        revers = item.getNumberOfRequiredVerifications()
-                        nmvers = item.getNumberOfVerifications()
-                        member = get_current_user()
-                        username = member.getUserName()
-                        item.addVerificator(username)
-                        if revers - nmvers <= 1:
+        # transition selected items from the bika_listing/Table. The
+        # transitions are promoted to the parents of the items once all of
+        # them have been transitioned (see bika.lims.workflow.bulk)
+        with defer_promotions():
+            for item in items:
+                # the only actions allowed on inactive/cancelled
+                # items are "reinstate" and "activate"
+                if not isActive(item) \
+                        and action not in ('reinstate', 'activate'):
+                    continue
+                if not skip(item, action, peek=True):
+                    allowed_transitions = \
+                        [it['id'] for it in workflow.getTransitionsFor(item)]
+                    if action in allowed_transitions:
+                        # if action is "verify" and the item is an analysis or
+                        # reference analysis, check if the if the required
+                        # number of verifications done for the analysis is, at
+                        # least, the number of verifications performed
+                        # previously+1
+                        if (action == 'verify' and
+                                hasattr(item, 'getNumberOfVerifications') and
+                                hasattr(item,
+                                        'getNumberOfRequiredVerifications')):
+                            success = True
+                            message = "Unknown error while submitting."
+                            revers = item.getNumberOfRequiredVerifications()
+                            nmvers = item.getNumberOfVerifications()
+                            member = get_current_user()
+                            username = member.getUserName()
+                            item.addVerificator(username)
+                            if revers - nmvers <= 1:
+                                success, message = doActionFor(item, action)
+                                if not success:
+                                    # If failed, delete last verificator.
+                                    item.deleteLastVerificator()
+                            item.reindexObject()
+                        else:
                             success, message = doActionFor(item, action)
-                            if not success:
-                                # If failed, delete last verificator.
-                                item.deleteLastVerificator()
-                        item.reindexObject()
-                    else:
-                        success, message = doActionFor(item, action)
-                    if success:
-                        transitioned.append(item.id)
-                    else:
-                        self.addPortalMessage(message, 'error')
+                        if success:
+                            transitioned.append(item.id)
+                        else:
+                            self.addPortalMessage(message, 'error')
 
         # automatic label printing
         if transitioned \
@@ -523,6 +575,15 @@ class BikaListingView(BrowserView):
         self.show_all = False
         self.show_more = False
         self.limit_from = 0
+        # Function called with each item, and the position of its brain from
+        # the results of the query, as soon as folderitems computes it (see
+        # stream_items)
+        self.folderitem_hook = None
+        # Total number of items, if known. It is only known when the items
+        # are filtered by the catalog (see allowed_items_query)
+        self.total_items = None
+        # Columns rendered, set while folderitems runs
+        self._visible_columns = None
         self.mtool = None
         self.sort_on = None
         self.sort_order = 'ascending'
@@ -822,6 +883,39 @@ class BikaListingView(BrowserView):
                    if 'index' in val]
         return indexes
 
+    def get_visible_columns(self):
+        """Returns the ids of the columns rendered for the current review
+        state, taking into account the columns hidden by the user
+        """
+        review_state = self.review_state or {}
+        return [col for col in review_state.get('columns', [])
+                if self.columns.get(col, {}).get('toggle', True)]
+
+    def is_column_visible(self, column):
+        """Returns whether the column passed in is rendered in the listing.
+        folderitem overrides can use this function to skip the computation of
+        values that will not be displayed
+        """
+        visible = getattr(self, '_visible_columns', None)
+        if visible is None:
+            visible = set(self.get_visible_columns())
+        return column in visible
+
+    def get_column_value(self, obj, column):
+        """Returns the value for the column passed in from the brain or object
+        """
+        value = ''
+        attrobj = getFromString(obj, column)
+        value = attrobj if attrobj else value
+
+        # Custom attribute? Inspect to set the value
+        # for the current column dynamically
+        vattr = self.columns[column].get('attr', None)
+        if vattr:
+            attrobj = getFromString(obj, vattr)
+            value = attrobj if attrobj else value
+        return value
+
     def get_toggle_cols(self):
         """
         Returns the list of column ids to be displayed for the current list.
@@ -934,6 +1028,9 @@ class BikaListingView(BrowserView):
             return self.rendered_items()
 
         self.before_render()
+        if self.request.get('ndjson', '') == self.form_id:
+            # Stream the items as newline-delimited JSON
+            return self.stream_items()
         if self.request.get('table_only', '') == self.form_id \
                 or self.request.get('rows_only', '') == self.form_id:
             return self.contents_table(table_only=self.form_id)
@@ -978,6 +1075,37 @@ class BikaListingView(BrowserView):
         """
         return True
 
+    def allowed_items_query(self):
+        """Returns a dict with the catalog query that filters the items the
+        same way isItemAllowed does. If so, items are filtered by the catalog
+        and batching is done at index level, so the total number of items is
+        known and each page costs the same. Returns None if the rules from
+        isItemAllowed cannot be expressed as a catalog query: items are then
+        checked one by one with isItemAllowed.
+
+        Batching at index level relies on folderitem returning an item for
+        each brain, so this is opt-in: only views whose folderitem never
+        discards items (by returning None) should return a query. Views that
+        override isItemAllowed or folderitem must override this function too,
+        otherwise it is ignored.
+        """
+        return None
+
+    def _get_allowed_items_query(self):
+        """Returns the query from allowed_items_query if it is defined along
+        with the isItemAllowed and folderitem in use (same class or a subclass
+        of them)
+        """
+        def defined_in(name):
+            for klass in inspect.getmro(self.__class__):
+                if name in klass.__dict__:
+                    return klass
+        query_cls = defined_in('allowed_items_query')
+        for name in ['isItemAllowed', 'folderitem']:
+            if not issubclass(query_cls, defined_in(name)):
+                return None
+        return self.allowed_items_query()
+
     # noinspection PyUnusedLocal
     def folderitem(self, obj, item, index):
         """Service triggered each time an item is iterated in folderitems.
@@ -1024,8 +1152,14 @@ class BikaListingView(BrowserView):
         idx = 0
         results = []
         self.show_more = False
-        brains = self._fetch_brains(self.limit_from)
-        for obj in brains:
+        allowed_query = self._get_allowed_items_query()
+        brains = self._fetch_brains(self.limit_from, allowed_query)
+        # Only the values of the columns to be rendered are computed. The
+        # rest are computed on demand (see ListingItem)
+        self._visible_columns = set(self.get_visible_columns())
+        # Items already filtered by the catalog don't need to be checked
+        check_allowed = self.total_items is None
+        for position, obj in enumerate(brains, self.limit_from):
             # avoid creating unnecessary info for items outside the current
             # batch;  only the path is needed for the "select all" case...
             # we only take allowed items into account
@@ -1035,9 +1169,8 @@ class BikaListingView(BrowserView):
                 break
 
             # check if the item must be rendered or not (prevents from
-
             # doing it later in folderitems) and dealing with paging
-            if not obj or not self.isItemAllowed(obj):
+            if not obj or (check_allowed and not self.isItemAllowed(obj)):
                 continue
 
             # Get the css for this row in accordance with the obj's state
@@ -1093,21 +1226,18 @@ class BikaListingView(BrowserView):
             # { field_id : "css classes" }
             results_dict['class'] = {}
 
-            # Search for values for all columns in obj
+            # Search for values for all visible columns in obj
+            lazy_columns = []
             for key in self.columns.keys():
+                if key not in self._visible_columns:
+                    if key not in results_dict:
+                        lazy_columns.append(key)
+                    continue
                 # if the key is already in the results dict
                 # then we don't replace it's value
                 value = results_dict.get(key, '')
                 if not value:
-                    attrobj = getFromString(obj, key)
-                    value = attrobj if attrobj else value
-
-                    # Custom attribute? Inspect to set the value
-                    # for the current column dynamically
-                    vattr = self.columns[key].get('attr', None)
-                    if vattr:
-                        attrobj = getFromString(obj, vattr)
-                        value = attrobj if attrobj else value
+                    value = self.get_column_value(obj, key)
                     results_dict[key] = value
                 # Replace with an url?
                 replace_url = self.columns[key].get('replace_url', None)
@@ -1116,6 +1246,8 @@ class BikaListingView(BrowserView):
                     if attrobj:
                         results_dict['replace'][key] = \
                             '<a href="%s">%s</a>' % (attrobj, value)
+            results_dict = ListingItem(
+                lazy_columns, self._get_lazy_column_getter(obj), results_dict)
             # The item basics filled. Delegate additional actions to folderitem
             # service. folderitem service is frequently overriden by child
             # objects
@@ -1123,9 +1255,19 @@ class BikaListingView(BrowserView):
             if item:
                 results.append(item)
                 idx += 1
+                if self.folderitem_hook:
+                    self.folderitem_hook(item, position)
+        self._visible_columns = None
         return results
 
-    def _fetch_brains(self, idxfrom=0):
+    def _get_lazy_column_getter(self, obj):
+        """Returns a function that computes the value of a column for obj
+        """
+        def getter(column):
+            return self.get_column_value(obj, column)
+        return getter
+
+    def _fetch_brains(self, idxfrom=0, allowed_query=None):
         """Returns the brains that must be displayed in the current list
 
         Uses the contentFilter and/or contentsMethod class variables (or
@@ -1133,9 +1275,16 @@ class BikaListingView(BrowserView):
         only a subset of the results must be returned by using idxfrom and. If
         the number of results is lower than idxfrom, will return an empty array
 
+        If allowed_query is passed in, it is added to the query. In such case,
+        all brains returned are allowed, only those of the current page (and
+        one more, to know if there are more pages) are returned and
+        self.total_items is set to the total number of results
+
         :param idxfrom: index to start to count for results
+        :param allowed_query: catalog query from allowed_items_query
         :return: the list of brains to be displayed in this list
         """
+        self.total_items = None
         # Creating a copy of the contentFilter dictionary in order to include
         # the filter bar's filtering additions in the query. We don't want to
         # modify contentFilter with those 'extra' filtering elements to be
@@ -1145,6 +1294,18 @@ class BikaListingView(BrowserView):
         # Adding the extra filtering elements
         if addition:
             contentFilterTemp.update(addition)
+        if allowed_query:
+            if set(allowed_query.keys()) & set(contentFilterTemp.keys()):
+                # The listing already filters by the same indexes. Do not
+                # mess with the contentFilter, check the items one by one
+                allowed_query = None
+            else:
+                contentFilterTemp.update(allowed_query)
+        batching = allowed_query is not None and self.pagesize > 0
+        if batching and hasattr(self.contentsMethod, '_catalog') \
+                and contentFilterTemp.get('sort_on'):
+            # Only sort the items up to the current page
+            contentFilterTemp['sort_limit'] = idxfrom + self.pagesize + 1
         # Check for 'and'/'or' logic queries
         if (hasattr(self, 'And') and self.And) \
                 or (hasattr(self, 'Or') and self.Or):
@@ -1168,6 +1329,16 @@ class BikaListingView(BrowserView):
         else:
             brains = self.contentsMethod(contentFilterTemp)
 
+        if allowed_query is not None:
+            # All brains are allowed. The total (before sort_limit is applied)
+            # is known and only the brains from the current page are needed.
+            # Lazy results are sliced without creating the brains in between
+            self.total_items = getattr(brains, 'actual_result_count',
+                                       len(brains))
+            if not batching:
+                return brains[idxfrom:]
+            return brains[idxfrom:idxfrom + self.pagesize + 1]
+
         # Return a subset of results, if necessary
         if idxfrom and len(brains) > idxfrom:
             return brains[idxfrom:]
@@ -1200,7 +1371,7 @@ class BikaListingView(BrowserView):
         results = []
         self.show_more = False
         brains = self._fetch_brains(self.limit_from)
-        for obj in brains:
+        for position, obj in enumerate(brains, self.limit_from):
             # avoid creating unnecessary info for items outside the current
             # batch;  only the path is needed for the "select all" case...
             # we only take allowed items into account
@@ -1373,6 +1544,8 @@ class BikaListingView(BrowserView):
             if item:
                 results.append(item)
                 idx += 1
+                if self.folderitem_hook:
+                    self.folderitem_hook(item, position)
 
         # Need manual_sort?
         # Note that the order has already been set in contentFilter, so
@@ -1427,14 +1600,259 @@ class BikaListingView(BrowserView):
         data = self.render_items(self.context)
         return data
 
-    def get_transitions_for_items(self, items):
-        """Extract Worfklow transitions for the bika listing items
+    def encode_cursor(self, cursor):
+        """Returns the cursor passed in as a string, safe to be used in urls
+        """
+        return base64.urlsafe_b64encode(json.dumps(cursor))
+
+    def decode_cursor(self, cursor):
+        """Returns the cursor encoded with encode_cursor as a dict
+        """
+        if not cursor:
+            return {}
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(str(cursor)))
+        except (TypeError, ValueError):
+            logger.warning("Invalid cursor for {}: {}".format(
+                self.form_id, cursor))
+            return {}
+        # Catalogs keep the strings encoded as utf-8
+        if isinstance(cursor.get('value'), unicode):
+            cursor['value'] = to_utf8(cursor['value'])
+        return cursor
+
+    def get_cursor_sort_index(self):
+        """Returns the name of the index items are sorted by, if the listing
+        can be paginated by the values of this index. Otherwise, returns None
+        and pagination is done by offset
+        """
+        sort_on = self.contentFilter.get('sort_on', None)
+        if not sort_on or self.manual_sort_on:
+            return None
+        if sort_on in self.get_filter_bar_queryaddition():
+            # The index is already used for filtering
+            return None
+        # The query for the sort index already set in the contentFilter must
+        # be a range, so it can be narrowed down by the cursor
+        if sort_on in self.contentFilter \
+                and self.get_cursor_query(sort_on, None) is None:
+            return None
+        if not hasattr(self, 'contentsMethod'):
+            self.contentsMethod = getToolByName(self.context, self.catalog)
+        # Only FieldIndexes keep the values as they are. Others, like
+        # DateIndexes, round them, so the value of the last item listed
+        # would not tell which items come after it
+        catalog = getattr(self.contentsMethod, '_catalog', None)
+        index = catalog and catalog.indexes.get(sort_on)
+        if getattr(index, 'meta_type', None) != 'FieldIndex':
+            return None
+        # The value of the last item listed is taken from the metadata
+        if sort_on not in self.contentsMethod.schema():
+            return None
+        return sort_on
+
+    def get_cursor_query(self, sort_on, value):
+        """Returns the query for the sort index that restricts the items to
+        those from the value passed in, merged with the range for the index
+        from the contentFilter, if any. If value is None, the range from the
+        contentFilter is returned as is. Returns None if the query of the
+        contentFilter for the index is not a range
+        """
+        desc = self.contentFilter.get('sort_order') == 'descending'
+        bound = desc and 'max' or 'min'
+        query = self.contentFilter.get(sort_on, None)
+        limits = {}
+        if query is not None:
+            if not isinstance(query, dict):
+                return None
+            ranges = query.get('range', '').split(':')
+            values = query.get('query')
+            if not isinstance(values, (list, tuple)):
+                values = [values]
+            if not set(ranges) <= set(['min', 'max']) \
+                    or len(ranges) != len(values):
+                return None
+            limits = dict(zip(ranges, values))
+        current = limits.get(bound)
+        if value is not None:
+            if current is None or (desc and value < current) \
+                    or (not desc and value > current):
+                limits[bound] = value
+        if not limits:
+            return None
+        ranges = filter(lambda name: name in limits, ['min', 'max'])
+        values = map(limits.get, ranges)
+        if len(values) == 1:
+            values = values[0]
+        return {'query': values, 'range': ':'.join(ranges)}
+
+    def apply_cursor(self, cursor):
+        """Restricts the query of the listing so it starts from the position
+        of the cursor passed in. Cursors store either the value of the sort
+        index from the last item listed along with the UIDs of the items
+        listed with the same value, an offset, or both
+        :returns: the list of UIDs to be skipped
+        """
+        self.limit_from = cursor.get('offset', 0)
+        if 'value' not in cursor:
+            return []
+        sort_on = self.get_cursor_sort_index()
+        if sort_on != cursor.get('index'):
+            return []
+        query = self.get_cursor_query(sort_on, cursor['value'])
+        if query is None:
+            return []
+        self.contentFilter[sort_on] = query
+        return cursor.get('uids', [])
+
+    def get_next_cursor(self, cursor, items, next_offset=None):
+        """Returns the cursor that points to the item after the last item
+        from the items passed in. When paginated by offset, next_offset is the
+        position of the brain that follows the one of the last item, so the
+        items discarded by isItemAllowed are not listed twice
+        """
+        sort_on = self.get_cursor_sort_index()
+        value = None
+        if sort_on and 'offset' not in cursor:
+            value = self.get_cursor_value(items[-1]['obj'], sort_on)
+        if not isinstance(value, (basestring, int, long, float)):
+            # Values that cannot be stored in the cursor as they are (e.g.
+            # missing values) are paginated by offset from then on, within
+            # the items after the value of the cursor, if any
+            if next_offset is None:
+                next_offset = cursor.get('offset', 0) + len(items)
+            next_cursor = dict(cursor)
+            next_cursor['offset'] = next_offset
+            return next_cursor
+        next_cursor = {'index': sort_on, 'value': value, 'uids': []}
+        if cursor.get('value') == value:
+            # Keep skipping the items with the same value from the last page
+            next_cursor['uids'] = cursor.get('uids', [])
+        next_cursor['uids'].extend([
+            item['uid'] for item in items
+            if self.get_cursor_value(item['obj'], sort_on) == value])
+        return next_cursor
+
+    def get_cursor_value(self, brain_or_object, sort_on):
+        """Returns the value of the sort index for the item passed in, from
+        the metadata of the catalog of the listing
+        """
+        if api.is_brain(brain_or_object):
+            return getattr(brain_or_object, sort_on, None)
+        catalog = self.contentsMethod
+        rid = catalog.getrid(api.get_path(brain_or_object))
+        if rid is None:
+            return None
+        metadata = catalog.getMetadataForRID(rid) or {}
+        return metadata.get(sort_on)
+
+    def to_json_item(self, item):
+        """Returns a dict with the values of the item that can be serialized
+        to JSON. Only the columns rendered are included
         """
         out = {}
+        columns = self.get_visible_columns()
+        for key in item.keys() + columns:
+            if key in ['obj'] or key in out:
+                continue
+            value = item.get(key, '')
+            if isinstance(value, DateTime):
+                value = value.ISO8601()
+            out[key] = value
+        return out
+
+    def stream_items(self):
+        """Writes the items of the current page into the response as
+        newline-delimited JSON, as soon as each one is computed.
+
+        Pages are set with <form_id>_pagesize and <form_id>_cursor. Each line
+        is a JSON object with a "type" key:
 
-        # extract all objects from the items
-        for obj in map(get_object, [item.get('obj') for item in items]):
-            for transition in get_transitions_for(obj):
+        - "item": an item of the listing, in "item"
+        - "transitions": the transitions available for the items of the page
+        - "page": the last line, with the "cursor" to be used to get the next
+          page (if "more" is true) and the "total" number of items, if known
+          (first page only)
+
+        Pages are delimited by the values of the sort index (keyset
+        pagination), so deep pages cost the same as the first one. Listings
+        sorted manually or by indexes other than FieldIndexes (e.g. dates) are
+        paginated by the position of the brains, and their items are written
+        in the order of the brains.
+
+        Items are written as folderitem returns them (see folderitem_hook), so
+        the changes done by folderitems overrides to the whole list of items
+        once the loop is done are not included.
+        """
+        response = self.request.response
+        response.setHeader("Content-Type", "application/x-ndjson")
+
+        def write(data):
+            response.write(json.dumps(data, default=str) + "\n")
+
+        cursor = self.decode_cursor(
+            self.request.get(self.form_id + "_cursor", ""))
+        skip_uids = self.apply_cursor(cursor)
+        page_size = self.pagesize
+        if page_size > 0:
+            # Fetch one more item to know if there are more pages
+            self.pagesize = page_size + len(skip_uids) + 1
+
+        page = {"items": [], "more": False, "next_offset": None,
+                "hooked": False}
+
+        def hook(item, position):
+            page["hooked"] = True
+            if write_item(item):
+                page["next_offset"] = position + 1
+
+        def write_item(item):
+            if item.get("uid") in skip_uids:
+                return False
+            if page_size > 0 and len(page["items"]) >= page_size:
+                page["more"] = True
+                return False
+            page["items"].append(item)
+            write({"type": "item", "item": self.to_json_item(item)})
+            return True
+
+        self.folderitem_hook = hook
+        try:
+            items = self.folderitems()
+        finally:
+            self.folderitem_hook = None
+        if not page["hooked"]:
+            # The listing builds its items without folderitem
+            map(write_item, items)
+        items = page["items"]
+        more = page["more"]
+
+        # Transitions are computed once for the whole page
+        self.items = items
+        write({"type": "transitions",
+               "transitions": self.get_workflow_actions()})
+
+        next_cursor = ""
+        if more and items:
+            next_cursor = self.encode_cursor(
+                self.get_next_cursor(cursor, items, page["next_offset"]))
+        # The total is only known for the first page: next pages are
+        # restricted to the items after the cursor
+        write({"type": "page",
+               "cursor": next_cursor,
+               "more": more,
+               "total": None if cursor else self.total_items})
+        return ""
+
+    def get_transitions_for_items(self, items):
+        """Extract Worfklow transitions for the bika listing items. Items in
+        the same states are resolved together, so only one object is woken up
+        per group (see bika.lims.workflow.listing)
+        """
+        out = {}
+        objs = [item.get('obj') for item in items]
+        for transitions in resolve_transitions(objs).values():
+            for transition in transitions:
                 # append the transition by its id to the transitions dictionary
                 out[transition['id']] = transition
         return out
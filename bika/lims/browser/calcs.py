@@ -6,23 +6,24 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import json
-import math
 import plone
 
 from zope.component import adapts
 from zope.component import getAdapters
 from zope.interface import implements
 
-from Products.Archetypes.config import REFERENCE_CATALOG
 from Products.CMFCore.utils import getToolByName
 from Products.PythonScripts.standard import html_quote
 
+from bika.lims import api
 from bika.lims import bikaMessageFactory as _
 from bika.lims.browser import BrowserView
 from bika.lims.interfaces import IAnalysis
 from bika.lims.interfaces import IFieldIcons
+from bika.lims.utils import dicts_to_dict
 from bika.lims.utils import t, isnumber
 from bika.lims.utils.analysis import format_numeric_result
+from bika.lims.utils.calculation import CalculationEngine
 
 
 class CalculationResultAlerts(object):
@@ -72,17 +73,106 @@ class ajaxCalculateAnalysisEntry(BrowserView):
         self.context = context
         self.request = request
 
-    def calculate(self, uid=None):
-        analysis = self.analyses[uid]
+    def setup(self):
+        """Reads the values of the form and looks up its analyses
+        """
+        self.spec = self.request.get('specification', None)
+
+        self.current_results = json.loads(self.request.get('results'))
+        self.form_results = json.loads(self.request.get('results'))
+        self.item_data = json.loads(self.request.get('item_data'))
+
+        # these get sent back the the javascript
+        self.alerts = {}
+        self.uncertainties = []
+        self.results = []
+
+        # lookups done once per request, for all the analyses of the form
+        self.specifications = {}
+        self.dry_analyses = {}
+        self.dry_service_uid = None
+
+        self.analyses = {}
+        uc = getToolByName(self.context, 'uid_catalog')
+        for brain in uc(UID=self.current_results.keys()):
+            analysis = brain.getObject()
+            if analysis:
+                self.analyses[brain.UID] = analysis
+        # ignore these analyses if objects no longer exist
+        self.ignore_uids = filter(lambda uid: uid not in self.analyses,
+                                  self.current_results.keys())
+
+    def get_specification(self, analysis):
+        """Returns the results range of the analysis from its Analysis
+        Request, or None. The ranges are read once per request
+        """
+        if api.get_portal_type(analysis) != 'Analysis':
+            return None
+        parent = analysis.aq_parent
+        key = api.get_uid(parent)
+        specifications = self.specifications.get(key)
+        if specifications is None:
+            specifications = dicts_to_dict(parent.getResultsRange(),
+                                           'keyword')
+            self.specifications[key] = specifications
+        return specifications.get(analysis.getKeyword())
+
+    def get_dry_analysis(self, analysis):
+        """Returns the Dry Matter analysis of the Analysis Request of the
+        analysis, or None
+        """
+        if self.dry_service_uid is None:
+            dry_service = self.context.bika_setup.getDryMatterService()
+            self.dry_service_uid = dry_service and dry_service.UID() or ''
+        parent = analysis.aq_parent
+        key = api.get_uid(parent)
+        if key not in self.dry_analyses:
+            dry_analysis = [a for a in parent.getAnalyses(full_objects=True)
+                            if a.getServiceUID() == self.dry_service_uid]
+            self.dry_analyses[key] = dry_analysis and dry_analysis[0] or None
+        return self.dry_analyses[key]
+
+    def get_interim_mapping(self, uid, deps):
+        """Returns the values of the interim fields from the form for the
+        analysis and the analyses it depends on, or None if an interim of
+        the analysis is blank
+        """
+        mapping = {}
+        for i_uid in [uid] + deps.keys():
+            for i in self.item_data.get(i_uid, []):
+                # if this interim belongs to current analysis and is blank,
+                # return an empty result for this analysis.
+                if i_uid == uid and i['value'] == '':
+                    return None
+                # All interims must be float, or they are ignored.
+                try:
+                    i['value'] = float(i['value'])
+                except:
+                    pass
+
+                # all interims are ServiceKeyword.InterimKeyword
+                if i_uid in deps:
+                    key = "%s.%s" % (deps[i_uid].getKeyword(),
+                                     i['keyword'])
+                    mapping[key] = i['value']
+                # this analysis' interims get extra reference
+                # without service keyword prefix
+                if uid == i_uid:
+                    mapping[i['keyword']] = i['value']
+        return mapping
+
+    def calculate(self, node):
+        """Calculates the result of the analysis of the node with the values
+        from the form. Returns True if the analyses that depend on it have
+        to be calculated too
+        """
+        uid = node.uid
+        analysis = node.analysis
         form_result = self.current_results[uid]['result']
-        calculation = analysis.getCalculation()
-        if analysis.portal_type == 'ReferenceAnalysis':
-            deps = {}
-        else:
-            deps = {}
-            for dep in analysis.getDependencies():
-                deps[dep.UID()] = dep
-        path = '++resource++bika.lims.images'
+        calculation = node.calculation
+        deps = {}
+        for dependency in node.dependencies:
+            deps[dependency.uid] = dependency.analysis
         mapping = {}
 
         # values to be returned to form for this UID
@@ -149,39 +239,19 @@ class ajaxCalculateAnalysisEntry(BrowserView):
                     unsatisfied = True
                     break
 
-            if unsatisfied:
+            # Add all interims to mapping
+            interims = None
+            if not unsatisfied:
+                interims = self.get_interim_mapping(uid, deps)
+
+            if interims is None:
                 # unsatisfied means that one or more result on which we depend
                 # is blank or unavailable, so we set blank result and abort.
                 self.results.append({'uid': uid,
                                      'result': '',
                                      'formatted_result': ''})
-                return None
-
-            # Add all interims to mapping
-            for i_uid, i_data in self.item_data.items():
-                for i in i_data:
-                    # if this interim belongs to current analysis and is blank,
-                    # return an empty result for this analysis.
-                    if i_uid == uid and i['value'] == '':
-                        self.results.append({'uid': uid,
-                                             'result': '',
-                                             'formatted_result': ''})
-                        return None
-                    # All interims must be float, or they are ignored.
-                    try:
-                        i['value'] = float(i['value'])
-                    except:
-                        pass
-
-                    # all interims are ServiceKeyword.InterimKeyword
-                    if i_uid in deps:
-                        key = "%s.%s" % (deps[i_uid].getKeyword(),
-                                         i['keyword'])
-                        mapping[key] = i['value']
-                    # this analysis' interims get extra reference
-                    # without service keyword prefix
-                    if uid == i_uid:
-                        mapping[i['keyword']] = i['value']
+                return False
+            mapping.update(interims)
 
             # Grab values for hidden InterimFields for only for current calculation
             # we can't allow non-floats through here till we change the eval's
@@ -204,58 +274,30 @@ class ajaxCalculateAnalysisEntry(BrowserView):
                     except ValueError:
                         pass
 
-            # convert formula to a valid python string, ready for interpolation
+            # calculate
             formula = calculation.getMinifiedFormula()
-            formula = formula.replace('[', '%(').replace(']', ')f')
-            try:
-                formula = eval("'%s'%%mapping" % formula,
-                               {"__builtins__": None,
-                                'math': math,
-                                'context': self.context},
-                               {'mapping': mapping})
-                # calculate
-                result = eval(formula, calculation._getGlobals())
+            result = self.engine.evaluate(node, mapping)
+            if node.exception is None:
                 Result['result'] = result
                 self.current_results[uid]['result'] = result
-            except TypeError as e:
-                # non-numeric arguments in interim mapping?
-                alert = {'field': 'Result',
-                         'icon': path + '/exclamation.png',
-                         'msg': "{0}: {1} ({2}) ".format(
-                             t(_("Type Error")),
-                             html_quote(str(e.args[0])),
-                             formula)}
-                if uid in self.alerts:
-                    self.alerts[uid].append(alert)
-                else:
-                    self.alerts[uid] = [alert, ]
-            except ZeroDivisionError as e:
+            elif isinstance(node.exception, ZeroDivisionError):
                 Result['result'] = '0/0'
                 Result['formatted_result'] = '0/0'
                 self.current_results[uid]['result'] = '0/0'
                 self.results.append(Result)
-                alert = {'field': 'Result',
-                         'icon': path + '/exclamation.png',
-                         'msg': "{0}: {1} ({2}) ".format(
-                             t(_("Division by zero")),
-                             html_quote(str(e.args[0])),
-                             formula)}
-                if uid in self.alerts:
-                    self.alerts[uid].append(alert)
-                else:
-                    self.alerts[uid] = [alert, ]
-                return None
-            except KeyError as e:
-                alert = {'field': 'Result',
-                         'icon': path + '/exclamation.png',
-                         'msg': "{0}: {1} ({2}) ".format(
-                             t(_("Key Error")),
-                             html_quote(str(e.args[0])),
-                             formula)}
-                if uid in self.alerts:
-                    self.alerts[uid].append(alert)
-                else:
-                    self.alerts[uid] = [alert, ]
+                self.add_formula_alert(uid, _("Division by zero"),
+                                       node.exception, formula)
+                return False
+            elif isinstance(node.exception, TypeError):
+                # non-numeric arguments in interim mapping?
+                self.add_formula_alert(uid, _("Type Error"),
+                                       node.exception, formula)
+            elif isinstance(node.exception, KeyError):
+                self.add_formula_alert(uid, _("Key Error"),
+                                       node.exception, formula)
+            else:
+                self.add_formula_alert(uid, _("Import Error"),
+                                       node.exception, formula)
 
         # format result
         try:
@@ -270,18 +312,15 @@ class ajaxCalculateAnalysisEntry(BrowserView):
             analysis.aq_parent.getReportDryMatter() and \
             analysis.getReportDryMatter()
         if dm:
-            dry_service = self.context.bika_setup.getDryMatterService()
-            # get the UID of the DryMatter Analysis from our parent AR
-            dry_analysis = [a for a in
-                            analysis.aq_parent.getAnalyses(full_objects=True)
-                            if a.getServiceUID() == dry_service.UID()]
+            # get the DryMatter Analysis from our parent AR
+            dry_analysis = self.get_dry_analysis(analysis)
             if dry_analysis:
-                dry_analysis = dry_analysis[0]
                 dry_uid = dry_analysis.UID()
                 # get the current DryMatter analysis result from the form
                 if dry_uid in self.current_results:
                     try:
-                        dry_result = float(self.current_results[dry_uid])
+                        dry_result = float(
+                            self.current_results[dry_uid]['result'])
                     except:
                         dm = False
                 else:
@@ -319,71 +358,77 @@ class ajaxCalculateAnalysisEntry(BrowserView):
             if not (belowldl or aboveudl):
                 self.uncertainties.append({'uid': uid, 'uncertainty': unc})
 
-        # maybe a service who depends on us must be recalculated.
-        if analysis.portal_type == 'ReferenceAnalysis':
-            dependents = []
-        else:
-            dependents = analysis.getDependents()
-        if dependents:
-            for dependent in dependents:
-                dependent_uid = dependent.UID()
-                # ignore analyses that no longer exist.
-                if dependent_uid in self.ignore_uids or \
-                   dependent_uid not in self.analyses:
-                    continue
-                self.calculate(dependent_uid)
-
         # These self.alerts are just for the json return.
         # we're placing the entire form's results in kwargs.
+        kwargs = {'form_results': self.current_results}
+        specification = self.get_specification(analysis)
+        if specification:
+            kwargs['specification'] = specification
         adapters = getAdapters((analysis, ), IFieldIcons)
         for name, adapter in adapters:
-            alerts = adapter(result=Result['result'], form_results=self.current_results)
+            alerts = adapter(result=Result['result'], **kwargs)
             if alerts:
-                if analysis.UID() in self.alerts:
-                    self.alerts[analysis.UID()].extend(alerts[analysis.UID()])
+                if uid in self.alerts:
+                    self.alerts[uid].extend(alerts[uid])
                 else:
-                    self.alerts[analysis.UID()] = alerts[analysis.UID()]
+                    self.alerts[uid] = alerts[uid]
+
+        # maybe a service who depends on us must be recalculated.
+        return True
+
+    def add_formula_alert(self, uid, title, exception, formula):
+        alert = {'field': 'Result',
+                 'icon': '++resource++bika.lims.images/exclamation.png',
+                 'msg': "{0}: {1} ({2}) ".format(
+                     t(title),
+                     html_quote(str(exception.args[0])),
+                     formula)}
+        if uid in self.alerts:
+            self.alerts[uid].append(alert)
+        else:
+            self.alerts[uid] = [alert, ]
+
+    def is_form_analysis(self, analysis):
+        """Returns whether the analysis is in the form and still exists
+        """
+        uid = analysis.UID()
+        return uid in self.analyses and uid not in self.ignore_uids
+
+    def recalculate(self, uids):
+        """Calculates the analyses with the UIDs passed in, then the analyses
+        of the form that depend on them, each one after all the analyses it
+        depends on. Each analysis is calculated once
+        """
+        self.engine = CalculationEngine()
+        reached = []
+        for uid in uids:
+            if uid not in self.analyses:
+                continue
+            trigger = self.engine.add(self.analyses[uid])
+            self.engine.add_dependents(trigger, accept=self.is_form_analysis)
+            reached.append(trigger.uid)
+        for node in self.engine.sort():
+            if node.uid not in reached:
+                continue
+            if self.calculate(node):
+                reached.extend([dep.uid for dep in node.dependents])
 
     def __call__(self):
-        self.rc = getToolByName(self.context, REFERENCE_CATALOG)
         plone.protect.CheckAuthenticator(self.request)
         plone.protect.PostOnly(self.request)
 
-        self.spec = self.request.get('specification', None)
-
         # information about the triggering element
         uid = self.request.get('uid')
         self.field = self.request.get('field')
         self.value = self.request.get('value')
 
-        self.current_results = json.loads(self.request.get('results'))
-        form_results = json.loads(self.request.get('results'))
-        self.item_data = json.loads(self.request.get('item_data'))
-
-        # these get sent back the the javascript
-        self.alerts = {}
-        self.uncertainties = []
-        self.results = []
-
-        self.services = {}
-        self.analyses = {}
-        # ignore these analyses if objects no longer exist
-        self.ignore_uids = []
-
-        for analysis_uid, result in self.current_results.items():
-            analysis = self.rc.lookupObject(analysis_uid)
-            if not analysis:
-                self.ignore_uids.append(analysis_uid)
-                continue
-            self.analyses[analysis_uid] = analysis
-
-        if uid not in self.ignore_uids:
-            self.calculate(uid)
+        self.setup()
+        self.recalculate([uid])
 
         results = []
         for result in self.results:
-            if result['uid'] in form_results.keys() and \
-               result['result'] != form_results[result['uid']]:
+            if result['uid'] in self.form_results.keys() and \
+               result['result'] != self.form_results[result['uid']]:
                 results.append(result)
 
         return json.dumps({'alerts': self.alerts,
@@ -391,6 +436,59 @@ class ajaxCalculateAnalysisEntry(BrowserView):
                            'results': results})
 
 
+class ajaxCalculateAnalysisEntries(ajaxCalculateAnalysisEntry):
+    """Recalculates the results of a form for a batch of changes at once.
+
+    Expects the same 'results' and 'item_data' as listing_string_entry, plus
+    'changes', a JSON list of [uid, field, value]. The values of interim
+    fields are applied to item_data, while the values of results are read
+    from 'results', where the detection limits are already resolved.
+
+    Each analysis affected by the changes is calculated once, and all the
+    analyses calculated are returned with their alerts and uncertainties,
+    whether their result differs from the form or not.
+    """
+
+    def get_changes(self):
+        """Returns the list of (uid, field, value) from the request
+        """
+        changes = []
+        for change in json.loads(self.request.get('changes', '[]')):
+            if isinstance(change, dict):
+                change = (change.get('uid'), change.get('field'),
+                          change.get('value'))
+            uid, field, value = change
+            changes.append((uid, field, value))
+        return changes
+
+    def apply_change(self, uid, field, value):
+        """Sets the value of the interim field to the form's item_data
+        """
+        for interim in self.item_data.get(uid, []):
+            if interim.get('keyword') == field:
+                interim['value'] = value
+                break
+
+    def __call__(self):
+        plone.protect.CheckAuthenticator(self.request)
+        plone.protect.PostOnly(self.request)
+
+        self.setup()
+        changed = []
+        for uid, field, value in self.get_changes():
+            if field != 'Result':
+                self.apply_change(uid, field, value)
+            if uid not in changed:
+                changed.append(uid)
+        self.recalculate(changed)
+
+        # Every recalculated analysis is sent back, even if its result did
+        # not change, so its dry result, formatted result and checkbox are
+        # refreshed in the form too
+        return json.dumps({'alerts': self.alerts,
+                           'uncertainties': self.uncertainties,
+                           'results': self.results})
+
 class ajaxGetMethodCalculation(BrowserView):
     """ Returns the calculation assigned to the defined method.
         uid: unique identifier of the method
@@ -18,6 +18,7 @@ from plone import protect
 
 from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
+from bika.lims.api import count
 from bika.lims.api import get_tool
 from bika.lims.browser import BrowserView
 from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
@@ -354,7 +355,7 @@ class DashboardView(BrowserView):
         results = 0
         ratio = 0
         if total > 0:
-            results = len(catalog(criterias))
+            results = count(criterias, catalog=catalog.getId())
             results = results if total >= results else total
             ratio = (float(results)/float(total))*100 if results > 0 else 0
         ratio = str("%%.%sf" % 1) % ratio
@@ -382,7 +383,7 @@ class DashboardView(BrowserView):
         query = self._update_criteria_with_filters(query, 'analysisrequests')
 
         # Active Analysis Requests (All)
-        total = len(catalog(query))
+        total = count(query, catalog=catalog.getId())
 
         # Sampling workflow enabled?
         if (self.context.bika_setup.getSamplingWorkflowEnabled()):
@@ -490,7 +491,7 @@ class DashboardView(BrowserView):
         query = self._update_criteria_with_filters(query, 'worksheets')
 
         # Active Worksheets (all)
-        total = len(bc(query))
+        total = count(query, catalog=bc.getId())
 
         # Open worksheets
         name = _('Results pending')
@@ -553,7 +554,7 @@ class DashboardView(BrowserView):
         query = self._update_criteria_with_filters(query, 'analyses')
 
         # Active Analyses (All)
-        total = len(bc(query))
+        total = count(query, catalog=bc.getId())
 
         # Analyses to be assigned
         name = _('Assignment pending')
@@ -618,7 +619,7 @@ class DashboardView(BrowserView):
         query = self._update_criteria_with_filters(query, 'samples')
 
         # Active Samples (All)
-        total = len(catalog(query))
+        total = count(query, catalog=catalog.getId())
 
         # Sampling workflow enabled?
         if self.context.bika_setup.getSamplingWorkflowEnabled():
@@ -5,11 +5,10 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
-import itertools
-
 from AccessControl import ClassSecurityInfo
 from bika.lims import api, deprecated, logger
 from bika.lims.catalog import CATALOG_ANALYSIS_LISTING
+from bika.lims.dependencygraph import get_service_dependencies
 from bika.lims.interfaces import IAnalysis, IAnalysisService, IARAnalysesField
 from bika.lims.permissions import ViewRetractedAnalyses
 from bika.lims.utils.analysis import create_analysis
@@ -139,11 +138,15 @@ class ARAnalysesField(ObjectField):
         # Convert the items to a valid list of AnalysisServices
         services = filter(None, map(self._to_service, items))
 
-        # Calculate dependencies
-        # FIXME Infinite recursion error possible here, if the formula includes
-        #       the Keyword of the Service that includes the Calculation
-        dependencies = map(lambda s: s.getServiceDependencies(), services)
-        dependencies = list(itertools.chain.from_iterable(dependencies))
+        # Calculate dependencies, from the dependency graph
+        service_uids = map(api.get_uid, services)
+        dependency_uids = set()
+        for service_uid in service_uids:
+            dependency_uids.update(get_service_dependencies(service_uid))
+        dependency_uids.difference_update(service_uids)
+        dependencies = map(lambda uid: api.get_object_by_uid(uid, None),
+                           dependency_uids)
+        dependencies = filter(None, dependencies)
 
         # Merge dependencies and services
         services = set(services + dependencies)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from DateTime import DateTime
+from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from plone import protect
+
+from bika.lims import bikaMessageFactory as _
+from bika.lims.catalog import query_log
+from bika.lims.decorators import returns_json
+
+# Valid sort keys for the worst offenders
+SORT_KEYS = ['total', 'max', 'count', 'average']
+
+
+class SlowQueriesView(BrowserView):
+    """Lists the catalog queries that took longer than the threshold set in
+    the registry, aggregated by catalog and queried indexes
+    """
+    template = ViewPageTemplateFile("templates/slow_queries.pt")
+
+    def __call__(self):
+        self.request.set('disable_plone.rightcolumn', 1)
+        self.request.set('disable_border', 1)
+
+        form = self.request.form
+        if form.get("submitted", False) and form.get("clear", False):
+            protect.CheckAuthenticator(form)
+            query_log.clear_query_log()
+            message = _("Slow-query log cleared")
+            self.context.plone_utils.addPortalMessage(message, "info")
+        return self.template()
+
+    @property
+    def sort_on(self):
+        sort_on = self.request.form.get("sort_on", "total")
+        return sort_on in SORT_KEYS and sort_on or "total"
+
+    @property
+    def limit(self):
+        try:
+            return int(self.request.form.get("limit", 50))
+        except ValueError:
+            return 50
+
+    def threshold(self):
+        return query_log.get_slow_query_threshold()
+
+    def offenders(self):
+        return query_log.get_worst_offenders(limit=self.limit,
+                                             sort_on=self.sort_on)
+
+    def recent(self):
+        return query_log.get_slow_queries(limit=self.limit)
+
+    def format_time(self, timestamp):
+        return DateTime(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    @returns_json
+    def json(self):
+        """Returns the worst offenders and the most recent slow queries
+        """
+        return {
+            "threshold": self.threshold(),
+            "sort_on": self.sort_on,
+            "offenders": self.offenders(),
+            "recent": self.recent(),
+        }
@@ -6,6 +6,7 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 from Products.CMFCore.utils import getToolByName
+from bika.lims import api
 from bika.lims.browser import BrowserView
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from bika.lims import bikaMessageFactory as _
@@ -98,6 +99,9 @@ class Report(BrowserView):
                    'class': '',
         }
 
+        # Number of analyses per service, counted straight from the indexes
+        counts = api.group_count(query, 'getServiceUID', catalog=bc.getId())
+
         datalines = []
         count_all = 0
         for cat in sc(portal_type="AnalysisCategory",
@@ -109,9 +113,7 @@ class Report(BrowserView):
             for service in sc(portal_type="AnalysisService",
                               getCategoryUID=cat.UID,
                               sort_on='sortable_title'):
-                query['getServiceUID'] = service.UID
-                analyses = bc(query)
-                count_analyses = len(analyses)
+                count_analyses = counts.get(service.UID, 0)
 
                 dataline = []
                 dataitem = {'value': service.Title}
@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from DateTime import DateTime
+from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from plone import protect
+
+from bika.lims import bikaMessageFactory as _
+from bika.lims.decorators import returns_json
+from bika.lims.workflow import taskqueue
+
+
+class TaskQueueView(BrowserView):
+    """Lists the pending and failed tasks of the queue of the work that
+    follows the transitions, and allows to retry or discard the failed ones
+    """
+    template = ViewPageTemplateFile("templates/task_queue.pt")
+
+    def __call__(self):
+        self.request.set('disable_plone.rightcolumn', 1)
+        self.request.set('disable_border', 1)
+
+        form = self.request.form
+        if form.get("submitted", False):
+            protect.CheckAuthenticator(form)
+            if form.get("retry", False):
+                count = taskqueue.retry_failed()
+                message = _("${count} failed tasks queued again",
+                            mapping={"count": count})
+                self.context.plone_utils.addPortalMessage(message, "info")
+            elif form.get("clear", False):
+                count = taskqueue.clear_failed()
+                message = _("${count} failed tasks discarded",
+                            mapping={"count": count})
+                self.context.plone_utils.addPortalMessage(message, "info")
+        return self.template()
+
+    @property
+    def limit(self):
+        try:
+            return int(self.request.form.get("limit", 50))
+        except ValueError:
+            return 50
+
+    def enabled(self):
+        return taskqueue.is_task_queue_enabled()
+
+    def stats(self):
+        return taskqueue.get_stats()
+
+    def pending(self):
+        return taskqueue.get_tasks(taskqueue.PENDING_KEY, limit=self.limit)
+
+    def failed(self):
+        return taskqueue.get_tasks(taskqueue.FAILED_KEY, limit=self.limit)
+
+    def format_time(self, timestamp):
+        if not timestamp:
+            return ""
+        return DateTime(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    @returns_json
+    def json(self):
+        """Returns the stats and the oldest pending and failed tasks
+        """
+        return {
+            "enabled": self.enabled(),
+            "stats": self.stats(),
+            "pending": self.pending(),
+            "failed": self.failed(),
+        }
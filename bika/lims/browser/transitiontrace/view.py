@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from DateTime import DateTime
+from Products.Five import BrowserView
+from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
+from plone import protect
+
+from bika.lims import bikaMessageFactory as _
+from bika.lims.decorators import returns_json
+from bika.lims.workflow import trace
+
+# Valid sort keys for the slowest transitions
+SORT_KEYS = ['total', 'max', 'count', 'average'] + trace.PHASES
+
+
+class SlowTransitionsView(BrowserView):
+    """Lists the timing of the transitions, aggregated by portal type and
+    transition, and the most recent requests in which transitions were done
+    """
+    template = ViewPageTemplateFile("templates/slow_transitions.pt")
+
+    def __call__(self):
+        self.request.set('disable_plone.rightcolumn', 1)
+        self.request.set('disable_border', 1)
+
+        form = self.request.form
+        if form.get("submitted", False) and form.get("clear", False):
+            protect.CheckAuthenticator(form)
+            trace.clear_traces()
+            message = _("Transition timings cleared")
+            self.context.plone_utils.addPortalMessage(message, "info")
+        return self.template()
+
+    @property
+    def sort_on(self):
+        sort_on = self.request.form.get("sort_on", "total")
+        return sort_on in SORT_KEYS and sort_on or "total"
+
+    @property
+    def limit(self):
+        try:
+            return int(self.request.form.get("limit", 50))
+        except ValueError:
+            return 50
+
+    def enabled(self):
+        return trace.get_registry_value(
+            trace.TRANSITION_TRACE_REGISTRY_KEY, False)
+
+    def phases(self):
+        return trace.PHASES
+
+    def slowest(self):
+        return trace.get_slowest_transitions(limit=self.limit,
+                                             sort_on=self.sort_on)
+
+    def traces(self):
+        return trace.get_traces(limit=self.limit)
+
+    def format_time(self, timestamp):
+        return DateTime(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+    @returns_json
+    def json(self):
+        """Returns the slowest transitions and the most recent traces, with
+        their trees of transitions
+        """
+        return {
+            "enabled": self.enabled(),
+            "sort_on": self.sort_on,
+            "slowest": self.slowest(),
+            "traces": self.traces(),
+        }
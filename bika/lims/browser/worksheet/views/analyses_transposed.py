@@ -5,10 +5,8 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
-from Products.CMFCore.utils import getToolByName
 from Products.Five.browser.pagetemplatefile import ViewPageTemplateFile
 from bika.lims import PMF, logger
-from bika.lims.api import get_object
 from bika.lims.browser.bika_listing import BikaListingTable
 from bika.lims.browser.worksheet.views.analyses import AnalysesView
 from bika.lims.utils import t
@@ -121,14 +119,9 @@ class AnalysesTransposedTable(BikaListingTable):
         if not self.bika_listing.show_select_column:
             return []
 
-        workflow = getToolByName(self.context, 'portal_workflow')
         # get all transitions for all items.
-        transitions = {}
+        transitions = self.bika_listing.get_transitions_for_items(self.items)
         actions = []
-        for obj in [i.get('obj', '') for i in self.items]:
-            obj = get_object(obj)
-            for it in workflow.getTransitionsFor(obj):
-                transitions[it['id']] = it
 
         # the list is restricted to and ordered by these transitions.
         if 'transitions' in self.bika_listing.review_state:
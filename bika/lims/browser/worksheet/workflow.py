@@ -22,6 +22,7 @@ from bika.lims.permissions import EditResults, ManageWorksheets
 from bika.lims.subscribers import doActionFor
 from bika.lims.subscribers import skip
 from bika.lims.utils import isActive
+from bika.lims.workflow.bulk import defer_promotions
 from plone.protect import CheckAuthenticator
 
 
@@ -204,86 +205,90 @@ class WorksheetWorkflowAction(WorkflowAction):
             else:
                 item_data = json.loads(form['item_data'])
 
-        # Iterate for each selected analysis and save its data as needed
-        for uid, analysis in selected.items():
-
-            allow_edit = sm.checkPermission(EditResults, analysis)
-            analysis_active = isActive(analysis)
-
-            # Need to save remarks?
-            if uid in remarks and allow_edit and analysis_active:
-                analysis.setRemarks(remarks[uid])
-
-            # Retested?
-            if uid in retested and allow_edit and analysis_active:
-                analysis.setRetested(retested[uid])
-
-            # Need to save the instrument?
-            if uid in instruments and analysis_active:
-                # TODO: Add SetAnalysisInstrument permission
-                # allow_setinstrument = sm.checkPermission(SetAnalysisInstrument)
-                allow_setinstrument = True
-                # ---8<-----
-                if allow_setinstrument == True:
-                    # The current analysis allows the instrument regards
-                    # to its analysis service and method?
-                    if (instruments[uid]==''):
-                        previnstr = analysis.getInstrument()
-                        if previnstr:
-                            previnstr.removeAnalysis(analysis)
-                        analysis.setInstrument(None);
-                    elif analysis.isInstrumentAllowed(instruments[uid]):
-                        previnstr = analysis.getInstrument()
-                        if previnstr:
-                            previnstr.removeAnalysis(analysis)
-                        analysis.setInstrument(instruments[uid])
-                        instrument = analysis.getInstrument()
-                        instrument.addAnalysis(analysis)
-                        if analysis.meta_type == 'ReferenceAnalysis':
-                            instrument.setDisposeUntilNextCalibrationTest(False)
-
-            # Need to save the method?
-            if uid in methods and analysis_active:
-                # TODO: Add SetAnalysisMethod permission
-                # allow_setmethod = sm.checkPermission(SetAnalysisMethod)
-                allow_setmethod = True
-                # ---8<-----
-                if allow_setmethod == True and analysis.isMethodAllowed(methods[uid]):
-                    analysis.setMethod(methods[uid])
-
-            # Need to save the analyst?
-            if uid in analysts and analysis_active:
-                analysis.setAnalyst(analysts[uid]);
-
-            # Need to save the uncertainty?
-            if uid in uncertainties and analysis_active:
-                analysis.setUncertainty(uncertainties[uid])
-
-            # Need to save the detection limit?
-            if analysis_active and uid in dlimits and dlimits[uid]:
-                analysis.setDetectionLimitOperand(dlimits[uid])
-
-            # Need to save results?
-            if uid in results and results[uid] and allow_edit \
-                and analysis_active:
-                interims = item_data.get(uid, [])
-                analysis.setInterimFields(interims)
-                analysis.setResult(results[uid])
-                analysis.reindexObject()
-
-                can_submit = True
-                deps = analysis.getDependencies() \
-                        if hasattr(analysis, 'getDependencies') else []
-                for dependency in deps:
-                    if workflow.getInfoFor(dependency, 'review_state') in \
-                       ('to_be_sampled', 'to_be_preserved',
-                        'sample_due', 'sample_received'):
-                        can_submit = False
-                        break
-                if can_submit:
-                    # doActionFor transitions the analysis to verif pending,
-                    # so must only be done when results are submitted.
-                    doActionFor(analysis, 'submit')
+        # Iterate for each selected analysis and save its data as needed. The
+        # submission of the analyses is promoted to the worksheet once all of
+        # them have been submitted (see bika.lims.workflow.bulk)
+        with defer_promotions():
+            for uid, analysis in selected.items():
+
+                allow_edit = sm.checkPermission(EditResults, analysis)
+                analysis_active = isActive(analysis)
+
+                # Need to save remarks?
+                if uid in remarks and allow_edit and analysis_active:
+                    analysis.setRemarks(remarks[uid])
+
+                # Retested?
+                if uid in retested and allow_edit and analysis_active:
+                    analysis.setRetested(retested[uid])
+
+                # Need to save the instrument?
+                if uid in instruments and analysis_active:
+                    # TODO: Add SetAnalysisInstrument permission
+                    # allow_setinstrument = sm.checkPermission(SetAnalysisInstrument)
+                    allow_setinstrument = True
+                    # ---8<-----
+                    if allow_setinstrument == True:
+                        # The current analysis allows the instrument regards
+                        # to its analysis service and method?
+                        if (instruments[uid]==''):
+                            previnstr = analysis.getInstrument()
+                            if previnstr:
+                                previnstr.removeAnalysis(analysis)
+                            analysis.setInstrument(None);
+                        elif analysis.isInstrumentAllowed(instruments[uid]):
+                            previnstr = analysis.getInstrument()
+                            if previnstr:
+                                previnstr.removeAnalysis(analysis)
+                            analysis.setInstrument(instruments[uid])
+                            instrument = analysis.getInstrument()
+                            instrument.addAnalysis(analysis)
+                            if analysis.meta_type == 'ReferenceAnalysis':
+                                instrument.setDisposeUntilNextCalibrationTest(False)
+
+                # Need to save the method?
+                if uid in methods and analysis_active:
+                    # TODO: Add SetAnalysisMethod permission
+                    # allow_setmethod = sm.checkPermission(SetAnalysisMethod)
+                    allow_setmethod = True
+                    # ---8<-----
+                    if allow_setmethod == True and analysis.isMethodAllowed(methods[uid]):
+                        analysis.setMethod(methods[uid])
+
+                # Need to save the analyst?
+                if uid in analysts and analysis_active:
+                    analysis.setAnalyst(analysts[uid]);
+
+                # Need to save the uncertainty?
+                if uid in uncertainties and analysis_active:
+                    analysis.setUncertainty(uncertainties[uid])
+
+                # Need to save the detection limit?
+                if analysis_active and uid in dlimits and dlimits[uid]:
+                    analysis.setDetectionLimitOperand(dlimits[uid])
+
+                # Need to save results?
+                if uid in results and results[uid] and allow_edit \
+                    and analysis_active:
+                    interims = item_data.get(uid, [])
+                    analysis.setInterimFields(interims)
+                    analysis.setResult(results[uid])
+                    analysis.reindexObject()
+
+                    can_submit = True
+                    deps = analysis.getDependencies() \
+                            if hasattr(analysis, 'getDependencies') else []
+                    for dependency in deps:
+                        if workflow.getInfoFor(dependency, 'review_state') in \
+                           ('to_be_sampled', 'to_be_preserved',
+                            'sample_due', 'sample_received'):
+                            can_submit = False
+                            break
+                    if can_submit:
+                        # doActionFor transitions the analysis to verif
+                        # pending, so must only be done when results are
+                        # submitted.
+                        doActionFor(analysis, 'submit')
 
         # Maybe some analyses need to be retracted due to a QC failure
         # Done here because don't know if the last selected analysis is
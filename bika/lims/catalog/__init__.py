@@ -22,6 +22,8 @@ from .report_catalog import BikaCatalogReport
 from .catalog_utilities import getCatalogDefinitions
 from .catalog_utilities import setup_catalogs
 from .catalog_utilities import getCatalog
+from .reindex_queue import queue_reindex
+from .reindex_queue import flush_reindex_queue
 
 # --Some important information:--
 #
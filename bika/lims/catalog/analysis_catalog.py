@@ -90,7 +90,6 @@ _columns_list = [
     'getMethodUID',
     'getMethodTitle',
     'getMethodURL',
-    'getAllowedMethodUIDs',
     'getAnalyst',
     'getAnalystName',
     'getNumberOfRequiredVerifications',
@@ -101,13 +100,14 @@ _columns_list = [
     'getLastVerificator',
     'getIsReflexAnalysis',
     'getPrioritySortkey',
-    # TODO-performance: All that comes from services could be
-    # defined as a service metacolumn instead of an analysis one
     'getResultOptions',
-    'getServiceUID',
     'getDepartmentUID',
+    'getManualEntryOfResults',
     'getInstrumentEntryOfResults',
-    'getAllowedInstrumentUIDs',
+    # The methods and instruments allowed, that come from the service, are
+    # not stored as metadata, but got from bika.lims.catalog.service_info by
+    # using getServiceUID
+    'getServiceUID',
     'getInstrumentUID',
     'getResultsRange',
     'getSampleTypeUID',
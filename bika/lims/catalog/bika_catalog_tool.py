@@ -6,14 +6,18 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import sys
+import time
 import traceback
 from AccessControl import ClassSecurityInfo
 from Products.CMFCore.permissions import ManagePortal
+from Products.CMFCore.permissions import SearchZCatalog
 from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.CatalogTool import CatalogTool
 from Products.ZCatalog.ZCatalog import ZCatalog
 import transaction
 from bika.lims import logger
+from bika.lims.catalog import query_log
+from bika.lims.catalog.reindex_queue import flush_reindex_queue
 
 
 class BikaCatalogTool(CatalogTool):
@@ -24,6 +28,8 @@ class BikaCatalogTool(CatalogTool):
     security = ClassSecurityInfo()
     _properties = ({'id': 'title', 'type': 'string', 'mode': 'w'},)
     plone_tool = 1
+    # Queries slower than the threshold set in the registry are logged
+    _log_slow_queries = True
 
     def __init__(self, id, title, portal_meta_type):
         self.portal_type = portal_meta_type
@@ -32,6 +38,27 @@ class BikaCatalogTool(CatalogTool):
         self.counter = None
         ZCatalog.__init__(self, id)
 
+    def searchResults(self, REQUEST=None, **kw):
+        """Calls CatalogTool.searchResults and logs the query if it takes
+        longer than the threshold. See bika.lims.catalog.query_log
+        """
+        # Objects of this catalog whose reindex has been deferred until the
+        # commit are reindexed first, so the results are up to date
+        flush_reindex_queue(self)
+        start = time.time()
+        results = CatalogTool.searchResults(self, REQUEST, **kw)
+        elapsed = time.time() - start
+        query_log.log_query(self, query_log.get_query(REQUEST, **kw),
+                            elapsed, getattr(results, 'actual_result_count',
+                                             None))
+        return results
+
+    security.declareProtected(SearchZCatalog, 'searchResults')
+
+    __call__ = searchResults
+
+    security.declareProtected(SearchZCatalog, '__call__')
+
     def clearFindAndRebuild(self):
         """Empties catalog, then finds all contentish objects (i.e. objects
            with an indexObject method), and reindexes them.
@@ -112,3 +139,14 @@ class BikaCatalogTool(CatalogTool):
         logger.info('%s cleaned and rebuilt' % self.id)
 
     security.declareProtected(ManagePortal, 'softClearFindAndRebuild')
+
+    def getRebuildProgress(self):
+        """Returns a dict with the progress of the chunked rebuild of this
+        catalog that is currently running (or that was interrupted), if any.
+        See bika.lims.catalog.parallel_rebuild
+        """
+        from bika.lims.catalog.parallel_rebuild import get_progress
+        return get_progress(self)
+
+    security.declareProtected(ManagePortal, 'getRebuildProgress')
+
@@ -6,7 +6,11 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import copy
+import transaction
+from Missing import MV
 from Products.CMFCore.utils import getToolByName
+from plone.indexer.interfaces import IIndexableObject
+from zope.component import queryMultiAdapter
 # Bika LIMS imports
 from bika.lims import logger
 from bika.lims.catalog.analysisrequest_catalog import\
@@ -50,10 +54,10 @@ def getCatalog(instance, field='UID'):
     :type instance: ATContentType
     :returns: The first catalog that stores the type of object passed in
     """
+    from bika.lims.workflow.skiplist import get_skiplist
     uid = instance.UID()
-    if 'workflow_skiplist' in instance.REQUEST and \
-        [x for x in instance.REQUEST['workflow_skiplist']
-         if x.find(uid) > -1]:
+    skiplist = get_skiplist(instance.REQUEST, create=False)
+    if skiplist is not None and skiplist.has_uid(uid):
         return None
     else:
         # grab the first catalog we are indexed in.
@@ -65,6 +69,126 @@ def getCatalog(instance, field='UID'):
         catalog = getToolByName(plone, catalog_name)
         return catalog
 
+def partial_reindex(obj, idxs, columns):
+    """
+    Reindexes only the indexes and metadata columns passed in for the object,
+    in all the catalogs the object is cataloged in. Unlike reindexObject,
+    the rest of metadata columns are not recomputed. Indexes and columns that
+    do not exist in a given catalog are dismissed.
+    If the object is not cataloged yet, it is fully cataloged.
+    :param obj: the object to be reindexed
+    :param idxs: list of index ids
+    :param columns: list of metadata column ids
+    """
+    # Import here to prevent circular imports
+    from bika.lims import api
+    path = '/'.join(obj.getPhysicalPath())
+    for catalog in api.get_catalogs_for(obj):
+        if isinstance(catalog, basestring):
+            catalog = api.get_tool(catalog)
+        catalog_data = catalog._catalog
+        rid = catalog_data.uids.get(path, None)
+        if rid is None:
+            catalog.catalog_object(obj, path)
+            continue
+        indexes = [idx for idx in idxs if idx in catalog_data.indexes]
+        if indexes:
+            # Note an empty list of indexes means all indexes
+            catalog.catalog_object(obj, path, idxs=indexes,
+                                   update_metadata=0)
+        cols = [col for col in columns if col in catalog_data.schema]
+        if cols:
+            wrapper = _get_indexable_object(obj, catalog)
+            _update_metadata_columns(catalog, rid, wrapper, cols)
+
+
+def _get_indexable_object(obj, catalog):
+    """
+    Returns the object wrapped as CatalogTool.catalog_object does, so values
+    computed by plone.indexer adapters are used
+    """
+    wrapper = queryMultiAdapter((obj, catalog), IIndexableObject)
+    return wrapper is not None and wrapper or obj
+
+
+def _update_metadata_columns(catalog, rid, wrapper, columns):
+    """
+    Updates in place the values of the metadata columns passed in for the
+    record with the rid passed in, leaving the rest of columns untouched
+    """
+    catalog_data = catalog._catalog
+    schema = catalog_data.schema
+    record = list(catalog_data.data[rid])
+    for col in columns:
+        value = getattr(wrapper, col, MV)
+        if callable(value):
+            value = value()
+        record[schema[col]] = value
+    catalog_data.data[rid] = tuple(record)
+
+
+def migrate_catalog(catalog, indexes=(), columns=(), batch_size=1000,
+                    commit=True):
+    """
+    Fills the indexes and metadata columns passed in for all the objects
+    already cataloged, without recataloging them. Meant to be used after
+    adding new indexes or columns to a catalog, instead of a full rebuild.
+    Objects are processed in batches and a commit is done after each batch,
+    or a savepoint if commit is False (e.g. within a GenericSetup import
+    step, which must not commit).
+    The records are walked through from a snapshot of the rids taken before
+    the first batch, so records cataloged or uncataloged by other
+    transactions meanwhile are neither skipped nor processed twice.
+    :param catalog: the catalog object
+    :param indexes: ids of the indexes to be filled
+    :param columns: ids of the metadata columns to be filled
+    :param batch_size: number of objects to be processed before commit
+    :param commit: whether to commit after each batch
+    :returns: the number of objects processed
+    """
+    catalog_data = catalog._catalog
+    indexes = [catalog_data.getIndex(idx) for idx in indexes
+               if idx in catalog_data.indexes]
+    columns = [col for col in columns if col in catalog_data.schema]
+    if not indexes and not columns:
+        return 0
+
+    total = len(catalog)
+    logger.info("Migrating {}: {} objects, indexes {}, columns {}".format(
+        catalog.id, total, [idx.getId() for idx in indexes], columns))
+    counter = 0
+    rids = list(catalog_data.paths.keys())
+    for rid in rids:
+        path = catalog_data.paths.get(rid, None)
+        if path is None:
+            # Uncataloged after the snapshot of the rids was taken
+            continue
+        obj = catalog.unrestrictedTraverse(path, None)
+        if obj is None:
+            logger.warning("Cannot migrate {}: object not found"
+                           .format(path))
+            continue
+        wrapper = _get_indexable_object(obj, catalog)
+        for index in indexes:
+            index.index_object(rid, wrapper)
+        if columns:
+            _update_metadata_columns(catalog, rid, wrapper, columns)
+        counter += 1
+        if counter % batch_size == 0:
+            if commit:
+                transaction.commit()
+            else:
+                transaction.savepoint(optimistic=True)
+            # Do not keep all objects walked through in the cache
+            catalog._p_jar.cacheGC()
+            logger.info("Progress: {}/{} objects migrated for {}"
+                        .format(counter, total, catalog.id))
+    if commit:
+        transaction.commit()
+    logger.info("{} migrated: {} objects".format(catalog.id, counter))
+    return counter
+
+
 def setup_catalogs(
         portal, catalogs_definition={},
         force_reindex=False, catalogs_extension={}, force_no_reindex=False):
@@ -73,6 +197,9 @@ def setup_catalogs(
     catalogs and then checks the indexes and metacolumns, if one index/column
     doesn't exist in the catalog_definition any more it will be
     removed, otherwise, if a new index/column is found, it will be created.
+    Catalogs with changes in the types mapping are rebuilt from scratch, but
+    for catalogs with new indexes or columns only those are filled (see
+    migrate_catalog).
 
     :param portal: The Plone's Portal object
     :param catalogs_definition: a dictionary with the following structure
@@ -114,17 +241,29 @@ def setup_catalogs(
     clean_and_rebuild = _map_content_types(archetype_tool, definition)
 
     # Indexing
+    to_migrate = {}
     for cat_id in definition.keys():
-        reindex = False
-        reindex = _setup_catalog(
-            portal, cat_id, definition.get(cat_id, {}))
-        if (reindex or force_reindex) and (cat_id not in clean_and_rebuild):
+        added = _setup_catalog(portal, cat_id, definition.get(cat_id, {}))
+        if force_reindex and (cat_id not in clean_and_rebuild):
             # add the catalog if it has not been added before
             clean_and_rebuild.append(cat_id)
+        elif added['indexes'] or added['columns']:
+            to_migrate[cat_id] = added
     # Reindex the catalogs which needs it
     if not force_no_reindex:
         _cleanAndRebuildIfNeeded(portal, clean_and_rebuild)
-    return clean_and_rebuild
+        # Only fill the new indexes and columns of the catalogs that have not
+        # been rebuilt from scratch
+        for cat_id, added in to_migrate.items():
+            if cat_id in clean_and_rebuild:
+                continue
+            catalog = getToolByName(portal, cat_id)
+            # Called from import steps, where the transaction is committed
+            # by GenericSetup
+            migrate_catalog(catalog, indexes=added['indexes'],
+                            columns=added['columns'], commit=False)
+    return clean_and_rebuild + [cat_id for cat_id in to_migrate.keys()
+                                if cat_id not in clean_and_rebuild]
 
 def _merge_catalog_definitions(dict1, dict2):
     """
@@ -255,40 +394,39 @@ def _setup_catalog(portal, catalog_id, catalog_definition):
                 ...
             ]
         }
+    :returns: a dict with the ids of the indexes and columns that have been
+        added, that need to be filled: {'indexes': [...], 'columns': [...]}
+        Removed indexes and columns don't need any further action.
     """
 
-    reindex = False
+    added = {'indexes': [], 'columns': []}
     catalog = getToolByName(portal, catalog_id, None)
     if catalog is None:
         logger.warning('Could not find the %s tool.' % (catalog_id))
-        return False
+        return added
     # Indexes
     indexes_ids = catalog_definition.get('indexes', {}).keys()
     # Indexing
     for idx in indexes_ids:
         # The function returns if the index needs to be reindexed
-        indexed = _addIndex(catalog, idx, catalog_definition['indexes'][idx])
-        reindex = True if indexed else reindex
+        if _addIndex(catalog, idx, catalog_definition['indexes'][idx]):
+            added['indexes'].append(idx)
     # Removing indexes
     in_catalog_idxs = catalog.indexes()
     to_remove = list(set(in_catalog_idxs)-set(indexes_ids))
     for idx in to_remove:
-        # The function returns if the index has been deleted
-        desindexed = _delIndex(catalog, idx)
-        reindex = True if desindexed else reindex
+        _delIndex(catalog, idx)
     # Columns
     columns_ids = catalog_definition.get('columns', [])
     for col in columns_ids:
-        created = _addColumn(catalog, col)
-        reindex = True if created else reindex
+        if _addColumn(catalog, col):
+            added['columns'].append(col)
     # Removing columns
     in_catalog_cols = catalog.schema()
     to_remove = list(set(in_catalog_cols)-set(columns_ids))
     for col in to_remove:
-        # The function returns if the index has been deleted
-        desindexed = _delColumn(catalog, col)
-        reindex = True if desindexed else reindex
-    return reindex
+        _delColumn(catalog, col)
+    return added
 
 
 def _addIndex(catalog, index, indextype):
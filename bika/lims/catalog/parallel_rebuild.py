@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Chunked and resumable rebuild of Bika catalogs, with the computation of the
+index and metadata values split across several worker processes.
+
+The UIDs of the objects to be cataloged (as registered in uid_catalog) are
+sorted and split in chunks of contiguous, half-open UID ranges: each chunk
+goes from its first UID up to the first UID of the next chunk (excluded), so
+objects created while the rebuild takes place fall in one chunk too. The plan
+(the chunks) and the chunks already loaded are stored in the catalog itself,
+so a rebuild that has been interrupted can be resumed later.
+
+Workers only read from the database: they compute the values of all indexes
+and metadata columns of the objects of their chunks and drop them as pickle
+files in a spool directory. A single writer loads these files into the
+catalog, commits and checkpoints after each chunk. This way, the writer is
+the only one that writes into the catalog and no conflicts arise.
+
+The site stays live while the catalog is rebuilt. Each record keeps the
+serial (last transaction) of its object when it was computed, so the writer
+catalogs again the objects modified since from their current values, and
+skips the objects removed since, instead of loading stale values.
+
+See bika/lims/scripts/rebuild-catalog.py for the command line entry point.
+"""
+
+import cPickle
+import os
+import subprocess
+import time
+
+import transaction
+from Acquisition import aq_base
+from DateTime import DateTime
+from Products.CMFCore.utils import getToolByName
+from Products.CMFPlone.CatalogTool import CatalogTool
+from persistent.list import PersistentList
+from persistent.mapping import PersistentMapping
+from plone.indexer.interfaces import IIndexableObject
+from zope.component import queryMultiAdapter
+
+from bika.lims import logger
+
+# Name of the catalog's attribute where the rebuild plan is stored
+CHECKPOINT_ATTR = '_rebuild_checkpoint'
+
+# Default number of objects per chunk
+DEFAULT_CHUNK_SIZE = 1000
+
+# Marker for objects whose values could not be pickled and that have to be
+# cataloged directly by the writer
+DIRECT = 'direct'
+
+
+class CatalogRecord(object):
+    """Stand-in for a content object with the values of indexes and metadata
+    columns already computed. Catalogs and indexes only rely on getattr, so
+    they can catalog this object as if it was the original one
+    """
+
+    def __init__(self, path, values):
+        self._path = tuple(path)
+        self._values = values
+
+    def getPhysicalPath(self):
+        return self._path
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def get_catalog_types(catalog):
+    """Returns the portal types mapped to the catalog passed in
+    """
+    at = getToolByName(catalog, 'archetype_tool')
+    return [k for k, v in at.catalog_map.items() if catalog.id in v]
+
+
+def get_source_names(catalog):
+    """Returns the attribute names catalog indexes and metadata columns read
+    from the objects
+    """
+    names = set(catalog.schema())
+    for index in catalog.getIndexObjects():
+        getter = getattr(index, 'getIndexSourceNames', None)
+        names.update(getter and getter() or [index.getId()])
+    return sorted(names)
+
+
+def get_checkpoint(catalog):
+    """Returns the rebuild plan stored in the catalog, if any
+    """
+    return getattr(catalog, CHECKPOINT_ATTR, None)
+
+
+def clear_checkpoint(catalog):
+    """Removes the rebuild plan stored in the catalog
+    """
+    if get_checkpoint(catalog) is not None:
+        delattr(catalog, CHECKPOINT_ATTR)
+
+
+def get_progress(catalog):
+    """Returns a dict with the progress of the current rebuild of the catalog
+    """
+    checkpoint = get_checkpoint(catalog)
+    if checkpoint is None:
+        return {}
+    chunks = len(checkpoint['chunks'])
+    done = len(checkpoint['done'])
+    return {
+        'catalog': catalog.id,
+        'started': checkpoint['started'],
+        'chunks': chunks,
+        'chunks_done': done,
+        'objects': checkpoint['total'],
+        'objects_done': checkpoint['loaded'],
+        'percent': chunks and (done * 100 / chunks) or 100,
+    }
+
+
+def plan_rebuild(catalog, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Splits the UIDs of the objects to be cataloged in chunks of contiguous
+    UID ranges, clears the catalog and stores the plan in the catalog. Each
+    chunk is a (start, end) tuple, with the end excluded. The end of the last
+    chunk is None
+    :returns: the checkpoint with the plan
+    """
+    uid_catalog = getToolByName(catalog, 'uid_catalog')
+    brains = uid_catalog(portal_type=get_catalog_types(catalog))
+    uids = sorted([brain.UID for brain in brains])
+    starts = uids[::chunk_size]
+    if starts:
+        starts[0] = ''
+    chunks = PersistentList(zip(starts, starts[1:] + [None]))
+
+    catalog.manage_catalogClear()
+    checkpoint = PersistentMapping({
+        'started': DateTime(),
+        'chunks': chunks,
+        'done': PersistentList(),
+        'total': len(uids),
+        'loaded': 0,
+    })
+    setattr(catalog, CHECKPOINT_ATTR, checkpoint)
+    logger.info("Rebuild of {} planned: {} objects in {} chunks".format(
+        catalog.id, len(uids), len(chunks)))
+    return checkpoint
+
+
+def get_chunk_objects(catalog, chunk):
+    """Returns the objects from the catalog's types within the UID range
+    """
+    uid_catalog = getToolByName(catalog, 'uid_catalog')
+    start, end = chunk
+    uid_query = {'query': start, 'range': 'min'}
+    if end is not None:
+        uid_query = {'query': [start, end], 'range': 'min:max'}
+    query = {
+        'portal_type': get_catalog_types(catalog),
+        'UID': uid_query,
+    }
+    for brain in uid_catalog(query):
+        if brain.UID == end:
+            # Ranges of the catalog include the end, chunks do not
+            continue
+        obj = brain.getObject()
+        if obj is not None:
+            yield obj
+
+
+def get_serial(obj):
+    """Returns the serial of the object, the id of the transaction where it
+    was modified for the last time
+    """
+    obj._p_activate()
+    return obj._p_serial
+
+
+def compute_record(catalog, obj, names):
+    """Computes the values for all the source names passed in for the object
+    :returns: a (path, uid, values, serial) tuple
+    """
+    wrapper = obj
+    if isinstance(catalog, CatalogTool):
+        # Same wrapping as CatalogTool.catalog_object, so plone.indexer's
+        # adapters (allowedRolesAndUsers, object_provides, ...) are used
+        adapted = queryMultiAdapter((obj, catalog), IIndexableObject)
+        if adapted is not None:
+            wrapper = adapted
+    values = {}
+    for name in names:
+        try:
+            value = getattr(wrapper, name)
+            if callable(value):
+                value = value()
+        except (AttributeError, TypeError):
+            # Indexes and catalog treat missing attributes as missing values
+            continue
+        values[name] = value
+    return obj.getPhysicalPath(), obj.UID(), values, get_serial(obj)
+
+
+def compute_chunk(catalog, chunk):
+    """Computes the records of all objects within the chunk passed in. Records
+    that cannot be pickled are replaced by a (DIRECT, uid) tuple, so the
+    writer catalogs the original object instead
+    """
+    names = get_source_names(catalog)
+    records = []
+    for obj in get_chunk_objects(catalog, chunk):
+        path, uid, values, serial = compute_record(catalog, obj, names)
+        try:
+            cPickle.dumps(values, cPickle.HIGHEST_PROTOCOL)
+        except (cPickle.PicklingError, TypeError):
+            records.append((DIRECT, uid))
+            continue
+        records.append((path, uid, values, serial))
+    return records
+
+
+def get_spool_file(spool_dir, catalog, num):
+    return os.path.join(spool_dir, '{}-{:06d}.pickle'.format(catalog.id, num))
+
+
+def run_worker(catalog, spool_dir, worker=0, workers=1):
+    """Computes the records of the pending chunks assigned to this worker and
+    writes them in the spool directory. The worker never writes in the
+    database. Each chunk is written atomically (written in a temporary file
+    and renamed afterwards), so the writer never reads incomplete chunks
+    """
+    checkpoint = get_checkpoint(catalog)
+    if checkpoint is None:
+        logger.error("No rebuild planned for {}".format(catalog.id))
+        return 0
+    done = set(checkpoint['done'])
+    computed = 0
+    for num, chunk in enumerate(checkpoint['chunks']):
+        if num % workers != worker or num in done:
+            continue
+        filename = get_spool_file(spool_dir, catalog, num)
+        if os.path.exists(filename):
+            continue
+        records = compute_chunk(catalog, chunk)
+        with open(filename + '.tmp', 'wb') as spool:
+            cPickle.dump(records, spool, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+        computed += 1
+        logger.info("Worker {}/{}: chunk {} of {} computed ({} objects)"
+                    .format(worker + 1, workers, num, catalog.id,
+                            len(records)))
+        # Do not keep the loaded objects in the cache of the connection
+        transaction.abort()
+        catalog._p_jar.cacheGC()
+    return computed
+
+
+def get_current_object(catalog, path, uid):
+    """Returns the object with the path and UID passed in, looked up by UID
+    if it has been moved, or None if it no longer exists
+    """
+    obj = path and catalog.unrestrictedTraverse(path, None) or None
+    # Do not take the UID acquired from the container of a missing object
+    if obj is not None and getattr(aq_base(obj), 'UID', None) is not None \
+            and obj.UID() == uid:
+        return obj
+    uid_catalog = getToolByName(catalog, 'uid_catalog')
+    brains = uid_catalog(UID=uid)
+    return brains and brains[0].getObject() or None
+
+
+def load_records(catalog, records):
+    """Bulk-loads the records computed by the workers into the catalog. The
+    objects removed after their record was computed are skipped, and the
+    ones modified or moved since are cataloged from their current values
+    :returns: the number of objects cataloged
+    """
+    idxs = catalog.indexes()
+    cataloged = 0
+    for record in records:
+        if record[0] == DIRECT:
+            path, uid, values, serial = None, record[1], None, None
+        else:
+            path, uid, values, serial = record
+        obj = get_current_object(catalog, path, uid)
+        if obj is None:
+            # Removed after the record was computed
+            continue
+        if serial is None or obj.getPhysicalPath() != tuple(path) or \
+                get_serial(obj) != serial:
+            catalog.catalog_object(obj, idxs=idxs, update_metadata=True)
+        else:
+            # Bypass CatalogTool.catalog_object: values are already computed
+            catalog._catalog.catalogObject(
+                CatalogRecord(path, values), '/'.join(path), idxs=idxs,
+                update_metadata=1)
+        cataloged += 1
+    return cataloged
+
+
+def run_writer(catalog, spool_dir, poll=5, workers=None):
+    """Loads the chunks computed by the workers into the catalog, as soon as
+    they are available in the spool directory. A commit is done after each
+    chunk, along with the update of the checkpoint
+    :param workers: list of worker processes to be monitored, if any. The
+        writer gives up if all of them finished and chunks are still missing
+    :returns: True if all chunks have been loaded
+    """
+    checkpoint = get_checkpoint(catalog)
+    if checkpoint is None:
+        logger.error("No rebuild planned for {}".format(catalog.id))
+        return False
+    pending = [num for num in range(len(checkpoint['chunks']))
+               if num not in checkpoint['done']]
+    while pending:
+        loaded = False
+        for num in pending[:]:
+            filename = get_spool_file(spool_dir, catalog, num)
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'rb') as spool:
+                records = cPickle.load(spool)
+            checkpoint['loaded'] += load_records(catalog, records)
+            checkpoint['done'].append(num)
+            transaction.commit()
+            os.remove(filename)
+            pending.remove(num)
+            loaded = True
+            progress = get_progress(catalog)
+            logger.info(
+                "Progress: {objects_done}/{objects} objects ({percent}%) "
+                "have been cataloged for {catalog}".format(**progress))
+        if loaded or not pending:
+            continue
+        if workers and all([w.poll() is not None for w in workers]):
+            logger.error("All workers finished, but {} chunks of {} are "
+                         "missing".format(len(pending), catalog.id))
+            return False
+        time.sleep(poll)
+    logger.info("{} rebuilt".format(catalog.id))
+    return True
+
+
+def spawn_workers(instance_script, script, site_id, catalog_id, spool_dir,
+                  workers):
+    """Starts the worker processes. Each worker runs in its own Zope client,
+    with its own (ZEO) connection to the database
+    :param instance_script: path to the Zope instance script (bin/instance)
+    :param script: path to the rebuild script to be run by the workers
+    """
+    processes = []
+    for worker in range(workers):
+        args = [instance_script, 'run', script, site_id, catalog_id,
+                '--worker', str(worker), '--workers', str(workers),
+                '--spool', spool_dir]
+        processes.append(subprocess.Popen(args))
+    return processes
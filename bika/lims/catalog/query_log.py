@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Slow-query log for Bika catalogs.
+
+Queries done through BikaCatalogTool.searchResults (and through api.search
+for the rest of catalogs) that take longer than the threshold set in the
+registry are recorded here, together with the query plan, the calling view
+and the elapsed time. The number of results each index returns on its own is
+recorded too if enabled in the registry: it is computed by querying each
+index again, which adds to the cost of the queries that are already slow.
+
+The log lives in memory, per Zope process. Besides the most recent slow
+queries, statistics are aggregated by catalog and query "shape" (the names of
+the indexes queried plus the sort index), so the worst offenders can be
+listed at @@slow_queries and @@slow_queries_json.
+"""
+
+import threading
+import time
+from collections import deque
+
+from plone.registry.interfaces import IRegistry
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+
+from bika.lims import logger
+
+# Registry record with the threshold (in seconds) above which a query is
+# considered slow. A value of zero or lower disables the log
+SLOW_QUERY_THRESHOLD_REGISTRY_KEY = 'bika.lims.catalog.slow_query_threshold'
+
+# Default threshold, in seconds
+DEFAULT_THRESHOLD = 1.0
+
+# Registry record that enables/disables the number of results of each index
+# in the query plan of slow queries
+SLOW_QUERY_INDEX_SIZES_REGISTRY_KEY = \
+    'bika.lims.catalog.slow_query_index_sizes'
+
+# Maximum number of slow queries kept in the log
+MAX_ENTRIES = 200
+
+# Maximum length of the representation of a query value
+MAX_VALUE_LENGTH = 200
+
+# Keys of a catalog query that are not indexes
+QUERY_OPTIONS = ['sort_on', 'sort_order', 'sort_limit', 'b_start', 'b_size']
+
+_lock = threading.Lock()
+_entries = deque(maxlen=MAX_ENTRIES)
+_stats = {}
+
+
+def get_registry_value(key, default):
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return default
+    value = registry.get(key, None)
+    if value is None:
+        return default
+    return value
+
+
+def get_slow_query_threshold():
+    """Returns the threshold in seconds above which a query is logged, as set
+    in the registry
+    """
+    return get_registry_value(SLOW_QUERY_THRESHOLD_REGISTRY_KEY,
+                              DEFAULT_THRESHOLD)
+
+
+def get_query(request=None, **kw):
+    """Returns a dict with the query, merged in the same way ZCatalog does
+    """
+    query = {}
+    if isinstance(request, dict):
+        query.update(request)
+    query.update(kw)
+    return query
+
+
+def get_caller():
+    """Returns a tuple (view name, url) of the current request
+    """
+    request = getRequest()
+    if request is None:
+        return '', ''
+    published = request.get('PUBLISHED', None)
+    name = getattr(published, '__name__', None)
+    if not name and published is not None:
+        name = getattr(published, '__class__', type(published)).__name__
+    return name or '', request.get('ACTUAL_URL', '')
+
+
+def get_query_plan(catalog, query, sizes=True):
+    """Returns the names of the indexes in the order the catalog evaluates
+    them for the query passed in, along with the number of results each index
+    returns on its own
+    :param sizes: whether to query each index to get its number of results
+    :returns: a list of (index name, number of results) tuples. The number of
+        results is None if it cannot be computed or sizes is False
+    """
+    _catalog = catalog._catalog
+    names = [key for key in query.keys()
+             if key not in QUERY_OPTIONS and key in _catalog.indexes]
+    try:
+        plan = _catalog.getCatalogPlan(query).plan() or []
+        names = [name for name in plan if name in names] + \
+                [name for name in names if name not in plan]
+    except Exception:
+        # Catalogs without query plans (Products.ZCatalog < 2.13)
+        names = sorted(names)
+
+    plan = []
+    for name in names:
+        size = None
+        if not sizes:
+            plan.append((name, size))
+            continue
+        try:
+            index = _catalog.getIndex(name)
+            result = index._apply_index({name: query[name]})
+            if result is not None:
+                size = len(result[0])
+        except Exception:
+            pass
+        plan.append((name, size))
+    return plan
+
+
+def get_query_key(catalog_id, query):
+    """Returns the key the statistics of the query passed in are aggregated
+    by: the catalog, the indexes queried and the sort index
+    """
+    indexes = sorted([key for key in query.keys() if key not in QUERY_OPTIONS])
+    return catalog_id, tuple(indexes), query.get('sort_on', '')
+
+
+def to_printable(query):
+    """Returns a copy of the query with all values converted to strings
+    """
+    printable = {}
+    for key, value in query.items():
+        value = repr(value)
+        if len(value) > MAX_VALUE_LENGTH:
+            value = value[:MAX_VALUE_LENGTH] + '...'
+        printable[key] = value
+    return printable
+
+
+def log_query(catalog, query, elapsed, num_results=None):
+    """Records the query passed in if the time it took is above the threshold
+    :param catalog: the catalog the query was done against
+    :param query: dict with the catalog query
+    :param elapsed: time in seconds the query took
+    :param num_results: number of results returned
+    :returns: the logged entry or None if the query is not slow
+    """
+    threshold = get_slow_query_threshold()
+    if threshold <= 0 or elapsed < threshold:
+        return None
+
+    view, url = get_caller()
+    catalog_id = catalog.getId()
+    sizes = get_registry_value(SLOW_QUERY_INDEX_SIZES_REGISTRY_KEY, False)
+    entry = {
+        'catalog': catalog_id,
+        'query': to_printable(query),
+        'plan': get_query_plan(catalog, query, sizes=sizes),
+        'elapsed': elapsed,
+        'results': num_results,
+        'view': view,
+        'url': url,
+        'time': time.time(),
+    }
+    logger.warning("Slow query ({:.3f}s) in {} from '{}': {}".format(
+        elapsed, catalog_id, view, entry['query']))
+
+    key = get_query_key(catalog_id, query)
+    with _lock:
+        _entries.append(entry)
+        stats = _stats.get(key, None)
+        if stats is None:
+            stats = {
+                'catalog': catalog_id,
+                'indexes': list(key[1]),
+                'sort_on': key[2],
+                'count': 0,
+                'total': 0.0,
+                'max': 0.0,
+                'views': {},
+            }
+            _stats[key] = stats
+        stats['count'] += 1
+        stats['total'] += elapsed
+        stats['max'] = max(stats['max'], elapsed)
+        stats['views'][view] = stats['views'].get(view, 0) + 1
+        stats['last'] = entry
+    return entry
+
+
+def search(catalog, query):
+    """Searches the catalog passed in and logs the query if slow. Catalogs
+    that already log their queries (BikaCatalogTool) are queried as usual
+    """
+    if getattr(catalog, '_log_slow_queries', False):
+        return catalog(query)
+    start = time.time()
+    results = catalog(query)
+    elapsed = time.time() - start
+    log_query(catalog, query, elapsed,
+              getattr(results, 'actual_result_count', None))
+    return results
+
+
+def get_slow_queries(limit=None):
+    """Returns the most recent slow queries, newest first
+    """
+    with _lock:
+        entries = list(_entries)
+    entries.reverse()
+    return entries[:limit]
+
+
+def get_worst_offenders(limit=None, sort_on='total'):
+    """Returns the statistics of slow queries, aggregated by catalog, indexes
+    queried and sort index
+    :param sort_on: 'total', 'max', 'count' or 'average'
+    """
+    with _lock:
+        stats = [dict(item) for item in _stats.values()]
+    for item in stats:
+        item['average'] = item['total'] / item['count']
+    stats.sort(key=lambda item: item.get(sort_on, 0), reverse=True)
+    return stats[:limit]
+
+
+def clear_query_log():
+    """Removes all the slow queries logged so far
+    """
+    with _lock:
+        _entries.clear()
+        _stats.clear()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+import time
+from collections import OrderedDict
+
+import transaction
+from Acquisition import aq_base
+from Acquisition import aq_parent
+from Products.CMFCore.utils import getToolByName
+from plone.registry.interfaces import IRegistry
+from zope.component import queryUtility
+
+from bika.lims import logger
+
+# Registry record that enables/disables the deferred reindexing. Useful to
+# compare the behavior of workflow cascades with and without the queue
+DEFERRED_REINDEX_REGISTRY_KEY = 'bika.lims.catalog.deferred_reindex'
+
+# Name of the attribute of the current transaction where the queue is stored
+_QUEUE_ATTR = '_bika_reindex_queue'
+
+
+class ReindexQueue(object):
+    """Keeps track of the objects that have to be reindexed before the
+    transaction this queue is bound to is committed.
+
+    Each object is only queued once: if the same object is queued more than
+    once, the indexes to be reindexed are merged. An empty list of indexes
+    means a full reindex (all indexes and metadata), that always wins over
+    a partial one.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        # id(aq_base(obj)) -> [obj, idxs], in the order objects were queued
+        self.queue = OrderedDict()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def add(self, obj, idxs=None):
+        """Adds the object passed in into the queue
+        :param obj: the object to be reindexed
+        :param idxs: the indexes to be reindexed. None or an empty list for
+            a full reindex
+        :returns: True if the object was not queued yet
+        """
+        key = id(aq_base(obj))
+        idxs = idxs and set(idxs) or None
+        entry = self.queue.get(key)
+        if entry is None:
+            self.queue[key] = [obj, idxs]
+            return True
+        # Always keep the last wrapper we've got
+        entry[0] = obj
+        if entry[1] is None or idxs is None:
+            # Full reindex wins
+            entry[1] = None
+        else:
+            entry[1].update(idxs)
+        return False
+
+    def remove(self, obj):
+        """Removes the object passed in from the queue, if queued
+        """
+        self.queue.pop(id(aq_base(obj)), None)
+
+    def get_portal_types(self):
+        """Returns the portal types of the queued objects
+        """
+        return set(map(lambda entry: getattr(entry[0], 'portal_type', None),
+                       self.queue.values()))
+
+    def pop(self):
+        """Returns the oldest queued (object, idxs) tuple and removes it from
+        the queue
+        """
+        key, (obj, idxs) = self.queue.popitem(last=False)
+        return obj, idxs and list(idxs) or []
+
+    def process(self):
+        """Reindexes all the queued objects. Objects queued while processing
+        (e.g. by reindexObject overrides) are processed too
+        :returns: the number of objects reindexed
+        """
+        processed = 0
+        while self.queue:
+            obj, idxs = self.pop()
+            if not is_alive(obj):
+                continue
+            obj.reindexObject(idxs=idxs)
+            processed += 1
+        return processed
+
+
+def is_alive(obj):
+    """Returns whether the object passed in is still stored in the container
+    it was acquired from. Objects deleted after being queued must not be
+    reindexed, otherwise they would be cataloged again
+    """
+    parent = aq_parent(obj)
+    if parent is None:
+        return False
+    try:
+        current = parent._getOb(obj.getId(), None)
+    except AttributeError:
+        return False
+    return aq_base(current) is aq_base(obj)
+
+
+def is_deferred_reindex_enabled():
+    """Returns whether reindexes are deferred until the transaction is about
+    to be committed, as set in the registry
+    """
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return False
+    return registry.get(DEFERRED_REINDEX_REGISTRY_KEY, True)
+
+
+def get_reindex_queue(create=True):
+    """Returns the reindex queue bound to the current transaction. If there is
+    no queue yet and create is True, a new queue is created and a before
+    commit hook that processes the queue is registered
+    """
+    txn = transaction.get()
+    queue = getattr(txn, _QUEUE_ATTR, None)
+    if queue is None and create:
+        queue = ReindexQueue()
+        setattr(txn, _QUEUE_ATTR, queue)
+        txn.addBeforeCommitHook(_before_commit, args=(queue,))
+    return queue
+
+
+def queue_reindex(obj, idxs=None):
+    """Reindexes the object passed in before the current transaction is
+    committed. If the same object is queued several times within the same
+    transaction, it will only be reindexed once. If deferred reindexing is
+    disabled, the object is reindexed immediately
+    :param obj: the object to be reindexed
+    :param idxs: the indexes to be reindexed. None for a full reindex
+    """
+    if not is_deferred_reindex_enabled():
+        obj.reindexObject(idxs=idxs or [])
+        return
+    get_reindex_queue().add(obj, idxs=idxs)
+
+
+def unqueue_reindex(obj):
+    """Removes the object passed in from the reindex queue of the current
+    transaction, if queued
+    """
+    queue = get_reindex_queue(create=False)
+    if queue is not None:
+        queue.remove(obj)
+
+
+def flush_reindex_queue(catalog=None):
+    """Reindexes right now all the objects queued in the current transaction.
+    Bika catalogs call this function before each search, with themselves as
+    the catalog, so searches never see stale values of queued objects. Call
+    it before querying other catalogs if the query relies on metadata or
+    indexes of queued objects
+    :param catalog: if set, the queue is only processed if any of the queued
+        objects is cataloged in this catalog
+    :returns: the number of objects reindexed
+    """
+    queue = get_reindex_queue(create=False)
+    if not queue:
+        return 0
+    if catalog is not None and not is_queued_in(queue, catalog):
+        return 0
+    return queue.process()
+
+
+def is_queued_in(queue, catalog):
+    """Returns whether any of the objects of the queue passed in is cataloged
+    in the catalog passed in
+    """
+    archetype_tool = getToolByName(catalog, 'archetype_tool', None)
+    if archetype_tool is None:
+        return True
+    catalog_id = catalog.getId()
+    catalog_map = archetype_tool.catalog_map
+    for portal_type in queue.get_portal_types():
+        if catalog_id in catalog_map.get(portal_type, []):
+            return True
+    return False
+
+
+def _before_commit(queue):
+    """Processes the queue passed in. Called right before the transaction is
+    committed
+    """
+    if not len(queue):
+        return
+    # Imported here to avoid circular imports with bika.lims.workflow
+    from bika.lims.workflow import trace
+    start = time.time()
+    processed = queue.process()
+    trace.add_timing("deferred_reindex", time.time() - start)
+    logger.debug("Deferred reindex: {} objects reindexed".format(processed))
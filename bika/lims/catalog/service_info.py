@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""In-memory cache of Analysis Service information used by listings.
+
+The methods and instruments allowed for an analysis are those assigned to its
+Analysis Service, which analyses do not copy. Instead of storing them as
+metadata columns for each analysis in bika_analysis_catalog, listings get
+them from this cache, keyed by the UID of the service (getServiceUID) and by
+the "manual entry of results" and "instrument entry of results" options of
+the analysis. Values that analyses copy from the service when created (e.g.
+the result options or the department) are read from the analysis instead, so
+analyses keep their own values when the service changes.
+
+The cache lives in memory (per Zope process), but is invalidated across all
+ZEO clients: each modification or transition of a service, method or
+instrument increases a counter stored in the database. When a process detects
+the counter has changed, it discards its cached values.
+"""
+
+from BTrees.Length import Length
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+
+# Annotation key in bika_setup where the version of the cache is stored
+SERVICE_INFO_VERSION_KEY = 'bika.lims.service_info_version'
+
+# Cached service information, by portal path
+_cache = {}
+
+
+def _get_version_counter(create=False):
+    setup = api.get_bika_setup()
+    annotations = IAnnotations(setup)
+    counter = annotations.get(SERVICE_INFO_VERSION_KEY, None)
+    if counter is None and create:
+        counter = Length()
+        annotations[SERVICE_INFO_VERSION_KEY] = counter
+    return counter
+
+
+def _get_site_cache():
+    """Returns the cache for the current site, cleared if the version stored
+    in the database is not the one the cache was built with
+    """
+    counter = _get_version_counter()
+    version = counter is not None and counter() or 0
+    key = api.get_path(api.get_portal())
+    site_cache = _cache.get(key, None)
+    if site_cache is None or site_cache['version'] != version:
+        site_cache = {'version': version, 'items': {}}
+        _cache[key] = site_cache
+    return site_cache['items']
+
+
+def invalidate_service_info():
+    """Discards the cached information of all services, in all processes
+    """
+    # Length resolves conflicts by itself, so concurrent invalidations from
+    # different ZEO clients won't conflict
+    _get_version_counter(create=True).change(1)
+
+
+def compute_service_info(service, manual_entry, instrument_entry):
+    """Returns a dict with the information from the service passed in that
+    listings need for each analysis with the entry of results options passed
+    in. Keys are named as the former metadata columns of bika_analysis_catalog
+    """
+    # Same as AbstractAnalysis.getAllowedMethods
+    methods = []
+    if manual_entry:
+        methods = service.getMethods()
+    if instrument_entry:
+        for instrument in service.getInstruments():
+            methods.extend(instrument.getMethods())
+    methods = list(set(methods))
+
+    # Same as AbstractAnalysis.getAllowedInstruments
+    instruments = []
+    if instrument_entry:
+        instruments = service.getInstruments()
+    if manual_entry:
+        for method in methods:
+            instruments += method.getInstruments()
+    instruments = list(set(instruments))
+
+    return {
+        'getAllowedMethodUIDs': [api.get_uid(m) for m in methods],
+        'getAllowedInstrumentUIDs': [api.get_uid(i) for i in instruments],
+    }
+
+
+def get_service_info(service_uid, manual_entry=True, instrument_entry=True):
+    """Returns the (cached) information of the service with the UID passed in
+    :param service_uid: UID of the Analysis Service
+    :param manual_entry: manual entry of results option of the analysis
+    :param instrument_entry: instrument entry of results option of the
+        analysis
+    :returns: a dict with the service information or an empty dict if no
+        service was found
+    """
+    if not service_uid:
+        return {}
+    items = _get_site_cache()
+    key = (service_uid, bool(manual_entry), bool(instrument_entry))
+    info = items.get(key, None)
+    if info is None:
+        service = api.get_object_by_uid(service_uid, None)
+        info = {}
+        if service:
+            info = compute_service_info(service, *key[1:])
+        items[key] = info
+    return info
+
+
+def get_service_metadata(brain_or_object, name, default=None):
+    """Returns the value for the service metadata passed in, for the analysis
+    brain or object passed in
+    :param brain_or_object: an analysis brain or object
+    :param name: name of the value (e.g. 'getAllowedMethodUIDs')
+    """
+    service_uid = api.safe_getattr(brain_or_object, 'getServiceUID', None)
+    manual_entry = api.safe_getattr(
+        brain_or_object, 'getManualEntryOfResults', True)
+    instrument_entry = api.safe_getattr(
+        brain_or_object, 'getInstrumentEntryOfResults', True)
+    info = get_service_info(service_uid, manual_entry, instrument_entry)
+    return info.get(name, default)
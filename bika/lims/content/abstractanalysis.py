@@ -6,7 +6,6 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import cgi
-import math
 from decimal import Decimal
 
 from AccessControl import ClassSecurityInfo
@@ -32,6 +31,7 @@ from bika.lims.utils import changeWorkflowState, formatDecimalMark
 from bika.lims.utils import drop_trailing_zeros_decimal
 from bika.lims.utils.analysis import create_analysis, format_numeric_result
 from bika.lims.utils.analysis import get_significant_digits
+from bika.lims.utils.calculation import CalculationEngine
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getTransitionActor
 from bika.lims.workflow import getTransitionDate
@@ -494,84 +494,9 @@ class AbstractAnalysis(AbstractBaseAnalysis):
         """Calculates the result for the current analysis if it depends of
         other analysis/interim fields. Otherwise, do nothing
         """
-        if self.getResult() and override is False:
-            return False
-
-        calc = self.getCalculation()
-        if not calc:
-            return False
-
-        mapping = {}
-
-        # Interims' priority order (from low to high):
-        # Calculation < Analysis
-        interims = calc.getInterimFields() + self.getInterimFields()
-
-        # Add interims to mapping
-        for i in interims:
-            if 'keyword' not in i:
-                continue
-            try:
-                ivalue = float(i['value'])
-                mapping[i['keyword']] = ivalue
-            except (TypeError, ValueError):
-                # Interim not float, abort
-                return False
-
-        # Add dependencies results to mapping
-        dependencies = self.getDependencies()
-        for dependency in dependencies:
-            result = dependency.getResult()
-            if not result:
-                # Dependency without results found
-                if cascade:
-                    # Try to calculate the dependency result
-                    dependency.calculateResult(override, cascade)
-                    result = dependency.getResult()
-                else:
-                    return False
-            if result:
-                try:
-                    result = float(str(result))
-                    key = dependency.getKeyword()
-                    ldl = dependency.getLowerDetectionLimit()
-                    udl = dependency.getUpperDetectionLimit()
-                    bdl = dependency.isBelowLowerDetectionLimit()
-                    adl = dependency.isAboveUpperDetectionLimit()
-                    mapping[key] = result
-                    mapping['%s.%s' % (key, 'RESULT')] = result
-                    mapping['%s.%s' % (key, 'LDL')] = ldl
-                    mapping['%s.%s' % (key, 'UDL')] = udl
-                    mapping['%s.%s' % (key, 'BELOWLDL')] = int(bdl)
-                    mapping['%s.%s' % (key, 'ABOVEUDL')] = int(adl)
-                except (TypeError, ValueError):
-                    return False
-
-        # Calculate
-        formula = calc.getMinifiedFormula()
-        formula = formula.replace('[', '%(').replace(']', ')f')
-        try:
-            formula = eval("'%s'%%mapping" % formula,
-                           {"__builtins__": None,
-                            'math': math,
-                            'context': self},
-                           {'mapping': mapping})
-            result = eval(formula, calc._getGlobals())
-        except TypeError:
-            self.setResult("NA")
-            return True
-        except ZeroDivisionError:
-            self.setResult('0/0')
-            return True
-        except KeyError as e:
-            self.setResult("NA")
-            return True
-        except ImportError as e:
-            self.setResult("NA")
-            return True
-
-        self.setResult(str(result))
-        return True
+        engine = CalculationEngine(override=override, cascade=cascade)
+        nodes = engine.calculate([self])
+        return nodes[self.UID()].calculated
 
     @security.public
     def getPrice(self):
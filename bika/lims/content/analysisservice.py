@@ -23,6 +23,10 @@ from bika.lims.browser.widgets.uidselectionwidget import UIDSelectionWidget
 from bika.lims.config import PROJECTNAME
 from bika.lims.content.abstractbaseanalysis import AbstractBaseAnalysis
 from bika.lims.content.abstractbaseanalysis import schema
+from bika.lims.dependencygraph import get_service_calculation
+from bika.lims.dependencygraph import get_service_dependants
+from bika.lims.dependencygraph import get_service_dependencies
+from bika.lims.dependencygraph import update_service
 from bika.lims.interfaces import IAnalysisService, IHaveIdentifiers
 from bika.lims.utils import to_utf8 as _c
 from magnitude import mg
@@ -408,6 +412,22 @@ class AnalysisService(AbstractBaseAnalysis):
 
         return renameAfterCreation(self)
 
+    @security.public
+    def setKeyword(self, value, **kwargs):
+        """Set the keyword and update the entry of the service in the
+        dependency graph
+        """
+        self.getField('Keyword').set(self, value, **kwargs)
+        update_service(self)
+
+    @security.public
+    def setCalculation(self, value, **kwargs):
+        """Set the calculation and update the entry of the service in the
+        dependency graph
+        """
+        self.getField('Calculation').set(self, value, **kwargs)
+        update_service(self)
+
     @security.public
     def getCalculationTitle(self):
         """Used to populate catalog values
@@ -545,10 +565,9 @@ class AnalysisService(AbstractBaseAnalysis):
         This methods returns a list with the analyses services dependencies.
         :return: a list of analysis services objects.
         """
-        calc = self.getCalculation()
-        if calc:
-            return calc.getCalculationDependencies(flat=True)
-        return []
+        uids = get_service_dependencies(self.UID())
+        return filter(None, map(lambda uid: api.get_object_by_uid(uid, None),
+                                uids))
 
     @security.public
     def getServiceDependenciesUIDs(self):
@@ -556,31 +575,25 @@ class AnalysisService(AbstractBaseAnalysis):
         This methods returns a list with the service dependencies UIDs
         :return: a list of uids
         """
-        deps = self.getServiceDependencies()
-        deps_uids = [service.UID() for service in deps]
-        return deps_uids
+        return get_service_dependencies(self.UID())
 
     @security.public
     def getServiceDependants(self):
-        bsc = getToolByName(self, 'bika_setup_catalog')
-        active_calcs = bsc(portal_type='Calculation', inactive_state="active")
-        calculations = [c.getObject() for c in active_calcs]
-        dependants = []
-        for calc in calculations:
-            calc_dependants = calc.getDependentServices()
-            if self in calc_dependants:
-                calc_dependencies = calc.getCalculationDependants()
-                dependants = dependants + calc_dependencies
-        dependants = list(set(dependants))
-        if self in dependants:
-            dependants.remove(self)
-        return dependants
+        uids = self.getServiceDependantsUIDs()
+        return filter(None, map(lambda uid: api.get_object_by_uid(uid, None),
+                                uids))
 
     @security.public
     def getServiceDependantsUIDs(self):
-        deps = self.getServiceDependants()
-        deps_uids = [service.UID() for service in deps]
-        return deps_uids
+        """Returns the UIDs of the services with an active calculation that
+        uses this service in its formula
+        """
+        bsc = getToolByName(self, 'bika_setup_catalog')
+        active_calcs = bsc(portal_type='Calculation', inactive_state="active")
+        active_uids = map(api.get_uid, active_calcs)
+        dependants = get_service_dependants(self.UID(), recursive=False)
+        return filter(lambda uid: get_service_calculation(uid) in active_uids,
+                      dependants)
 
     @security.public
     def after_deactivate_transition_event(self):
@@ -18,6 +18,7 @@ from bika.lims.content.bikaschema import BikaSchema
 from bika.lims.content.analysisrequest import schema as ar_schema
 from bika.lims.content.sample import schema as sample_schema
 from bika.lims.idserver import renameAfterCreation
+from bika.lims.idserver import set_bulk_reservation
 from bika.lims.interfaces import IARImport, IClient
 from bika.lims.utils import tmpID
 from bika.lims.utils.analysisrequest import create_analysisrequest
@@ -297,6 +298,11 @@ class ARImport(BaseFolder):
         profiles = [x.getObject() for x in bsc(portal_type='AnalysisProfile')]
 
         gridrows = self.schema['SampleData'].get(self)
+
+        # Reserve the sequence numbers for all the rows at once. The numbers
+        # not used are given back when the reservation is disabled below
+        set_bulk_reservation(len(gridrows))
+
         row_cnt = 0
         for therow in gridrows:
             row = deepcopy(therow)
@@ -348,6 +354,8 @@ class ARImport(BaseFolder):
             progress = ProgressState(self.REQUEST, progress_index)
             notify(UpdateProgressEvent(progress))
 
+        set_bulk_reservation(0)
+
         # document has been written to, and redirect() fails here
         self.REQUEST.response.write(
             '<script>document.location.href="%s"</script>' % (
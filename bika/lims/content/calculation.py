@@ -31,12 +31,16 @@ from bika.lims import bikaMessageFactory as _
 from bika.lims.api import get_object_by_uid
 from bika.lims.browser.fields import InterimFieldsField
 from bika.lims.browser.fields.uidreferencefield import UIDReferenceField
-from bika.lims.browser.fields.uidreferencefield import get_backreferences
 from bika.lims.browser.widgets import RecordsWidget
 from bika.lims.browser.widgets import RecordsWidget as BikaRecordsWidget
 from bika.lims.config import PROJECTNAME
 from bika.lims.content.bikaschema import BikaSchema
+from bika.lims.dependencygraph import get_calculation_dependencies
+from bika.lims.dependencygraph import get_calculation_services
+from bika.lims.dependencygraph import update_calculation
 from bika.lims.interfaces.calculation import ICalculation
+from bika.lims.utils.formula import evaluate_formula
+from bika.lims.utils.formula import evaluate_formula_batch
 
 
 schema = BikaSchema.copy() + Schema((
@@ -154,6 +158,9 @@ schema = BikaSchema.copy() + Schema((
 schema['title'].widget.visible = True
 schema['description'].widget.visible = True
 
+# Globals for the formula evaluation, by Python imports
+_globals_cache = {}
+
 
 class Calculation(BaseFolder, HistoryAwareMixin):
     """Calculation for Analysis Results
@@ -196,6 +203,14 @@ class Calculation(BaseFolder, HistoryAwareMixin):
             services = [brain.getObject() for brain in brains]
             self.getField('DependentServices').set(self, services)
             self.getField('Formula').set(self, Formula)
+        update_calculation(self)
+
+    def setDependentServices(self, value, **kwargs):
+        """Set the Dependent Services and update the entry of the calculation
+        in the dependency graph
+        """
+        self.getField('DependentServices').set(self, value, **kwargs)
+        update_calculation(self)
 
     def getMinifiedFormula(self):
         """Return the current formula value as text.
@@ -217,18 +232,19 @@ class Calculation(BaseFolder, HistoryAwareMixin):
             }
 
             set flat=True to get a simple list of AnalysisService objects
+
+            Dependencies are looked up in the site-wide dependency graph
         """
         if deps is None:
             deps = [] if flat is True else {}
 
-        for service in self.getDependentServices():
-            calc = service.getCalculation()
-            if calc:
-                calc.getCalculationDependencies(flat, deps)
-            if flat:
+        for uid in get_calculation_dependencies(self.UID()):
+            if not flat:
+                deps[uid] = {}
+                continue
+            service = get_object_by_uid(uid, None)
+            if service is not None:
                 deps.append(service)
-            else:
-                deps[service.UID()] = {}
         return deps
 
     def getCalculationDependants(self, deps=None):
@@ -242,13 +258,10 @@ class Calculation(BaseFolder, HistoryAwareMixin):
         """
         if deps is None:
             deps = []
-        backrefs = get_backreferences(self, 'AnalysisServiceCalculation')
-        services = map(get_object_by_uid, backrefs)
-        for service in services:
-            calc = service.getCalculation()
-            if calc and calc.UID() != self.UID():
-                calc.getCalculationDependants(deps)
-            deps.append(service)
+        for uid in get_calculation_services(self.UID()):
+            service = get_object_by_uid(uid, None)
+            if service is not None:
+                deps.append(service)
         return deps
 
     def setTestParameters(self, form_value):
@@ -316,6 +329,23 @@ class Calculation(BaseFolder, HistoryAwareMixin):
     def _getGlobals(self, **kwargs):
         """Return the globals dictionary for the formula calculation
         """
+        # The globals only depend on the Python imports, so they are cached
+        # by the imports. Changing the imports changes the cache key
+        imports = tuple([(imp["module"], imp["function"])
+                         for imp in self.getPythonImports()])
+        globs = _globals_cache.get(imports)
+        if globs is None:
+            globs = self._computeGlobals(imports)
+            _globals_cache[imports] = globs
+        globs = dict(globs)
+        # Update with keyword arguments
+        globs.update(kwargs)
+        return globs
+
+    def _computeGlobals(self, imports):
+        """Return the globals dictionary with the default members and the
+        members from the (module, function) imports passed in
+        """
         # Default globals
         globs = {
             "__builtins__": None,
@@ -326,12 +356,8 @@ class Calculation(BaseFolder, HistoryAwareMixin):
             "int": int,
             "max": max,
         }
-        # Update with keyword arguments
-        globs.update(kwargs)
         # Update with additional Python libraries
-        for imp in self.getPythonImports():
-            mod = imp["module"]
-            func = imp["function"]
+        for mod, func in imports:
             member = self._getModuleMember(mod, func)
             if member is None:
                 raise ImportError(
@@ -340,6 +366,21 @@ class Calculation(BaseFolder, HistoryAwareMixin):
             globs[func] = member
         return globs
 
+    def calculateFormula(self, mapping):
+        """Evaluate the formula of this calculation with the values of the
+        mapping passed in (keyword -> value)
+        """
+        return evaluate_formula(self.getMinifiedFormula(), mapping,
+                                self._getGlobals())
+
+    def calculateFormulas(self, mappings, errors=()):
+        """Evaluate the formula of this calculation for each one of the
+        mappings passed in. Returns a list with the result for each mapping,
+        or the error raised if it is one of the errors passed in
+        """
+        return evaluate_formula_batch(self.getMinifiedFormula(), mappings,
+                                      self._getGlobals(), errors=errors)
+
     def _getModuleMember(self, dotted_name, member):
         """Get the member object of a module.
 
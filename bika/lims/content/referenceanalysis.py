@@ -18,6 +18,7 @@ from bika.lims.content.abstractanalysis import schema
 from bika.lims.interfaces import IReferenceAnalysis
 from bika.lims.subscribers import skip
 from bika.lims.workflow import doActionFor
+from bika.lims.workflow.skiplist import get_skiplist
 from plone.app.blob.field import BlobField
 from zope.interface import implements
 
@@ -221,10 +222,7 @@ class ReferenceAnalysis(AbstractAnalysis):
             if workflow.getInfoFor(ws, 'review_state') == 'open':
                 skip(ws, "retract")
             else:
-                if "retract all analyses" \
-                        not in self.REQUEST['workflow_skiplist']:
-                    self.REQUEST["workflow_skiplist"].append(
-                        "retract all analyses")
+                get_skiplist(self.REQUEST).append("retract all analyses")
                 workflow.doActionFor(ws, 'retract')
         self.reindexObject()
 
@@ -248,10 +246,7 @@ class ReferenceAnalysis(AbstractAnalysis):
                         all_verified = False
                         break
                 if all_verified:
-                    if "verify all analyses" \
-                            not in self.REQUEST['workflow_skiplist']:
-                        self.REQUEST["workflow_skiplist"].append(
-                            "verify all analyses")
+                    get_skiplist(self.REQUEST).append("verify all analyses")
                     workflow.doActionFor(ws, "verify")
         self.reindexObject()
 
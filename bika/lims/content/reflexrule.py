@@ -25,6 +25,7 @@ from bika.lims.utils import isnumber
 from bika.lims.utils import getUsers
 from bika.lims.utils import tmpID
 from bika.lims.utils.analysis import duplicateAnalysis
+from bika.lims.utils.calculation import CalculationEngine
 from bika.lims.idserver import renameAfterCreation
 from bika.lims import logger
 from bika.lims.workflow import doActionFor
@@ -532,6 +533,8 @@ def doReflexRuleAction(base, action_row):
     :action_row: a list of dictionaries containing the actions to do
         [{'action': 'duplicate', ...}, {,}, ...]
     """
+    # Analyses with a result set by the actions
+    results_set = []
     for action in action_row:
         # Do the action
         analysis = doActionToAnalysis(base, action)
@@ -543,4 +546,13 @@ def doReflexRuleAction(base, action_row):
         # are reindexed in some workflow step that some of them don't do?
         base.reindexObject()
         analysis.reindexObject()
+        if action.get('action', '') == 'setresult':
+            results_set.append(analysis)
+    if results_set:
+        # Calculate the analyses without result yet that depend on the
+        # results set, all at once
+        engine = CalculationEngine()
+        for node in engine.calculate_dependents(results_set).values():
+            if node.calculated:
+                node.analysis.reindexObject()
     return True
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Site-wide graph of the dependencies between Analysis Services.
+
+A service depends on the services used in the formula of its calculation,
+and on the dependencies of these services, recursively. Resolving this
+through the objects wakes up every service and calculation of the chain on
+each lookup. Instead, the edges of the graph are stored in the annotations
+where the number generator stores its numbers (bika_setup, or the portal if
+bika_setup does not exist yet, see numbergenerator.get_portal_annotation):
+
+- services: service UID -> (keyword, UID of its calculation or "")
+- calculations: calculation UID -> UIDs of the services used in the formula
+
+The graph is built as a whole when the add-on is installed or upgraded. The
+entry of a service or a calculation is updated when it changes (see the
+setters of AnalysisService and Calculation, and the subscribers). If the
+graph has not been stored yet, readers build it in memory, without writing in
+the database. Dependencies and dependants computed from the edges are kept in
+memory per process. Each change of the edges increases a counter stored in
+the database, so all ZEO clients discard the values they computed from the
+former edges.
+"""
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.numbergenerator import get_portal_annotation
+
+# Annotation keys where the graph is stored
+SERVICES_KEY = "bika.lims.dependency_graph.services"
+CALCULATIONS_KEY = "bika.lims.dependency_graph.calculations"
+VERSION_KEY = "bika.lims.dependency_graph.version"
+
+# Values computed from the graph, by portal path
+_cache = {}
+
+
+def get_service_entry(service):
+    """Returns the entry of the graph for the service passed in
+    """
+    calculation = service.getCalculation()
+    calculation_uid = calculation and api.get_uid(calculation) or ""
+    return (service.getKeyword(), calculation_uid)
+
+
+def get_calculation_entry(calculation):
+    """Returns the entry of the graph for the calculation passed in
+    """
+    return tuple(map(api.get_uid, calculation.getDependentServices()))
+
+
+def build_graph(store=True):
+    """Builds the graph from all the services and calculations
+    :param store: store the graph in the database
+    """
+    services = OOBTree()
+    calculations = OOBTree()
+    setup_catalog = api.get_tool("bika_setup_catalog")
+    for brain in setup_catalog(portal_type="AnalysisService"):
+        service = api.get_object(brain)
+        services[api.get_uid(service)] = get_service_entry(service)
+    for brain in setup_catalog(portal_type="Calculation"):
+        calculation = api.get_object(brain)
+        calculations[api.get_uid(calculation)] = \
+            get_calculation_entry(calculation)
+    if store:
+        annotation = get_portal_annotation()
+        annotation[SERVICES_KEY] = services
+        annotation[CALCULATIONS_KEY] = calculations
+        increase_version()
+        logger.info("Built the dependency graph of {} services and {} "
+                    "calculations".format(len(services), len(calculations)))
+    return services, calculations
+
+
+def get_graph(create=False):
+    """Returns the edges of the graph, a tuple of (services, calculations).
+    If the graph is not stored yet, it is built and stored if create is set,
+    or built in memory otherwise
+    """
+    annotation = get_portal_annotation()
+    services = annotation.get(SERVICES_KEY)
+    calculations = annotation.get(CALCULATIONS_KEY)
+    if services is not None and calculations is not None:
+        return services, calculations
+    if create:
+        return build_graph()
+    site_cache = _get_site_cache()
+    graph = site_cache.get("graph")
+    if graph is None:
+        graph = build_graph(store=False)
+        site_cache["graph"] = graph
+    return graph
+
+
+def increase_version():
+    """Discards the values computed from the graph, in all processes
+    """
+    annotation = get_portal_annotation()
+    counter = annotation.get(VERSION_KEY)
+    if counter is None:
+        counter = Length()
+        annotation[VERSION_KEY] = counter
+    # Length resolves conflicts by itself, so concurrent changes from
+    # different ZEO clients won't conflict here
+    counter.change(1)
+
+
+def is_temporary(obj):
+    """Checks if the object has no UID yet or is a temporary object created
+    by portal_factory, which are not added to the graph
+    """
+    return not api.get_uid(obj) or "portal_factory" in obj.getPhysicalPath()
+
+
+def update_service(service):
+    """Updates the entry of the service passed in
+    """
+    if is_temporary(service):
+        return
+    services, calculations = get_graph(create=True)
+    uid = api.get_uid(service)
+    entry = get_service_entry(service)
+    if services.get(uid) != entry:
+        services[uid] = entry
+        increase_version()
+
+
+def update_calculation(calculation):
+    """Updates the entry of the calculation passed in
+    """
+    if is_temporary(calculation):
+        return
+    services, calculations = get_graph(create=True)
+    uid = api.get_uid(calculation)
+    entry = get_calculation_entry(calculation)
+    if calculations.get(uid) != entry:
+        calculations[uid] = entry
+        increase_version()
+
+
+def remove_entry(uid):
+    """Removes the entry of the service or calculation with the UID passed in
+    """
+    for storage in get_graph(create=True):
+        if uid in storage:
+            del storage[uid]
+            increase_version()
+
+
+def _get_site_cache():
+    """Returns the values computed for the current site, cleared if the graph
+    changed since they were computed
+    """
+    counter = get_portal_annotation().get(VERSION_KEY)
+    # The serial tells apart two versions with the same number, e.g. when a
+    # transaction that changed the graph was aborted
+    version = counter is not None and (counter(), counter._p_serial) or None
+    key = api.get_path(api.get_portal())
+    site_cache = _cache.get(key)
+    if site_cache is None or site_cache["version"] != version:
+        site_cache = {"version": version}
+        _cache[key] = site_cache
+    return site_cache
+
+
+def _get_reverse_edges():
+    """Returns a tuple of dicts: service UID -> UIDs of the calculations that
+    use it in their formula, and calculation UID -> UIDs of the services the
+    calculation is assigned to
+    """
+    site_cache = _get_site_cache()
+    reverse = site_cache.get("reverse")
+    if reverse is None:
+        services, calculations = get_graph()
+        used_by = {}
+        for calculation_uid, service_uids in calculations.items():
+            for service_uid in service_uids:
+                used_by.setdefault(service_uid, []).append(calculation_uid)
+        assigned_to = {}
+        for service_uid, entry in services.items():
+            if entry[1]:
+                assigned_to.setdefault(entry[1], []).append(service_uid)
+        reverse = (used_by, assigned_to)
+        site_cache["reverse"] = reverse
+    return reverse
+
+
+def _get_cached(name, uid, compute):
+    values = _get_site_cache().setdefault(name, {})
+    if uid not in values:
+        values[uid] = tuple(compute(uid))
+    return list(values[uid])
+
+
+def get_service_calculation(service_uid):
+    """Returns the UID of the calculation of the service, or an empty string
+    """
+    services, calculations = get_graph()
+    return services.get(service_uid, ("", ""))[1]
+
+
+def get_dependent_keywords(calculation_uid):
+    """Returns the keywords of the services used in the formula of the
+    calculation with the UID passed in
+    """
+    def compute(uid):
+        services, calculations = get_graph()
+        for service_uid in calculations.get(uid, ()):
+            keyword = services.get(service_uid, ("", ""))[0]
+            if keyword:
+                yield keyword
+    return _get_cached("keywords", calculation_uid, compute)
+
+
+def get_calculation_dependencies(calculation_uid):
+    """Returns the UIDs of the services the calculation depends on: the
+    services used in its formula and their dependencies, recursively
+    """
+    def compute(uid):
+        services, calculations = get_graph()
+        dependencies = []
+        pending = list(calculations.get(uid, ()))
+        while pending:
+            service_uid = pending.pop(0)
+            if service_uid in dependencies:
+                continue
+            dependencies.append(service_uid)
+            calculation_uid = services.get(service_uid, ("", ""))[1]
+            pending.extend(calculations.get(calculation_uid, ()))
+        return dependencies
+    return _get_cached("dependencies", calculation_uid, compute)
+
+
+def get_calculation_services(calculation_uid):
+    """Returns the UIDs of the services the calculation is assigned to
+    """
+    used_by, assigned_to = _get_reverse_edges()
+    return list(assigned_to.get(calculation_uid, []))
+
+
+def get_service_dependencies(service_uid):
+    """Returns the UIDs of the services the service depends on, recursively
+    """
+    calculation_uid = get_service_calculation(service_uid)
+    if not calculation_uid:
+        return []
+    dependencies = get_calculation_dependencies(calculation_uid)
+    return filter(lambda uid: uid != service_uid, dependencies)
+
+
+def get_service_dependants(service_uid, recursive=True):
+    """Returns the UIDs of the services whose calculation uses the service,
+    and the dependants of these services if recursive is set
+    """
+    def compute(uid):
+        used_by, assigned_to = _get_reverse_edges()
+        dependants = []
+        pending = [uid]
+        while pending:
+            dependency_uid = pending.pop(0)
+            for calculation_uid in used_by.get(dependency_uid, []):
+                for dependant_uid in assigned_to.get(calculation_uid, []):
+                    if dependant_uid in dependants:
+                        continue
+                    dependants.append(dependant_uid)
+                    if recursive:
+                        pending.append(dependant_uid)
+        return filter(lambda dependant: dependant != uid, dependants)
+    name = recursive and "dependants" or "direct_dependants"
+    return _get_cached(name, service_uid, compute)
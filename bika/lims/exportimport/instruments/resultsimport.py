@@ -17,6 +17,7 @@ from bika.lims.exportimport.instruments.logger import Logger
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.utils import t
 from bika.lims.utils import tmpID
+from bika.lims.utils.calculation import CalculationEngine
 from bika.lims.workflow import doActionFor
 
 
@@ -452,6 +453,10 @@ class AnalysisResultsImporter(Logger):
         attachments = {}
         infile = self._parser.getInputFile()
 
+        # Analyses with results imported by object ID. The calculations that
+        # depend on them are done at once, when all the results are set
+        imported = {}
+
         # searchcriteria = self.getIdSearchCriteria()
         # self.log(_("Search criterias: %s") % (', '.join(searchcriteria)))
         for objid, results in self._parser.getRawResults().iteritems():
@@ -576,6 +581,7 @@ class AnalysisResultsImporter(Logger):
                     processed = self._process_analysis(objid, analysis, values)
                     if processed:
                         ancount += 1
+                        imported.setdefault(objid, []).append(analysis)
                         if inst:
                             # Calibration Test (import to Instrument)
                             instprocessed.append(inst.UID())
@@ -603,6 +609,9 @@ class AnalysisResultsImporter(Logger):
                                 "it is not assigned to a worksheet (%s)" %
                                 analysis)
 
+        if imported:
+            self.calculateTotalResults(imported)
+
         for arid, acodes in importedars.iteritems():
             acodesmsg = ["Analysis %s" % acod for acod in acodes]
             self.log(
@@ -850,43 +859,39 @@ class AnalysisResultsImporter(Logger):
 
         return analyses
 
-    def calculateTotalResults(self, objid, analysis):
-        """ If an AR(objid) has an analysis that has a calculation
-        then check if param analysis is used on the calculations formula.
+    def calculateTotalResults(self, imported):
+        """Calculates the results of the analyses that depend on the
+        analyses with results imported, directly or through other calculated
+        analyses. All of them are calculated at once, so the analyses with
+        the same calculation are evaluated together.
         Here we are dealing with two types of analysis.
         1. Calculated Analysis - Results are calculated.
         2. Analysis - Results are captured and not calculated
-        :param objid: AR ID or Worksheet's Reference Sample IDs
-        :param analysis: Analysis Object
+        :param imported: dict of AR ID or Worksheet's Reference Sample ID ->
+            Analyses with results imported
         """
-        analyses = self._getZODBAnalyses(objid)
-        # Filter Analyses With Calculation
-        analyses_with_calculation = filter(
-                                        lambda an: an.getCalculation(),
-                                        analyses)
-        for analysis_with_calc in analyses_with_calculation:
-            # Get the calculation to get the formula so that we can check
-            # if param analysis keyword is used on the calculation formula
-            calcultion = analysis_with_calc.getCalculation()
-            formula = calcultion.getMinifiedFormula()
-            # The analysis that we are currenly on
-            analysis_keyword = analysis.getKeyword()
-            if analysis_keyword not in formula:
+        objids = {}
+        analyses = []
+        for objid, imported_analyses in imported.items():
+            analyses.extend(imported_analyses)
+            # Only the analyses that can be imported for the object are
+            # calculated
+            for analysis in self._getZODBAnalyses(objid):
+                objids[api.get_uid(analysis)] = objid
+        engine = CalculationEngine(override=self._override[1], vectorize=True)
+        nodes = engine.calculate_dependents(
+            analyses, accept=lambda analysis: api.get_uid(analysis) in objids)
+        for node in nodes.values():
+            if not node.calculated:
                 continue
-
-            # If the analysis_keyword is in the formula, it means that this
-            # analysis is a dependent on that calculated analysis
-            calc_passed = analysis_with_calc.calculateResult(override=self._override[1])
-            if calc_passed:
-                api.do_transition_for(analysis_with_calc, "submit")
-                self.log(
-                    "${request_id}: calculated result for "
-                    "'${analysis_keyword}': '${analysis_result}'",
-                    mapping={"request_id": objid,
-                             "analysis_keyword": analysis_with_calc.getKeyword(),
-                             "analysis_result": str(analysis_with_calc.getResult())}
-                )
-
+            api.do_transition_for(node.analysis, "submit")
+            self.log(
+                "${request_id}: calculated result for "
+                "'${analysis_keyword}': '${analysis_result}'",
+                mapping={"request_id": objids.get(node.uid),
+                         "analysis_keyword": node.keyword,
+                         "analysis_result": str(node.analysis.getResult())}
+            )
 
     def _process_analysis(self, objid, analysis, values):
         resultsaved = False
@@ -961,7 +966,6 @@ class AnalysisResultsImporter(Logger):
 
         if resultsaved:
             doActionFor(analysis, 'submit')
-            self.calculateTotalResults(objid, analysis)
             fields_to_reindex.append('Result')
 
         if (resultsaved) \
@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Indexes of the IDs generated by the ID server.
+
+The prefix index keeps the highest sequence number in use for each ID
+prefix. Keys are the ones of the number generator (see
+idserver.make_storage_key), so a lookup is a single BTree access instead of
+a scan of all the objects of the portal type. Unlike the numbers of the
+number generator, this index is not flushed, so it can be used to seed the
+number generator again.
+
+The registry of issued IDs keeps all the IDs generated for each portal type,
+so duplicate IDs are detected globally and not only in the container of the
+new object. The IDs of each portal type are sharded by their prefix (e.g.
+"WATER" for "WATER-0001-R01"), in a separate set per shard. The registry is
+built from the existing objects when the add-on is installed or upgraded
+(see build_issued_ids), and only the generation of IDs writes into it
+afterwards.
+"""
+
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from BTrees.OOBTree import OOTreeSet
+
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.numbergenerator import get_portal_annotation
+
+# Annotation key in bika_setup where the index is stored
+PREFIX_INDEX = "bika.lims.idserver.prefix_index"
+
+# Annotation key in bika_setup where the issued IDs are stored
+ISSUED_IDS = "bika.lims.idserver.issued_ids"
+
+
+class MaxNumber(Length):
+    """Persistent highest number. Concurrent updates resolve to the highest
+    number, so IDs generated for the same prefix in different ZEO clients
+    do not conflict here
+    """
+
+    def _p_resolveConflict(self, old, committed, new):
+        return max(committed, new)
+
+    def update(self, number):
+        if number > self.value:
+            self.set(number)
+
+
+def get_prefix_index(create=False):
+    """Returns the index, an OOBTree of key -> MaxNumber. If the index does
+    not exist yet and create is False, an empty index that is not stored is
+    returned
+    """
+    annotation = get_portal_annotation()
+    index = annotation.get(PREFIX_INDEX)
+    if index is None:
+        index = OOBTree()
+        if create:
+            annotation[PREFIX_INDEX] = index
+    return index
+
+
+def get_max_number(key, default=None):
+    """Returns the highest number indexed for the key passed in
+    """
+    number = get_prefix_index().get(key)
+    if number is None:
+        return default
+    return number()
+
+
+def update_max_number(key, number):
+    """Sets the highest number for the key passed in, unless a higher number
+    is indexed already
+    """
+    index = get_prefix_index(create=True)
+    max_number = index.get(key)
+    if max_number is None:
+        index[key] = MaxNumber(number)
+    else:
+        max_number.update(number)
+
+
+def remove_max_number(key):
+    """Removes the key passed in from the index
+    """
+    index = get_prefix_index()
+    if key in index:
+        del index[key]
+
+
+def get_shard_key(obj_id):
+    """Returns the key of the shard of issued IDs the ID passed in belongs to
+    """
+    return obj_id.split("-")[0]
+
+
+def get_issued_ids_registry(create=False):
+    """Returns the registry of issued IDs, an OOBTree of portal_type ->
+    OOBTree of shard key -> OOTreeSet of IDs, or None if it does not exist
+    and create is False
+    """
+    annotation = get_portal_annotation()
+    registry = annotation.get(ISSUED_IDS)
+    if registry is None and create:
+        registry = OOBTree()
+        annotation[ISSUED_IDS] = registry
+    return registry
+
+
+def get_issued_ids(portal_type, obj_id, create=False):
+    """Returns the set of IDs issued for the portal type passed in, that
+    shares the shard with the ID passed in, or None if it does not exist and
+    create is False
+    """
+    registry = get_issued_ids_registry(create=create)
+    if registry is None:
+        return None
+    shards = registry.get(portal_type)
+    if shards is None:
+        if not create:
+            return None
+        shards = registry[portal_type] = OOBTree()
+    shard_key = get_shard_key(obj_id)
+    ids = shards.get(shard_key)
+    if ids is None and create:
+        ids = shards[shard_key] = OOTreeSet()
+    return ids
+
+
+def is_issued_id(portal_type, obj_id):
+    """Checks if the ID passed in was already issued for the portal type
+    """
+    ids = get_issued_ids(portal_type, obj_id)
+    return ids is not None and obj_id in ids
+
+
+def register_issued_id(portal_type, obj_id):
+    """Registers the ID passed in as issued for the portal type
+    """
+    get_issued_ids(portal_type, obj_id, create=True).insert(obj_id)
+
+
+def build_issued_ids(portal_types):
+    """Registers the IDs of the existing objects of the portal types passed in
+    as issued, from uid_catalog
+    """
+    catalog = api.get_tool("uid_catalog")
+    for portal_type in portal_types:
+        brains = catalog({"portal_type": portal_type})
+        for brain in brains:
+            register_issued_id(portal_type, api.get_id(brain))
+        logger.info("Registered {} issued IDs for {}".format(
+            len(brains), portal_type))
@@ -16,11 +16,40 @@ from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
 from bika.lims.browser.fields.uidreferencefield \
     import get_backreferences as get_backuidreferences
+from bika.lims.idindex import build_issued_ids
+from bika.lims.idindex import get_max_number
+from bika.lims.idindex import is_issued_id
+from bika.lims.idindex import register_issued_id
+from bika.lims.idindex import update_max_number
 from bika.lims.interfaces import IIdServer
 from bika.lims.numbergenerator import INumberGenerator
+from zope.annotation.interfaces import IAnnotations
 from zope.component import getAdapters
+from zope.component import getGlobalSiteManager
+from zope.component import getSiteManager
 from zope.component import getUtility
 
+# Request annotation key where the numbers reserved in the current request
+# are kept, by number generator key
+RESERVED_NUMBERS_KEY = "bika.lims.idserver.reserved_numbers"
+
+# Request annotation key where whether there are IIdServer adapters
+# registered is kept
+ID_SERVER_ADAPTERS_KEY = "bika.lims.idserver.has_adapters"
+
+# Maximum number of IDs generated for an object when the generated ones are
+# already taken
+MAX_ID_ATTEMPTS = 10
+
+# Portal types whose IDs are not generated by the ID server (analyses are
+# named after the keyword of their service)
+NOT_GENERATED_TYPES = (
+    "Analysis",
+    "DuplicateAnalysis",
+    "ReferenceAnalysis",
+    "RejectAnalysis",
+)
+
 
 class IDServerUnavailable(Exception):
     pass
@@ -279,6 +308,11 @@ def get_counted_number(context, config, variables, **kw):
     seq_items = get_objects_in_sequence(obj, counter_type, counter_reference)
 
     number = len(seq_items)
+
+    # The object the ID is generated for is not created yet, so it is not
+    # in the sequence
+    if kw.get("pending", False):
+        number += 1
     return number
 
 
@@ -314,32 +348,180 @@ def get_generated_number(context, config, variables, **kw):
     # The key used for the storage
     key = make_storage_key(portal_type, prefix)
 
+    if kw.get("dry_run", False):
+        # => This allows us to "preview" the next generated ID in the UI
+        # TODO Show the user the next generated number somewhere in the UI
+        reserved = get_reserved_numbers(key)
+        if reserved:
+            return reserved[0]
+        number = number_generator.get(key)
+        if number is None:
+            number = get_max_seq_number(portal_type, prefix, id_template,
+                                        store=False)
+        return number + 1
+
     # Handle flushed storage
-    if key not in number_generator:
-        max_num = 0
-        existing = get_ids_with_prefix(portal_type, prefix)
-        numbers = map(lambda id: get_seq_number_from_id(id, id_template, prefix), existing)
-        # figure out the highest number in the sequence
-        if numbers:
-            max_num = max(numbers)
-        # set the number generator
-        logger.info("*** SEEDING Prefix '{}' to {}".format(prefix, max_num))
-        number_generator.set_number(key, max_num)
-
-    if not kw.get("dry_run", False):
+    seed_number(portal_type, prefix, id_template)
+
+    # Take the next number reserved for this request, if any
+    number = pop_reserved_number(key)
+    if number is None:
         # Generate a new number
         # NOTE Even when the number exceeds the given ID sequence format,
         #      it will overflow gracefully, e.g.
         #      >>> {sampleId}-R{seq:03d}'.format(sampleId="Water", seq=999999)
         #      'Water-R999999‘
         number = number_generator.generate_number(key=key)
-    else:
-        # => This allows us to "preview" the next generated ID in the UI
-        # TODO Show the user the next generated number somewhere in the UI
-        number = number_generator.get(key, 1)
+
+    # Keep track of the highest number in use for this prefix. Prefixes not
+    # indexed yet are indexed from the IDs of the existing objects first
+    if number > get_max_seq_number(portal_type, prefix, id_template):
+        update_max_number(key, number)
     return number
 
 
+def get_max_seq_number(portal_type, prefix, id_template="", store=True):
+    """Returns the highest sequence number in use for the given portal_type
+    and prefix. The number is looked up in the prefix index. Prefixes not
+    indexed yet are computed from the IDs of the existing objects once
+    :param store: store the number computed for a prefix not indexed yet
+    """
+    key = make_storage_key(portal_type, prefix)
+    max_num = get_max_number(key)
+    if max_num is not None:
+        return max_num
+    max_num = 0
+    existing = get_ids_with_prefix(portal_type, prefix)
+    numbers = map(lambda id: get_seq_number_from_id(id, id_template, prefix), existing)
+    # figure out the highest number in the sequence
+    if numbers:
+        max_num = max(numbers)
+    if store:
+        logger.info("*** INDEXING Prefix '{}' with {}".format(prefix, max_num))
+        update_max_number(key, max_num)
+    return max_num
+
+
+def seed_number(portal_type, prefix, id_template=""):
+    """Seeds the number generator with the highest number in use for the
+    given portal_type and prefix, if the key is missing (flushed storage)
+    """
+    number_generator = getUtility(INumberGenerator)
+    key = make_storage_key(portal_type, prefix)
+    if key in number_generator:
+        return
+    max_num = get_max_seq_number(portal_type, prefix, id_template)
+    # set the number generator
+    logger.info("*** SEEDING Prefix '{}' to {}".format(prefix, max_num))
+    number_generator.set_number(key, max_num)
+
+
+def get_reservations():
+    """Returns the dict where the numbers reserved in the current request are
+    kept, or None if there is no request
+    """
+    request = api.get_request()
+    if request is None:
+        return None
+    annotations = IAnnotations(request)
+    reservations = annotations.get(RESERVED_NUMBERS_KEY)
+    if reservations is None:
+        reservations = {"size": 0, "numbers": {}, "bulk": set()}
+        annotations[RESERVED_NUMBERS_KEY] = reservations
+    return reservations
+
+
+def get_reserved_numbers(key):
+    """Returns the numbers reserved in the current request and not used yet
+    for the given number generator key
+    """
+    reservations = get_reservations()
+    if reservations is None:
+        return []
+    numbers = reservations["numbers"].get(key, [])
+    # Discard the reservation if the counter was rolled back (e.g. a
+    # savepoint rollback), otherwise the numbers would be issued again
+    if numbers and getUtility(INumberGenerator).get(key, 0) < numbers[-1]:
+        del reservations["numbers"][key]
+        return []
+    return numbers
+
+
+def pop_reserved_number(key):
+    """Returns the next number reserved in the current request for the given
+    key. If none is left and a bulk reservation is active, a new block of
+    numbers is reserved. Returns None if no number is reserved
+    """
+    numbers = get_reserved_numbers(key)
+    if not numbers:
+        reservations = get_reservations()
+        size = reservations and reservations["size"] or 0
+        if size < 2:
+            return None
+        number_generator = getUtility(INumberGenerator)
+        numbers = number_generator.reserve_numbers(key, size)
+        reservations["numbers"][key] = numbers
+        reservations["bulk"].add(key)
+    return numbers.pop(0)
+
+
+def release_reserved_numbers(key):
+    """Gives the numbers reserved in the current request for the given key
+    and not used back to the number generator, as long as no number was
+    generated for the key after them. Returns the count of numbers released
+    """
+    numbers = get_reserved_numbers(key)
+    reservations = get_reservations()
+    if reservations is not None:
+        reservations["numbers"].pop(key, None)
+    if not numbers:
+        return 0
+    number_generator = getUtility(INumberGenerator)
+    if number_generator.get(key) != numbers[-1]:
+        return 0
+    number_generator.set_number(key, numbers[0] - 1)
+    return len(numbers)
+
+
+def reserve_numbers(portal_type, prefix, count):
+    """Reserves a contiguous block of sequence numbers for the given
+    portal_type and prefix with a single write. The numbers are used by the
+    IDs generated for this portal_type and prefix in the current request.
+    Reserved numbers that are not used are lost, so there will be gaps in
+    the sequence
+    :returns: the list of reserved numbers
+    """
+    # normalize the prefix in the same way get_generated_number does
+    prefix = api.normalize_filename(prefix)
+    seed_number(portal_type, prefix)
+    key = make_storage_key(portal_type, prefix)
+    number_generator = getUtility(INumberGenerator)
+    numbers = number_generator.reserve_numbers(key, count)
+    reservations = get_reservations()
+    if reservations is not None:
+        reserved = get_reserved_numbers(key)
+        reservations["numbers"][key] = reserved + numbers
+    return numbers
+
+
+def set_bulk_reservation(count):
+    """Reserves blocks of `count` numbers at once for each key for which IDs
+    are generated in the current request, e.g. before the creation of many
+    objects (AR imports), so the number generator is written once per key
+    and block instead of once per object. A count below 2 disables it, and
+    the numbers of the blocks that were not used are released, so the
+    sequences have no gaps
+    """
+    reservations = get_reservations()
+    if reservations is None:
+        return
+    reservations["size"] = count
+    if count < 2:
+        for key in reservations["bulk"]:
+            release_reserved_numbers(key)
+        reservations["bulk"].clear()
+
+
 def generateUniqueId(context, **kw):
     """ Generate pretty content IDs.
     """
@@ -348,7 +530,7 @@ def generateUniqueId(context, **kw):
     config = get_config(context, **kw)
 
     # get the variables map for later string interpolation
-    variables = get_variables(context, **kw)
+    variables = kw.get("variables") or get_variables(context, **kw)
 
     # The new generate sequence number
     number = 0
@@ -385,6 +567,135 @@ def generateUniqueId(context, **kw):
     return normalized_id
 
 
+def build_id_indexes():
+    """Registers the IDs of the existing objects as issued, for the portal
+    types whose IDs are "generated" sequences. Called when the add-on is
+    installed or upgraded, so the generation of IDs does not need to scan
+    the existing objects
+    """
+    catalog = api.get_tool("uid_catalog")
+    portal_types = []
+    for portal_type in catalog.uniqueValuesFor("portal_type"):
+        if portal_type in NOT_GENERATED_TYPES:
+            continue
+        config = get_config(None, portal_type=portal_type)
+        if config.get("sequence_type", "generated") == "generated":
+            portal_types.append(portal_type)
+    build_issued_ids(portal_types)
+
+
+def lookup_id_server_adapters():
+    """Checks if there is any IIdServer adapter registered
+    """
+    for registry in (getSiteManager(), getGlobalSiteManager()):
+        for registration in registry.registeredAdapters():
+            if registration.provided.isOrExtends(IIdServer):
+                return True
+    return False
+
+
+def has_id_server_adapters():
+    """Checks if there is any IIdServer adapter registered. The registries
+    are only looked up once per request
+    """
+    request = api.get_request()
+    if request is None:
+        return lookup_id_server_adapters()
+    annotations = IAnnotations(request)
+    found = annotations.get(ID_SERVER_ADAPTERS_KEY)
+    if found is None:
+        found = lookup_id_server_adapters()
+        annotations[ID_SERVER_ADAPTERS_KEY] = found
+    return found
+
+
+def generate_id_for(container, portal_type, **kw):
+    """Generates the final ID for an object of the given portal_type that is
+    about to be created inside the container, so it can be created with this
+    ID instead of being renamed after creation. Additional variables for the
+    ID template (e.g. sample) are passed as keyword arguments.
+
+    Returns None if the ID can not be generated before the object exists:
+    an IIdServer adapter is registered, the ID template requires variables
+    that are not available or the generated ID is already taken
+    """
+    if has_id_server_adapters():
+        return None
+
+    variables = {
+        'context': None,
+        'id': '',
+        'portal_type': portal_type,
+        'year': get_current_year(),
+        'parent': container,
+        'seq': 0,
+    }
+    variables.update(kw)
+    if portal_type == "AnalysisRequest" and kw.get("sample"):
+        variables.setdefault("sampleId", api.get_id(kw["sample"]))
+
+    config = get_config(container, portal_type=portal_type)
+
+    # The object counted numbers rely on must be available
+    if config.get("sequence_type", "generated") == "counter":
+        if variables.get(config.get("context")) is None:
+            return None
+
+    # Check the template can be interpolated before generating a number
+    try:
+        config.get("form", "").format(**variables)
+    except (KeyError, IndexError, AttributeError):
+        return None
+
+    def generate():
+        return generateUniqueId(container, portal_type=portal_type,
+                                variables=variables, pending=True)
+    try:
+        return generate_free_id(container, portal_type, generate)
+    except KeyError:
+        return None
+
+
+def generate_free_id(container, portal_type, generate, check_issued=None):
+    """Calls generate until it returns an ID that is not taken, neither in
+    the container nor, for "generated" sequences, by any other object of the
+    same portal type. Other sequences (e.g. counters of contained objects)
+    might legitimately repeat IDs in different containers.
+    :param generate: callable without arguments that returns a new ID
+    :param check_issued: check the registry of issued IDs. Defaults to
+        whether the ID config of the portal type is a "generated" sequence
+    :returns: the ID, registered as issued
+    """
+    if check_issued is None:
+        config = get_config(container, portal_type=portal_type)
+        sequence_type = config.get("sequence_type", "generated")
+        check_issued = sequence_type == "generated"
+
+    def is_taken(new_id):
+        if container.hasObject(new_id):
+            return True
+        return check_issued and is_issued_id(portal_type, new_id)
+
+    tried = []
+    new_id = generate()
+    while is_taken(new_id):
+        tried.append(new_id)
+        if len(tried) >= MAX_ID_ATTEMPTS:
+            raise KeyError("The IDs {} are already taken".format(
+                ", ".join(tried)))
+        logger.warn("The ID {} is already taken, generating a new one"
+                    .format(new_id))
+        new_id = generate()
+        if new_id in tried:
+            # The same ID is generated again, e.g. for counted sequences
+            raise KeyError("The ID {} is already taken in the path {}".format(
+                new_id, api.get_path(container)))
+
+    if check_issued:
+        register_issued_id(portal_type, new_id)
+    return new_id
+
+
 def renameAfterCreation(obj):
     """Rename the content after it was created/added
     """
@@ -395,27 +706,29 @@ def renameAfterCreation(obj):
     # Can't rename without a subtransaction commit when using portal_factory
     transaction.savepoint(optimistic=True)
     # The id returned should be normalized already
-    new_id = None
-    # Checking if an adapter exists for this content type. If yes, we will
-    # get new_id from adapter.
-    for name, adapter in getAdapters((obj, ), IIdServer):
-        if new_id:
-            logger.warn(('More than one ID Generator Adapter found for'
-                         'content type -> %s') % obj.portal_type)
-        new_id = adapter.generate_id(obj.portal_type)
-    if not new_id:
-        new_id = generateUniqueId(obj)
-
-    # TODO: This is a naive check just in current folder
-    # -> this should check globally for duplicate objects with same prefix
-    # N.B. a check like `search_by_prefix` each time would probably slow things
-    # down too much!
-    # -> A solution could be to store all IDs with a certain prefix in a storage
+    adapters = list(getAdapters((obj, ), IIdServer))
+    if len(adapters) > 1:
+        logger.warn(('More than one ID Generator Adapter found for'
+                     'content type -> %s') % obj.portal_type)
+
+    def generate():
+        new_id = None
+        # Checking if an adapter exists for this content type. If yes, we
+        # will get new_id from adapter.
+        for name, adapter in adapters:
+            new_id = adapter.generate_id(obj.portal_type)
+        if not new_id:
+            new_id = generateUniqueId(obj)
+        return new_id
+
+    # Generate a new ID as long as the generated one is already taken, in
+    # the parent or (for generated sequences) globally for the portal type
     parent = api.get_parent(obj)
-    if new_id in parent.objectIds():
-        # XXX We could do the check in a `while` loop and generate a new one.
-        raise KeyError("The ID {} is already taken in the path {}".format(
-            new_id, api.get_path(parent)))
+    check_issued = None
+    if adapters:
+        check_issued = False
+    new_id = generate_free_id(parent, api.get_portal_type(obj), generate,
+                              check_issued=check_issued)
     # rename the object to the new id
     parent.manage_renameObject(obj.id, new_id)
 
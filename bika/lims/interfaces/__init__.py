@@ -556,6 +556,10 @@ class IResultOutOfRange(Interface):
         If a result is present in the request, it is passed here to be checked.
         if result is None, the value from the database is checked.
 
+        Adapters can also accept a 'specification' keyword argument, a dict
+        with 'min', 'max' and 'error' keys that overrides the specification
+        of the analysis. It is only passed to the adapters that accept it.
+
         """
 
 
@@ -8,6 +8,7 @@
 import json
 
 from Products.CMFCore.utils import getToolByName
+from bika.lims.workflow.listing import resolve_transitions
 from plone.jsonapi.core import router
 from plone.jsonapi.core.interfaces import IRouteProvider
 from zExceptions import BadRequest
@@ -39,7 +40,6 @@ class allowedTransitionsFor(object):
         Required parameters:
             - uid: uids of the objects to get the allowed transitions from
         """
-        wftool = getToolByName(context, "portal_workflow")
         uc = getToolByName(context, 'uid_catalog')
         uids = json.loads(request.get('uid', '[]'))
         if not uids:
@@ -47,13 +47,15 @@ class allowedTransitionsFor(object):
 
         allowed_transitions = []
         try:
+            # Objects in the same states are resolved together, see
+            # bika.lims.workflow.listing
             brains = uc(UID=uids)
+            resolved = resolve_transitions(brains)
             for brain in brains:
-                obj = brain.getObject()
                 trans = [{'id': t['id'], 'title': t['title']} for t in
-                         wftool.getTransitionsFor(obj)]
+                         resolved.get(brain.UID, [])]
                 allowed_transitions.append(
-                    {'uid': obj.UID(), 'transitions': trans})
+                    {'uid': brain.UID, 'transitions': trans})
         except Exception as e:
             msg = "Cannot get the allowed transitions ({})".format(e.message)
             raise BadRequest(msg)
@@ -7,6 +7,7 @@
 
 from AccessControl import getSecurityManager
 from AccessControl import Unauthorized
+from bika.lims.idserver import generate_id_for
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.jsonapi import set_fields_from_request
 from bika.lims.jsonapi import resolve_request_lookup
@@ -363,13 +364,15 @@ class Create(object):
                   'separate': False}]
 
         specs = self.get_specs_from_request()
-        ar = _createObjectByType("AnalysisRequest", client, tmpID())
+        ar_id = generate_id_for(client, "AnalysisRequest", sample=sample)
+        ar = _createObjectByType("AnalysisRequest", client, ar_id or tmpID())
         ar.unmarkCreationFlag()
         fields = set_fields_from_request(ar, request)
         for field in fields:
             self.used(field)
         ar.setSample(sample)
-        ar._renameAfterCreation()
+        if not ar_id:
+            ar._renameAfterCreation()
         ret['ar_id'] = ar.getId()
 
         brains = resolve_request_lookup(context, request, 'Services')
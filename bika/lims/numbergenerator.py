@@ -5,27 +5,27 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
-import thread
 import logging
-import datetime
 from bika.lims.interfaces import INumberGenerator
-from BTrees.OIBTree import OIBTree
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
 from plone import api
+from ZODB.POSException import ConflictError
 from zope.annotation.interfaces import IAnnotations
-from zope.component import getGlobalSiteManager
 from zope.interface import implements
 
 
-
-lock = thread.allocate_lock()
-
 logger = logging.getLogger("bika.lims.idserver")
 
 STORAGE_KEY  = "bika.lims.numbercounter"
 STORAGE_HASH = "bika.lims.numbercounter.hash"
 
+# Former storage: a single OIBTree with all the numbers
 NUMBER_STORAGE = "bika.lims.consecutive_numbers_storage"
 
+# Storage of the counters: an OOBTree of key -> NumberCounter
+NUMBER_COUNTERS = "bika.lims.consecutive_numbers_counters"
+
 
 def get_storage_location():
     """ get the portal with the plone.api
@@ -41,86 +41,185 @@ def get_portal_annotation():
     return IAnnotations(get_storage_location())
 
 
+class NumberCounter(Length):
+    """Persistent counter for a single key of the number generator.
+
+    Each key has its own persistent record, so numbers for different keys
+    (e.g. different sample types) can be generated concurrently from several
+    ZEO clients without conflicts. Unlike Length, concurrent increments of
+    the same counter are not merged, because both transactions would get the
+    same number: only changes that leave the value untouched in one of the
+    transactions are resolved
+    """
+
+    def _p_resolveConflict(self, old, committed, new):
+        if committed == old:
+            return new
+        if new == old:
+            return committed
+        raise ConflictError
+
+
+def migrate_number_storage(counters, annotations):
+    """Moves the numbers from the former storage (a single OIBTree) to the
+    counters passed in, and removes the former storage. Keys that already
+    have a counter keep the highest number. Returns the number of keys
+    migrated
+    """
+    storage = annotations.get(NUMBER_STORAGE)
+    if storage is None:
+        return 0
+    logger.info("Migrating {} numbers to counters".format(len(storage)))
+    for key, value in storage.items():
+        counter = counters.get(key)
+        if counter is None:
+            counters[key] = NumberCounter(value)
+        elif counter() < value:
+            counter.set(value)
+    del annotations[NUMBER_STORAGE]
+    return len(storage)
+
+
+class CounterStorage(object):
+    """Read-write mapping of key -> number on top of the counters
+    """
+
+    def __init__(self, counters):
+        self.counters = counters
+
+    def __iter__(self):
+        return iter(self.counters.keys())
+
+    def __contains__(self, key):
+        return key in self.counters
+
+    def __len__(self):
+        return len(self.counters)
+
+    def __getitem__(self, key):
+        return self.counters[key]()
+
+    def __setitem__(self, key, value):
+        counter = self.counters.get(key)
+        if counter is None:
+            self.counters[key] = NumberCounter(value)
+        elif counter() != value:
+            counter.set(value)
+
+    def __delitem__(self, key):
+        del self.counters[key]
+
+    def get(self, key, default=None):
+        counter = self.counters.get(key)
+        if counter is None:
+            return default
+        return counter()
+
+    def keys(self):
+        return list(self.counters.keys())
+
+    def values(self):
+        return map(lambda counter: counter(), self.counters.values())
+
+    def items(self):
+        return map(lambda item: (item[0], item[1]()), self.counters.items())
+
+
 class NumberGenerator(object):
     """ perisistent consecutive numbers
     """
     implements(INumberGenerator)
 
+    @property
+    def counters(self):
+        """ get the counters, by key
+        """
+        annotation = get_portal_annotation()
+        if annotation.get(NUMBER_COUNTERS) is None:
+            # Sites not upgraded yet still have the former storage
+            self.migrate_storage()
+        return annotation[NUMBER_COUNTERS]
+
+    def migrate_storage(self):
+        """ move the numbers of the former storage to the counters
+        """
+        annotation = get_portal_annotation()
+        counters = annotation.get(NUMBER_COUNTERS)
+        if counters is None:
+            counters = OOBTree()
+            annotation[NUMBER_COUNTERS] = counters
+        return migrate_number_storage(counters, annotation)
+
     @property
     def storage(self):
         """ get the counter storage
         """
-        annotation = get_portal_annotation()
-        if annotation.get(NUMBER_STORAGE) is None:
-            annotation[NUMBER_STORAGE]  = OIBTree()
-        return annotation[NUMBER_STORAGE]
+        return CounterStorage(self.counters)
 
     def flush(self):
         """ delete all annotation storages
         """
         annotations = get_portal_annotation()
-        if annotations.get(NUMBER_STORAGE) is not None:
-            del annotations[NUMBER_STORAGE]
+        for key in [NUMBER_STORAGE, NUMBER_COUNTERS]:
+            if annotations.get(key) is not None:
+                del annotations[key]
 
     def keys(self):
-        out = []
-        for key in self.storage.keys():
-            out.append(key)
-        return out
+        return self.storage.keys()
 
     def values(self):
-        out = []
-        for value in self.storage.values():
-            out.append(value)
-        return out
+        return self.storage.values()
 
     def __iter__(self):
         return self.storage.__iter__()
 
+    def __contains__(self, key):
+        return self.storage.__contains__(key)
+
     def __getitem__(self, key):
         return self.storage.__getitem__(key)
 
     def get(self, key, default=None):
         return self.storage.get(key, default)
 
+    def get_counter(self, key):
+        """ get the counter for the given key, created if missing
+        """
+        counters = self.counters
+        counter = counters.get(key)
+        if counter is None:
+            # Only the creation of a new key writes into the BTree
+            counter = NumberCounter(0)
+            counters[key] = counter
+        return counter
+
     def get_number(self, key):
         """ get the next consecutive number
         """
-        storage = self.storage
-
-        logger.debug("NUMBER before => %s" % storage.get(key, '-'))
-        try:
-            logger.debug("*** consecutive number lock acquire ***")
-            lock.acquire()
-            try:
-                counter = storage[key]
-                storage[key] = counter + 1
-            except KeyError:
-                storage[key] = 1
-        finally:
-            logger.debug("*** consecutive number lock release ***")
-            self.storage._p_changed = True
-            lock.release()
-
-        logger.debug("NUMBER after => %s" % storage.get(key, '-'))
-        return storage[key]
+        counter = self.get_counter(key)
+        logger.debug("NUMBER before => %s" % counter())
+        counter.change(1)
+        logger.debug("NUMBER after => %s" % counter())
+        return counter()
+
+    def reserve_numbers(self, key, count):
+        """ reserve a contiguous block of numbers with a single write
+        """
+        counter = self.get_counter(key)
+        counter.change(count)
+        last = counter()
+        logger.debug("NUMBERS reserved => %s-%s" % (last - count + 1, last))
+        return range(last - count + 1, last + 1)
 
     def set_number(self, key, value):
         """ set a key's value
         """
-        storage = self.storage
-
         if not isinstance(value, int):
             logger.error("set_number: Value must be an integer")
             return
 
-        try:
-            lock.acquire()
-            storage[key] = value
-        finally:
-            self.storage._p_changed = True
-            lock.release()
-
+        storage = self.storage
+        storage[key] = value
         return storage[key]
 
 
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Benchmark of the recalculation of results while they are entered.
+
+Usage:
+bin/instance run calculation-benchmark.py <ploneSiteId> [options]
+
+Builds a results entry form with --rows analyses that have not been submitted
+yet, as the listing of a worksheet or an analysis request does, and posts
+--changes changed results at once to the calculate_analysis_entries view,
+--repeat times:
+
+    bin/instance run calculation-benchmark.py senaite --rows 200 --changes 10
+
+The fastest and the median times are reported against --target (100 ms by
+default). The changes are aborted afterwards, nothing is stored.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from AccessControl.SecurityManagement import newSecurityManager
+from Testing.makerequest import makerequest
+from plone.protect.authenticator import createToken
+from zope.component.hooks import setSite
+import transaction
+
+from bika.lims import api
+from bika.lims.browser.calcs import ajaxCalculateAnalysisEntries
+
+parser = argparse.ArgumentParser()
+parser.add_argument('site_id')
+parser.add_argument('--user', default='admin',
+                    help="User that enters the results")
+parser.add_argument('--rows', type=int, default=200,
+                    help="Number of analyses of the form")
+parser.add_argument('--changes', type=int, default=1,
+                    help="Number of results changed in each request")
+parser.add_argument('--repeat', type=int, default=10,
+                    help="Number of requests")
+parser.add_argument('--target', type=float, default=100,
+                    help="Target time for each request, in milliseconds")
+args = parser.parse_args(sys.argv[1:])
+
+app = makerequest(app)
+portal = app[args.site_id]
+setSite(portal)
+app._p_jar.sync()
+
+user = app.acl_users.getUserById(args.user)
+if user is None:
+    user = portal.acl_users.getUserById(args.user)
+if user is None:
+    parser.error("User {} not found".format(args.user))
+newSecurityManager(None, user.__of__(app.acl_users))
+
+
+def get_form_result(analysis):
+    """Returns the mapping of the result of the analysis, as sent by the form
+    """
+    return {
+        'keyword': analysis.getKeyword(),
+        'result': analysis.getResult() or '',
+        'isldl': False,
+        'isudl': False,
+        'ldl': 0,
+        'udl': 100000,
+        'belowldl': False,
+        'aboveudl': False,
+    }
+
+
+def get_form(rows):
+    """Returns the results and the item_data of a form with the analyses
+    """
+    query = dict(portal_type='Analysis',
+                 review_state=['sample_received', 'to_be_verified'],
+                 sort_on='getRequestID')
+    brains = api.search(query, 'bika_analysis_catalog')[:rows]
+    analyses = map(api.get_object, brains)
+    results = {}
+    item_data = {}
+    for analysis in analyses:
+        uid = api.get_uid(analysis)
+        results[uid] = get_form_result(analysis)
+        item_data[uid] = map(lambda interim: {
+            'keyword': interim.get('keyword'),
+            'value': interim.get('value', ''),
+        }, analysis.getInterimFields())
+    return analyses, results, item_data
+
+
+def get_changes(analyses, num):
+    """Returns num changes of results of analyses without calculation, which
+    trigger the calculation of the analyses that depend on them
+    """
+    changes = []
+    for analysis in analyses:
+        if analysis.getCalculation():
+            continue
+        changes.append([api.get_uid(analysis), 'Result',
+                        str(len(changes) + 1)])
+        if len(changes) == num:
+            break
+    return changes
+
+
+analyses, results, item_data = get_form(args.rows)
+if not analyses:
+    parser.error("No analyses with results to be entered found")
+changes = get_changes(analyses, args.changes)
+
+request = portal.REQUEST
+request.environ['REQUEST_METHOD'] = 'POST'
+request.form.update({
+    '_authenticator': createToken(),
+    'changes': json.dumps(changes),
+    'results': json.dumps(results),
+    'item_data': json.dumps(item_data),
+})
+for key, value in request.form.items():
+    request.other[key] = value
+
+times = []
+returned = 0
+for num in range(args.repeat):
+    view = ajaxCalculateAnalysisEntries(portal, request)
+    start = time.time()
+    output = view()
+    times.append((time.time() - start) * 1000)
+    returned = len(json.loads(output)['results'])
+transaction.abort()
+
+times.sort()
+median = times[len(times) / 2]
+print "Rows: {}, changes: {}, results returned: {}".format(
+    len(analyses), len(changes), returned)
+print "Fastest: {:.1f} ms, median: {:.1f} ms, slowest: {:.1f} ms".format(
+    times[0], median, times[-1])
+print "Target: {:.1f} ms ({})".format(
+    args.target, median <= args.target and "met" or "NOT met")
+
+sys.exit(median > args.target and 1 or 0)
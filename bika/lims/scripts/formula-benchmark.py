@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Micro-benchmark of the evaluation of calculation formulas.
+
+Usage:
+bin/instance run formula-benchmark.py [-n iterations]
+
+Evaluates a set of formulas with random values, through the former string
+interpolation and through the compiled formulas, checks both give identical
+results (or raise the same errors), and reports the time of each one.
+"""
+
+import getopt
+import math
+import random
+import sys
+import time
+
+from bika.lims.utils.formula import evaluate_formula
+from bika.lims.utils.formula import interpolate_and_evaluate
+
+FORMULAS = [
+    "[Ca] + [Mg]",
+    "([Ca] * 2.497) + ([Mg] * 4.118)",
+    "[Wet] / [Dry] * 100",
+    "[Ca] * [DF]",
+    "[Ca] ** 2 + [Mg]",
+    "[Ca].is_integer() + [Mg]",
+    "math.sqrt([Ca]) + max([Mg], [Ca.LDL])",
+    "[Ca.BELOWLDL] and [Ca.LDL] or [Ca]",
+    "round([Ca] / ([Mg] - [Mg]), 2)",
+    "[Ca] + [Missing]",
+]
+
+GLOBALS = {
+    "__builtins__": None,
+    "math": math,
+    "round": round,
+    "divmod": divmod,
+    "float": float,
+    "int": int,
+    "max": max,
+}
+
+
+def get_mapping():
+    ca = random.uniform(-100, 100)
+    return {
+        "Ca": ca,
+        "Ca.LDL": random.uniform(0, 1),
+        "Ca.BELOWLDL": int(ca < 0),
+        "Mg": random.uniform(0, 100),
+        "Wet": random.uniform(0, 100),
+        "Dry": random.uniform(0, 10),
+        "DF": random.randint(1, 10),
+    }
+
+
+def evaluate(func, formula, mapping):
+    try:
+        return func(formula, mapping, GLOBALS)
+    except Exception, e:
+        return e.__class__.__name__
+
+
+def run():
+    iterations = 10000
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'n:')
+    except getopt.GetoptError, e:
+        print __doc__
+        sys.exit(1)
+    for (opt, arg) in optlist:
+        if opt == '-n': iterations = int(arg)
+
+    mappings = [get_mapping() for i in range(iterations)]
+    differences = 0
+    total_legacy = 0
+    total_compiled = 0
+    for formula in FORMULAS:
+        start = time.time()
+        legacy = [evaluate(interpolate_and_evaluate, formula, mapping)
+                  for mapping in mappings]
+        elapsed_legacy = time.time() - start
+        start = time.time()
+        compiled = [evaluate(evaluate_formula, formula, mapping)
+                    for mapping in mappings]
+        elapsed_compiled = time.time() - start
+        total_legacy += elapsed_legacy
+        total_compiled += elapsed_compiled
+        diff = len(filter(lambda pair: pair[0] != pair[1],
+                          zip(legacy, compiled)))
+        differences += diff
+        print "%-40s %8.3fs %8.3fs %6.1fx  %s differences" % (
+            formula, elapsed_legacy, elapsed_compiled,
+            elapsed_legacy / elapsed_compiled, diff)
+
+    print "%-40s %8.3fs %8.3fs %6.1fx" % (
+        "Total ({} evaluations each)".format(iterations),
+        total_legacy, total_compiled, total_legacy / total_compiled)
+    sys.exit(differences and 1 or 0)
+
+
+run()
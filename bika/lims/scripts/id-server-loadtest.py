@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Load test of the stand-alone ID server (id-server.py).
+
+Usage:
+python id-server-loadtest.py [-u url] [-t threads] [-r requests] [-k keys]
+                             [-b batch_size] [-m keys_per_request]
+
+Starts the given number of threads, each one doing the given number of
+requests to the ID server, and reports the requests per second. With -m,
+each request reserves numbers for several keys at once (/_batch endpoint).
+At the end, the numbers issued for each key are checked for duplicates.
+"""
+
+import getopt
+import json
+import sys
+import threading
+import time
+import urllib
+import urllib2
+
+
+def usage(message=''):
+    if message:
+        message = 'Error: %s\n\n' % message
+    print __doc__
+    print message
+    sys.exit(0)
+
+
+class Worker(threading.Thread):
+
+    def __init__(self, url, requests, keys, batch_size, multi):
+        threading.Thread.__init__(self)
+        self.url = url.rstrip('/')
+        self.requests = requests
+        self.keys = keys
+        self.batch_size = batch_size
+        self.multi = multi
+        self.numbers = {}
+        self.errors = 0
+
+    def issued(self, key, first, last):
+        self.numbers.setdefault(key, []).extend(range(first, last + 1))
+
+    def request(self, num):
+        if self.multi:
+            keys = [self.keys[(num + i) % len(self.keys)]
+                    for i in range(self.multi)]
+            query = urllib.urlencode([(key, self.batch_size) for key in keys])
+            f = urllib2.urlopen('%s/_batch?%s' % (self.url, query))
+            for key, (first, last) in json.loads(f.read()).items():
+                self.issued(key, first, last)
+        else:
+            key = self.keys[num % len(self.keys)]
+            url = '%s%s' % (self.url, key)
+            if self.batch_size > 1:
+                url += '?batch_size=%s' % self.batch_size
+            f = urllib2.urlopen(url)
+            first = int(f.read())
+            self.issued(key, first, first + self.batch_size - 1)
+        f.close()
+
+    def run(self):
+        for num in range(self.requests):
+            try:
+                self.request(num)
+            except Exception:
+                self.errors += 1
+
+
+def run():
+    url = 'http://localhost:8081'
+    threads = 10
+    requests = 1000
+    keys = 1
+    batch_size = 1
+    multi = 0
+    try:
+        optlist, args = getopt.getopt(sys.argv[1:], 'u:t:r:k:b:m:h')
+    except getopt.GetoptError, e:
+        usage(str(e))
+    for (opt, arg) in optlist:
+        if opt == '-u': url = arg
+        elif opt == '-t': threads = int(arg)
+        elif opt == '-r': requests = int(arg)
+        elif opt == '-k': keys = int(arg)
+        elif opt == '-b': batch_size = int(arg)
+        elif opt == '-m': multi = int(arg)
+        elif opt == '-h': usage()
+
+    # use a different set of keys each run
+    run_id = int(time.time())
+    key_names = ['/loadtest-%s/key-%s' % (run_id, i) for i in range(keys)]
+
+    workers = [Worker(url, requests, key_names, batch_size, multi)
+               for i in range(threads)]
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+
+    total = threads * requests
+    errors = sum([worker.errors for worker in workers])
+    numbers = {}
+    for worker in workers:
+        for key, issued in worker.numbers.items():
+            numbers.setdefault(key, []).extend(issued)
+    issued = sum([len(values) for values in numbers.values()])
+    duplicates = sum([len(values) - len(set(values))
+                      for values in numbers.values()])
+
+    print 'Threads: %s, keys: %s, batch size: %s, keys per request: %s' % (
+        threads, keys, batch_size, multi or 1)
+    print 'Requests: %s in %.2fs (%.1f requests/s)' % (
+        total, elapsed, total / elapsed)
+    print 'Numbers issued: %s (%.1f numbers/s)' % (issued, issued / elapsed)
+    print 'Errors: %s' % errors
+    print 'Duplicates: %s' % duplicates
+    sys.exit(duplicates and 1 or 0)
+
+
+if __name__ == '__main__':
+    run()
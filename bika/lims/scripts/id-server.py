@@ -6,14 +6,191 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
 import os, sys, getopt, cgi
+import json
+import threading
+import time
 import BaseHTTPServer
+import SocketServer
 from cPickle import Pickler, Unpickler
 
+# Journal records are written and fsync'ed in batches. Requests wait until
+# the record of their counter is on disk before they are answered
+JOURNAL_SUFFIX = '.journal'
+
+# Default number of journal records after which a snapshot of the counters
+# is written and the journal is truncated
+SNAPSHOT_INTERVAL = 10000
+
+# Default maximum time (in seconds) the journal writer waits for more records
+# to batch them in a single fsync
+SYNC_DELAY = 0.002
+
+
+class CounterStore(object):
+    """In-memory counter table, made durable by an append-only journal and
+    periodic snapshots.
+
+    The snapshot is the counter file (a pickled dict of key -> last issued
+    number, same format as in former versions of the ID server). Each journal
+    record holds the last issued number of a key, so replaying the journal
+    on top of the snapshot is idempotent. On start, the snapshot is loaded
+    and the journal replayed (crash recovery). A truncated last record,
+    written when the process crashed, is ignored: it was never answered.
+    """
+
+    def __init__(self, counter_file, snapshot_interval=SNAPSHOT_INTERVAL,
+                 sync_delay=SYNC_DELAY):
+        self.counter_file = counter_file
+        self.journal_file = counter_file + JOURNAL_SUFFIX
+        self.snapshot_interval = snapshot_interval
+        self.sync_delay = sync_delay
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.synced = threading.Condition(self.lock)
+        self.pending = []
+        self.last_seq = 0
+        self.synced_seq = 0
+        self.since_snapshot = 0
+        self.running = True
+        self.recover()
+        self.journal = open(self.journal_file, 'a')
+        self.writer = threading.Thread(target=self.write_journal)
+        self.writer.setDaemon(True)
+        self.writer.start()
+
+    def recover(self):
+        """Loads the snapshot and replays the journal
+        """
+        if os.path.exists(self.counter_file):
+            f = open(self.counter_file, 'rb')
+            try:
+                self.counters = Unpickler(f).load()
+            except EOFError:
+                self.counters = {}
+            f.close()
+        if not os.path.exists(self.journal_file):
+            return
+        replayed = 0
+        f = open(self.journal_file, 'rb')
+        for line in f:
+            if not line.endswith('\n'):
+                # truncated record
+                break
+            try:
+                key, value = json.loads(line)
+            except ValueError:
+                break
+            if value > self.counters.get(key, 0):
+                self.counters[key] = value
+            replayed += 1
+        f.close()
+        print 'Recovered %s counters, %s journal records replayed' % (
+            len(self.counters), replayed)
+        # write a fresh snapshot, so the journal starts empty
+        self.write_snapshot(dict(self.counters))
+        open(self.journal_file, 'w').close()
+
+    def write_snapshot(self, counters):
+        """Writes the counters to the counter file atomically
+        """
+        tmp_file = self.counter_file + '.tmp'
+        f = open(tmp_file, 'wb')
+        Pickler(f, 2).dump(counters)
+        f.flush()
+        os.fsync(f.fileno())
+        f.close()
+        if os.name == 'nt' and os.path.exists(self.counter_file):
+            # rename does not replace existing files on Windows
+            os.remove(self.counter_file)
+        os.rename(tmp_file, self.counter_file)
+
+    def write_journal(self):
+        """Journal writer: writes the pending records in batches, with one
+        fsync per batch, and takes the snapshots
+        """
+        while True:
+            self.lock.acquire()
+            try:
+                while not self.pending and self.running:
+                    self.synced.wait(1)
+                if not self.pending and not self.running:
+                    return
+                records = self.pending
+                self.pending = []
+                seq = self.last_seq
+            finally:
+                self.lock.release()
+
+            self.journal.write(''.join(records))
+            self.journal.flush()
+            os.fsync(self.journal.fileno())
+
+            self.lock.acquire()
+            try:
+                self.synced_seq = seq
+                self.since_snapshot += len(records)
+                self.synced.notifyAll()
+                snapshot = None
+                if self.since_snapshot >= self.snapshot_interval:
+                    # The copy may contain numbers not in the journal yet.
+                    # These will be written to the new journal
+                    snapshot = dict(self.counters)
+                    self.since_snapshot = 0
+            finally:
+                self.lock.release()
+
+            if snapshot is not None:
+                self.write_snapshot(snapshot)
+                self.journal.truncate(0)
+                self.journal.seek(0)
+
+            # give other requests the chance to join the next batch
+            time.sleep(self.sync_delay)
+
+    def reserve(self, counts):
+        """Reserves numbers for several keys at once and waits until the
+        reservation is durable
+        :param counts: list of (key, count, count_from) tuples
+        :returns: dict of key -> (first, last) reserved numbers
+        """
+        result = {}
+        self.lock.acquire()
+        try:
+            for key, count, count_from in counts:
+                last = self.counters.get(key, 0)
+                if count_from and count_from > last + 1:
+                    last = count_from - 1
+                first = last + 1
+                last = last + max(count, 1)
+                self.counters[key] = last
+                self.pending.append(json.dumps([key, last]) + '\n')
+                result[key] = (first, last)
+            self.last_seq += 1
+            seq = self.last_seq
+            self.synced.notifyAll()
+            while self.synced_seq < seq:
+                self.synced.wait()
+        finally:
+            self.lock.release()
+        return result
+
+    def close(self):
+        """Writes the pending records and a last snapshot
+        """
+        self.lock.acquire()
+        self.running = False
+        self.synced.notifyAll()
+        self.lock.release()
+        self.writer.join()
+        self.write_snapshot(dict(self.counters))
+        self.journal.truncate(0)
+        self.journal.close()
+
+
 class IDRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
 
     def run(self):
         try:
-            self.counter_file = os.environ.get('counter')
             self.get_id()
         except:
             self.send_response(400)
@@ -23,29 +200,11 @@ class IDRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
     do_GET = run
     # do_POST = run
 
-    def getCounter(self, key):
-        # initialise counter
-        try:
-            f = open(self.counter_file, 'r+')
-            self._counters = Unpickler(f).load()
-        except:
-            f = open(self.counter_file, 'w+')
-            self._counters = {}
-        f.close()
-        if not self._counters.has_key(key):
-            self._counters[key] = 0
-        return self._counters[key]
-
-    def setCounter(self, key, count):
-        self._counters[key] = count
-        f = open(self.counter_file, 'r+')
-        p = Pickler(f)
-        p.dump(self._counters)
-        f.close()
-
     def get_id(self):
         batch_size = None
-        command = self.command.lower() 
+        count_from = None
+        data = {}
+        command = self.command.lower()
         if command == 'get' and self.path.find('?') != -1:
             key, qs = self.path.split('?', 1)
             data = cgi.parse_qs(qs)
@@ -53,30 +212,53 @@ class IDRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
                 batch_size = int(data['batch_size'][0])
             except:
                 batch_size = None
+            try:
+                count_from = int(data['count_from'][0])
+            except:
+                count_from = None
         else:
             key = self.path
 
-        # POST (also works .. let's GET for now .. )
-        # elif command == 'post':
-        #     key = self.path
-        #     length = self.headers.getheader('content-length')
-        #     if length:
-        #         length = int(length)
-        #         qs = self.rfile.read(length)
-        #         data = cgi.parse_qs(qs)
-
-        prev_count = self.getCounter(key)
-        next_count = prev_count + 1
-        if batch_size:
-            last_count = prev_count + batch_size
-        else:
-            last_count = next_count 
-        self.setCounter(key, last_count)
+        store = self.server.store
+
+        # Multi-key endpoint: /_batch?<key>=<count>&<key>=<count>
+        # Returns a JSON object with the first and last reserved numbers for
+        # each key
+        if key.rstrip('/') == '/_batch':
+            counts = []
+            for name, values in data.items():
+                counts.append((name, int(values[0]), None))
+            result = store.reserve(counts)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.end_headers()
+            self.wfile.write(json.dumps(result))
+            return
+
+        result = store.reserve([(key, batch_size or 1, count_from)])
+        next_count = result[key][0]
         self.send_response(200)
         self.send_header('Content-Type', 'text/plain')
         self.end_headers()
         self.wfile.write(str(next_count))
 
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPServer.BaseHTTPRequestHandler.log_message(
+                self, format, *args)
+
+
+class IDServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    """Threaded HTTP server. All threads share the same counter store
+    """
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler, store, verbose=False):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self.store = store
+        self.verbose = verbose
+
 # Copied and modified roundup-server code - thanks Richard Jones
 
 def usage(message=''):
@@ -84,14 +266,20 @@ def usage(message=''):
         message = 'Error: %(error)s\n\n'%{'error': message}
     print '''%(message)sUsage:
 id-server [-f counter] [-n hostname] [-p port] [-l file] [-d file]
+          [-s records] [-w seconds] [-v]
 
-  -f: counter file
+  -f: counter file. The journal is written next to it (counter.journal)
   -n: sets the host name
   -p: sets the port to listen on
   -l: sets a filename to log to (instead of stdout)
   -d: run the server in the background and on UN*X write the server's PID
       to the nominated file. Note: on Windows the PID argument is needed,
       but ignored.
+  -s: number of journal records after which a snapshot of the counters is
+      written (default %(snapshot_interval)s)
+  -w: maximum time in seconds the journal waits for more requests to write
+      them in a single fsync (default %(sync_delay)s)
+  -v: log every request
 
   Call the ID server with the key for which you want a count as path.
   E.g. calling
@@ -101,9 +289,16 @@ id-server [-f counter] [-n hostname] [-p port] [-l file] [-d file]
   parameter:
     http://<hostname>:<port>/Key?count_from=104
   This will return 104, or (if 104 has already been issued) the next
-  available number.
-
-'''%locals()
+  available number. To reserve a range of numbers, pass 'batch_size':
+    http://<hostname>:<port>/Key?batch_size=10
+  This will return the first number of the range. To reserve ranges for
+  several keys in a single request, call:
+    http://<hostname>:<port>/_batch?Key1=10&Key2=5
+  This will return a JSON object with the first and last numbers reserved
+  for each key, e.g. {"Key1": [1, 10], "Key2": [1, 5]}.
+
+'''%dict(locals(), snapshot_interval=SNAPSHOT_INTERVAL,
+          sync_delay=SYNC_DELAY)
     sys.exit(0)
 
 def abspath(path):
@@ -164,10 +359,13 @@ def run():
     logfile = None
     user = None
     counter = None
+    snapshot_interval = SNAPSHOT_INTERVAL
+    sync_delay = SYNC_DELAY
+    verbose = False
     try:
         # handle the command-line args
         try:
-            optlist, args = getopt.getopt(sys.argv[1:], 'f:n:p:u:d:l:h')
+            optlist, args = getopt.getopt(sys.argv[1:], 'f:n:p:u:d:l:s:w:vh')
         except getopt.GetoptError, e:
             usage(str(e))
 
@@ -178,6 +376,9 @@ def run():
             elif opt == '-u': user = arg
             elif opt == '-d': pidfile = abspath(arg)
             elif opt == '-l': logfile = abspath(arg)
+            elif opt == '-s': snapshot_interval = int(arg)
+            elif opt == '-w': sync_delay = float(arg)
+            elif opt == '-v': verbose = True
             elif opt == '-h': usage()
 
         if hasattr(os, 'getuid'):
@@ -202,7 +403,7 @@ def run():
         if counter is None:
             raise ValueError, "You have to specify the location of the counter file."
         else:
-            os.environ['counter'] = counter
+            counter = abspath(counter)
 
     except SystemExit:
         raise
@@ -228,12 +429,16 @@ def run():
         # appending, unbuffered
         sys.stdout = sys.stderr = open(logfile, 'a', 0)
 
-    httpd = BaseHTTPServer.HTTPServer(address, IDRequestHandler)
+    store = CounterStore(counter, snapshot_interval=snapshot_interval,
+                         sync_delay=sync_delay)
+    httpd = IDServer(address, IDRequestHandler, store, verbose=verbose)
     print 'ID server started on %(address)s'%locals()
     try:
         httpd.serve_forever()
     except KeyboardInterrupt:
         print 'Keyboard Interrupt: exiting'
+    httpd.server_close()
+    store.close()
 
 if __name__ == '__main__':
     run()
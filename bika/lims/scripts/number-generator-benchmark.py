@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Benchmark of the number generator with concurrent ZEO clients.
+
+Usage:
+bin/instance run number-generator-benchmark.py <ploneSiteId> [options]
+
+Starts --clients processes with the instance script passed in with --spawn.
+Each process has its own ZEO connection and generates --numbers numbers,
+committing after each one, as the creation of an object does. With --keys 1
+all clients share the same key (worst case, e.g. a single sample type),
+while with as many keys as clients each client generates numbers for its own
+key (e.g. different sample types):
+
+    bin/instance run number-generator-benchmark.py senaite \\
+        --spawn bin/client1 --clients 4 --numbers 200 --keys 4
+
+Once all clients are done, the total throughput, the number of conflicts
+(retried transactions) and the duplicate numbers, if any, are reported. The
+keys used by the benchmark are removed from the number generator afterwards.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+from Testing.makerequest import makerequest
+from ZODB.POSException import ConflictError
+from zope.component import getUtility
+from zope.component.hooks import setSite
+import transaction
+
+from bika.lims.interfaces import INumberGenerator
+
+KEY_PREFIX = 'benchmark'
+
+parser = argparse.ArgumentParser()
+parser.add_argument('site_id')
+parser.add_argument('--spawn', default=None,
+                    help="Path to the instance script used to spawn clients")
+parser.add_argument('--clients', type=int, default=4,
+                    help="Number of concurrent clients")
+parser.add_argument('--numbers', type=int, default=100,
+                    help="Numbers to generate by each client")
+parser.add_argument('--keys', type=int, default=1,
+                    help="Number of distinct keys")
+parser.add_argument('--client', type=int, default=None,
+                    help="Run as the client with this number (0-based)")
+parser.add_argument('--retries', type=int, default=10,
+                    help="Maximum retries on conflict for each number")
+args = parser.parse_args(sys.argv[1:])
+
+app = makerequest(app)
+portal = app[args.site_id]
+setSite(portal)
+app._p_jar.sync()
+
+
+def get_key(client):
+    return '{}-{}'.format(KEY_PREFIX, client % args.keys)
+
+
+def run_client(client):
+    """Generates the numbers, retrying on conflicts, and prints the results
+    as a JSON line
+    """
+    number_generator = getUtility(INumberGenerator)
+    key = get_key(client)
+    numbers = []
+    conflicts = 0
+    start = time.time()
+    for num in range(args.numbers):
+        for retry in range(args.retries + 1):
+            try:
+                number = number_generator.generate_number(key=key)
+                transaction.commit()
+                numbers.append(number)
+                break
+            except ConflictError:
+                transaction.abort()
+                conflicts += 1
+    elapsed = time.time() - start
+    print json.dumps({
+        'client': client,
+        'key': key,
+        'numbers': numbers,
+        'conflicts': conflicts,
+        'elapsed': elapsed,
+    })
+
+
+if args.client is not None:
+    run_client(args.client)
+    sys.exit(0)
+
+if not args.spawn:
+    parser.error("--spawn is required to start the clients")
+
+script = os.path.abspath(sys.argv[0])
+processes = []
+start = time.time()
+for client in range(args.clients):
+    cmd = [args.spawn, 'run', script, args.site_id,
+           '--client', str(client), '--clients', str(args.clients),
+           '--numbers', str(args.numbers), '--keys', str(args.keys),
+           '--retries', str(args.retries)]
+    processes.append(subprocess.Popen(cmd, stdout=subprocess.PIPE))
+
+results = []
+for process in processes:
+    output = process.communicate()[0]
+    for line in output.splitlines():
+        if line.startswith('{'):
+            results.append(json.loads(line))
+elapsed = time.time() - start
+
+generated = 0
+conflicts = 0
+numbers_by_key = {}
+for result in results:
+    generated += len(result['numbers'])
+    conflicts += result['conflicts']
+    numbers_by_key.setdefault(result['key'], []).extend(result['numbers'])
+    print "Client {client} ({key}): {generated} numbers, {conflicts} " \
+          "conflicts, {elapsed:.2f}s".format(generated=len(result['numbers']),
+                                            **result)
+
+duplicates = 0
+for key, numbers in numbers_by_key.items():
+    duplicates += len(numbers) - len(set(numbers))
+
+print "Clients: {}, keys: {}".format(len(results), args.keys)
+print "Generated: {} numbers in {:.2f}s ({:.1f} numbers/s)".format(
+    generated, elapsed, generated / elapsed)
+print "Conflicts: {}".format(conflicts)
+print "Failed: {}".format(args.clients * args.numbers - generated)
+print "Duplicates: {}".format(duplicates)
+
+# Remove the keys used by the benchmark
+app._p_jar.sync()
+storage = getUtility(INumberGenerator).storage
+for key in numbers_by_key.keys():
+    if key in storage:
+        del storage[key]
+transaction.commit()
+
+sys.exit(duplicates and 1 or 0)
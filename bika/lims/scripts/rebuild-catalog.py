@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Chunked, resumable and multi-process rebuild of a Bika catalog.
+
+Usage:
+bin/instance run rebuild-catalog.py <ploneSiteId> <catalogId> [options]
+
+Writer (plans the rebuild, or resumes the last one, and loads the chunks
+computed by the workers). With --spawn, the workers are started by the writer:
+
+    bin/instance run rebuild-catalog.py senaite bika_analysis_catalog \\
+        --spool var/rebuild --spawn bin/instance --workers 4
+
+Workers can also be started by hand, e.g. from other ZEO clients sharing the
+same spool directory:
+
+    bin/instance run rebuild-catalog.py senaite bika_analysis_catalog \\
+        --spool var/rebuild --worker 0 --workers 4
+"""
+
+import argparse
+import os
+import sys
+
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+import transaction
+
+from bika.lims.catalog import parallel_rebuild
+
+parser = argparse.ArgumentParser()
+parser.add_argument('site_id')
+parser.add_argument('catalog_id')
+parser.add_argument('--spool', required=True,
+                    help="Directory shared by the writer and the workers")
+parser.add_argument('--workers', type=int, default=1,
+                    help="Total number of workers")
+parser.add_argument('--worker', type=int, default=None,
+                    help="Run as the worker with this number (0-based)")
+parser.add_argument('--spawn', default=None,
+                    help="Path to the instance script used to spawn workers")
+parser.add_argument('--chunk-size', type=int,
+                    default=parallel_rebuild.DEFAULT_CHUNK_SIZE)
+parser.add_argument('--restart', action='store_true',
+                    help="Discard the last checkpoint and plan again")
+args = parser.parse_args(sys.argv[1:])
+
+app = makerequest(app)
+portal = app[args.site_id]
+setSite(portal)
+catalog = portal[args.catalog_id]
+app._p_jar.sync()
+
+if not os.path.isdir(args.spool):
+    os.makedirs(args.spool)
+
+if args.worker is not None:
+    parallel_rebuild.run_worker(catalog, args.spool, worker=args.worker,
+                                workers=args.workers)
+    transaction.abort()
+    sys.exit(0)
+
+if args.restart or parallel_rebuild.get_checkpoint(catalog) is None:
+    parallel_rebuild.plan_rebuild(catalog, chunk_size=args.chunk_size)
+    transaction.commit()
+else:
+    progress = parallel_rebuild.get_progress(catalog)
+    print "Resuming rebuild of {catalog}: {chunks_done}/{chunks} chunks " \
+          "already loaded".format(**progress)
+
+workers = []
+if args.spawn:
+    script = os.path.abspath(sys.argv[0])
+    workers = parallel_rebuild.spawn_workers(
+        args.spawn, script, args.site_id, args.catalog_id, args.spool,
+        args.workers)
+
+if parallel_rebuild.run_writer(catalog, args.spool, workers=workers):
+    parallel_rebuild.clear_checkpoint(catalog)
+    transaction.commit()
+    sys.exit(0)
+sys.exit(1)
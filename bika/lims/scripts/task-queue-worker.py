@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""
+Worker of the queue of the work that follows the transitions (see
+bika.lims.workflow.taskqueue). Runs as a separate ZEO client, and must be
+running while the task queue is enabled in the registry.
+
+Usage:
+bin/instance run task-queue-worker.py <ploneSiteId> [options]
+
+Run the pending tasks every 5 seconds, until stopped:
+
+    bin/instance run task-queue-worker.py senaite --interval 5
+
+Run the pending tasks once and exit (e.g. from a cron job):
+
+    bin/instance run task-queue-worker.py senaite --once
+"""
+
+import argparse
+import sys
+import time
+
+from Testing.makerequest import makerequest
+from zope.component.hooks import setSite
+from zope.globalrequest import setRequest
+import transaction
+
+from bika.lims import logger
+from bika.lims.workflow import taskqueue
+
+parser = argparse.ArgumentParser()
+parser.add_argument('site_id')
+parser.add_argument('--interval', type=float, default=5,
+                    help="Seconds to wait when there are no pending tasks")
+parser.add_argument('--limit', type=int, default=100,
+                    help="Maximum number of tasks run before syncing")
+parser.add_argument('--max-attempts', type=int,
+                    default=taskqueue.MAX_ATTEMPTS,
+                    help="Attempts before a task is given up")
+parser.add_argument('--once', action='store_true',
+                    help="Run the pending tasks once and exit")
+args = parser.parse_args(sys.argv[1:])
+
+app = makerequest(app)
+portal = app[args.site_id]
+setSite(portal)
+setRequest(app.REQUEST)
+
+while True:
+    # Get the tasks queued by the other clients since the last run
+    transaction.abort()
+    app._p_jar.sync()
+    processed = taskqueue.process_queue(limit=args.limit,
+                                        max_attempts=args.max_attempts)
+    if processed:
+        logger.info("Task queue: {} tasks done".format(processed))
+    if args.once:
+        break
+    if not processed:
+        time.sleep(args.interval)
@@ -14,6 +14,8 @@ from bika.lims import logger
 from bika.lims.catalog import getCatalogDefinitions
 from bika.lims.catalog import setup_catalogs
 from bika.lims.config import *
+from bika.lims.dependencygraph import build_graph
+from bika.lims.idserver import build_id_indexes
 from bika.lims.interfaces import IARImportFolder, IHaveNoBreadCrumbs
 from bika.lims.permissions import setup_permissions
 from bika.lims.utils import tmpID
@@ -612,3 +614,10 @@ def setupVarious(context):
     #  'jsregistry')
 
     create_CAS_IdentifierType(site)
+
+    # Register the IDs of the objects created so far as issued
+    build_id_indexes()
+
+    # Dependencies between services and calculations are looked up in the
+    # site-wide dependency graph
+    build_graph()
@@ -11,6 +11,7 @@ from bika.lims import logger
 from bika.lims.subscribers import doActionFor
 from bika.lims.subscribers import skip
 from bika.lims.utils import changeWorkflowState
+from bika.lims.workflow.skiplist import get_skiplist
 from DateTime import DateTime
 from Products.Archetypes.config import REFERENCE_CATALOG
 from Products.Archetypes.event import ObjectInitializedEvent
@@ -39,11 +40,10 @@ def ObjectInitializedEventHandler(instance, event):
         changeWorkflowState(instance, "bika_analysis_workflow", ar_state)
     elif ar_state in ('to_be_verified'):
         # Apply to AR only; we don't want this transition to cascade.
-        if 'workflow_skiplist' not in ar.REQUEST:
-            ar.REQUEST['workflow_skiplist'] = []
-        ar.REQUEST['workflow_skiplist'].append("retract all analyses")
+        skiplist = get_skiplist(ar.REQUEST)
+        skiplist.append("retract all analyses")
         wf_tool.doActionFor(ar, 'retract')
-        ar.REQUEST['workflow_skiplist'].remove("retract all analyses")
+        skiplist.remove("retract all analyses")
 
     if ar_ws_state == 'assigned':
         # TODO workflow: analysis request can be 'assigned'?
@@ -65,8 +65,7 @@ def ObjectRemovedEventHandler(instance, event):
 
     # We add this manually here, because during admin/ZMI removal,
     # it may possibly not be added by the workflow code.
-    if not 'workflow_skiplist' in instance.REQUEST:
-        instance.REQUEST['workflow_skiplist'] = []
+    skiplist = get_skiplist(instance.REQUEST)
 
     for a in ar.getAnalyses():
         a_state = a.review_state
@@ -104,14 +103,14 @@ def ObjectRemovedEventHandler(instance, event):
             pass
         skip(ar, 'attach', unskip=True)
     if can_verify and workflow.getInfoFor(ar, 'review_state') == 'to_be_verified':
-        instance.REQUEST["workflow_skiplist"].append('verify all analyses')
+        skiplist.append('verify all analyses')
         try:
             workflow.doActionFor(ar, 'verify')
         except WorkflowException:
             pass
         skip(ar, 'verify', unskip=True)
     if can_publish and workflow.getInfoFor(ar, 'review_state') == 'verified':
-        instance.REQUEST["workflow_skiplist"].append('publish all analyses')
+        skiplist.append('publish all analyses')
         try:
             workflow.doActionFor(ar, 'publish')
         except WorkflowException:
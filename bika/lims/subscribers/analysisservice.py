@@ -0,0 +1,16 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims.catalog.service_info import invalidate_service_info
+
+
+def ServiceInfoInvalidationHandler(instance, event):
+    """Event fired when an Analysis Service, Method or Instrument gets
+    modified or transitioned. Discards the cached information of services
+    used by analyses listings
+    """
+    invalidate_service_info()
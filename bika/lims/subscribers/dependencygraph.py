@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+from bika.lims import api
+from bika.lims.dependencygraph import remove_entry
+from bika.lims.dependencygraph import update_calculation
+from bika.lims.dependencygraph import update_service
+
+
+def ServiceModifiedEventHandler(instance, event):
+    """Event fired when an Analysis Service gets modified. Updates the entry
+    of the service in the dependency graph
+    """
+    update_service(instance)
+
+
+def CalculationModifiedEventHandler(instance, event):
+    """Event fired when a Calculation gets modified. Updates the entry of the
+    calculation in the dependency graph
+    """
+    update_calculation(instance)
+
+
+def ObjectRemovedEventHandler(instance, event):
+    """Event fired when an Analysis Service or a Calculation gets removed.
+    Removes its entry from the dependency graph
+    """
+    if event.object is not instance:
+        # A container was removed, e.g. the whole site
+        return
+    remove_entry(api.get_uid(instance))
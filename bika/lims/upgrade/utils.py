@@ -9,6 +9,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.ZCatalog.ProgressHandler import ZLogHandler
 from bika.lims import logger
 from bika.lims.catalog.catalog_utilities import addZCTextIndex
+from bika.lims.catalog.catalog_utilities import migrate_catalog
 from Products.contentmigration.walker import CustomQueryWalker
 from Products.contentmigration.migrator import BaseInlineMigrator
 from Products.contentmigration.common import HAS_LINGUA_PLONE
@@ -194,6 +195,7 @@ class UpgradeUtils(object):
         self.portal = portal
         self.reindexcatalog = {}
         self.refreshcatalog = []
+        self.addedcolumns = {}
         self.pgthreshold = pgthreshold
 
     def getInstalledVersion(self, product):
@@ -286,6 +288,9 @@ class UpgradeUtils(object):
         cat.addColumn(column)
         logger.info('Added column {0} to catalog {1}'.format(
             column, cat.id))
+        columns = self.addedcolumns.get(cat.id, [])
+        columns.append(column)
+        self.addedcolumns[cat.id] = columns
         if cat.id not in self.refreshcatalog:
             logger.info("{} to refresh because col {} added".format(
                 catalog, column
@@ -309,15 +314,26 @@ class UpgradeUtils(object):
         recatalogs all objects in the database, this method only reindexes over
         the already cataloged objects.
 
-        If a metacolumn is added it refreshes the catalog, if only a new index
-        is added, it reindexes only those new indexes.
+        Only the new indexes and metacolumns are filled, the rest of indexes
+        and columns are not recomputed (see migrate_catalog). If a catalog
+        has to be refreshed for other reasons, it is fully refreshed.
         """
         to_refresh = self.refreshcatalog[:]
         to_reindex = self.reindexcatalog.keys()
         to_reindex = to_reindex[:]
         done = []
+        # Fill only the new columns and the indexes to be reindexed
+        for catalog_id, columns in self.addedcolumns.items():
+            if catalog_id not in to_refresh:
+                continue
+            catalog = getToolByName(self.portal, catalog_id)
+            indexes = self.reindexcatalog.get(catalog_id, [])
+            migrate_catalog(catalog, indexes=indexes, columns=columns)
+            done.append(catalog_id)
         # Start reindexing the catalogs with new columns
         for catalog_to_refresh in to_refresh:
+            if catalog_to_refresh in done:
+                continue
             logger.info(
                 'Catalog {0} refreshing started'.format(catalog_to_refresh))
             catalog = getToolByName(self.portal, catalog_to_refresh)
@@ -6,13 +6,28 @@
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 from Products.Archetypes.config import REFERENCE_CATALOG
 from Products.CMFCore.utils import getToolByName
+from plone.registry import Record
+from plone.registry import field
+from plone.registry.interfaces import IRegistry
+from zope.component import getUtility
 from bika.lims import logger
+from bika.lims.catalog.reindex_queue import DEFERRED_REINDEX_REGISTRY_KEY
+from bika.lims.catalog.query_log import DEFAULT_THRESHOLD
+from bika.lims.catalog.query_log import SLOW_QUERY_INDEX_SIZES_REGISTRY_KEY
+from bika.lims.catalog.query_log import SLOW_QUERY_THRESHOLD_REGISTRY_KEY
+from bika.lims.catalog.analysis_catalog import CATALOG_ANALYSIS_LISTING
 from bika.lims.catalog.worksheet_catalog import CATALOG_WORKSHEET_LISTING
 from bika.lims.browser.dashboard.dashboard import \
     setup_dashboard_panels_visibility_registry
 from bika.lims.config import PROJECTNAME as product
+from bika.lims.dependencygraph import build_graph
+from bika.lims.idserver import build_id_indexes
+from bika.lims.interfaces import INumberGenerator
 from bika.lims.upgrade import upgradestep
 from bika.lims.upgrade.utils import UpgradeUtils
+from bika.lims.workflow.taskqueue import TASK_QUEUE_REGISTRY_KEY
+from bika.lims.workflow.trace import TRANSITION_TRACE_DIR_REGISTRY_KEY
+from bika.lims.workflow.trace import TRANSITION_TRACE_REGISTRY_KEY
 
 version = '1.2.2'  # Remember version number in metadata.xml and setup.py
 profile = 'profile-{0}:default'.format(product)
@@ -47,6 +62,48 @@ def upgrade(tool):
     # section from Dashboard
     add_sample_section_in_dashboard(portal)
 
+    # Registry record to enable/disable the deferred reindexing of objects
+    add_registry_record(DEFERRED_REINDEX_REGISTRY_KEY,
+                        field.Bool(title=u"Deferred reindexing"), True)
+
+    # Registry record with the threshold of the slow-query log
+    add_registry_record(SLOW_QUERY_THRESHOLD_REGISTRY_KEY,
+                        field.Float(title=u"Slow query threshold"),
+                        DEFAULT_THRESHOLD)
+    add_registry_record(SLOW_QUERY_INDEX_SIZES_REGISTRY_KEY,
+                        field.Bool(title=u"Slow query index sizes"), False)
+    setup = portal.portal_setup
+    setup.runImportStepFromProfile(profile, 'controlpanel')
+
+    # Registry record to enable/disable the queue of the work that follows
+    # the transitions
+    add_registry_record(TASK_QUEUE_REGISTRY_KEY,
+                        field.Bool(title=u"Task queue"), False)
+
+    # Registry records of the timing of the transitions
+    add_registry_record(TRANSITION_TRACE_REGISTRY_KEY,
+                        field.Bool(title=u"Transition timing"), False)
+    add_registry_record(TRANSITION_TRACE_DIR_REGISTRY_KEY,
+                        field.TextLine(title=u"Transition timing directory",
+                                       required=False), u"")
+
+    # The methods and instruments allowed by Analysis Services are no longer
+    # stored as metadata columns for each analysis, but read from the service
+    # info cache, by the entry of results options of each analysis
+    update_service_columns_of_analysis_catalog(ut)
+
+    # Numbers are stored in one persistent counter per key, so ZEO clients
+    # generating IDs for different keys do not conflict
+    migrate_number_generator_storage(portal)
+
+    # Generated IDs are checked against the registry of issued IDs, which is
+    # filled from the existing objects here
+    build_id_indexes()
+
+    # Dependencies between services and calculations are looked up in the
+    # site-wide dependency graph
+    build_graph()
+
     logger.info("{0} upgraded to version {1}".format(product, version))
 
     return True
@@ -69,3 +126,32 @@ def fix_worksheet_template_index(portal, ut):
     
 def add_sample_section_in_dashboard(portal):
     setup_dashboard_panels_visibility_registry('samples')
+
+
+def update_service_columns_of_analysis_catalog(ut):
+    for column in ['getAllowedMethodUIDs', 'getAllowedInstrumentUIDs']:
+        ut.delColumn(CATALOG_ANALYSIS_LISTING, column)
+    columns = ['getResultOptions', 'getDepartmentUID',
+               'getManualEntryOfResults', 'getInstrumentEntryOfResults']
+    for column in columns:
+        ut.addColumn(CATALOG_ANALYSIS_LISTING, column)
+    ut.refreshCatalogs()
+
+
+def migrate_number_generator_storage(portal):
+    """Moves the numbers of the number generator to per-key counters
+    """
+    number_generator = getUtility(INumberGenerator)
+    migrated = number_generator.migrate_storage()
+    logger.info("Number generator: {} numbers migrated, {} counters".format(
+        migrated, len(number_generator.counters)))
+
+
+def add_registry_record(key, record_field, value):
+    """Adds a new record to the registry, if it does not exist yet
+    """
+    registry = getUtility(IRegistry)
+    if key in registry:
+        return
+    registry.records[key] = Record(record_field, value)
+    logger.info("Registry record '{}' added".format(key))
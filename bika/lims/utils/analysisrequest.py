@@ -9,6 +9,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.utils import safe_unicode
 from bika.lims import bikaMessageFactory as _
 from bika.lims import logger
+from bika.lims.idserver import generate_id_for
 from bika.lims.idserver import renameAfterCreation
 from bika.lims.interfaces import ISample, IAnalysisService, IRoutineAnalysis
 from bika.lims.utils import tmpID
@@ -66,8 +67,12 @@ def create_analysisrequest(client, request, values, analyses=None,
         sample = get_sample_from_values(client, values)
         secondary = True
 
-    # Create the Analysis Request
-    ar = _createObjectByType('AnalysisRequest', client, tmpID())
+    # Create the Analysis Request, with its final ID if possible
+    ar_id = generate_id_for(client, 'AnalysisRequest', sample=sample)
+    ar = _createObjectByType('AnalysisRequest', client, ar_id or tmpID())
+    if ar_id:
+        # Do not rename after creation
+        ar._bika_id = ar_id
 
     # Set some required fields manually before processForm is called
     ar.setSample(sample)
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Calculation of the results of a set of analyses in a single pass.
+
+An analysis with a calculation depends on the siblings (analyses of the same
+request) whose keywords are used by the calculation. The engine builds the
+graph of dependencies of the analyses passed in once, sorts it so that each
+analysis comes after the analyses it depends on, and evaluates the formulas
+in that order. The values of each dependency (result, detection limits) are
+read once and reused by all the analyses that depend on it.
+
+The outcome of each analysis is kept in its node of the graph: whether the
+result was calculated, the result and the error, if any.
+
+With vectorize, the analyses with the same calculation and at the same depth
+of the graph are evaluated together, over arrays if NumPy is installed (see
+formula.evaluate_formula_batch). Results and errors are the same as when they
+are evaluated one by one.
+"""
+
+from collections import OrderedDict
+
+from bika.lims import api
+from bika.lims.dependencygraph import get_dependent_keywords
+from bika.lims.interfaces import IReferenceAnalysis
+from bika.lims.workflow import in_state
+from bika.lims.workflow.analysis import STATE_REJECTED
+from bika.lims.workflow.analysis import STATE_RETRACTED
+
+# Errors of the nodes that prevent the evaluation of the formula. Errors
+# raised by the formula itself are stored with the name of the exception,
+# e.g. "ZeroDivisionError"
+CIRCULAR_DEPENDENCY = "circular_dependency"
+INVALID_INTERIM = "invalid_interim"
+MISSING_DEPENDENCY = "missing_dependency"
+INVALID_DEPENDENCY = "invalid_dependency"
+
+# Errors raised by formulas that can't be evaluated, with the result set
+FORMULA_ERRORS = {
+    TypeError: "NA",
+    KeyError: "NA",
+    ImportError: "NA",
+    ZeroDivisionError: "0/0",
+}
+
+
+def get_error_result(error):
+    """Returns the result set for the formula error passed in, which can be
+    an instance of a subclass of the errors in FORMULA_ERRORS
+    """
+    for klass in type(error).__mro__:
+        if klass in FORMULA_ERRORS:
+            return FORMULA_ERRORS[klass]
+    raise error
+
+
+class CalculationNode(object):
+    """An analysis of the graph of dependencies
+    """
+
+    def __init__(self, analysis):
+        self.analysis = analysis
+        self.uid = api.get_uid(analysis)
+        self.keyword = analysis.getKeyword()
+        self.calculation = analysis.getCalculation()
+        # nodes of the analyses this one depends on
+        self.dependencies = []
+        # nodes of the analyses that depend on this one, only filled for
+        # the analyses added with add_dependents
+        self.dependents = []
+        # length of the longest path to the node from an analysis without
+        # dependencies, set when the graph is sorted
+        self.level = 0
+        # whether the result of the analysis has to be calculated
+        self.pending = False
+        self.calculated = False
+        self.result = None
+        self.error = None
+        self.exception = None
+
+    def __repr__(self):
+        return "<CalculationNode {} {} result={!r} error={}>".format(
+            self.keyword, self.uid, self.result, self.error)
+
+
+class CalculationEngine(object):
+    """Calculates the results of analyses in dependency order
+    """
+
+    def __init__(self, override=False, cascade=False, vectorize=False):
+        """
+        :param override: calculate the result of the analyses passed in even
+            if they have a result already
+        :param cascade: calculate first the dependencies without result
+        :param vectorize: evaluate the formulas of the analyses with the same
+            calculation together
+        """
+        self.override = override
+        self.cascade = cascade
+        self.vectorize = vectorize
+        self.nodes = OrderedDict()
+        self._siblings = {}
+        self._keywords = {}
+        self._values = {}
+
+    def get_siblings(self, analysis):
+        """Returns the siblings of the analysis, excluding the retracted or
+        rejected ones. The siblings of a routine analysis are the analyses of
+        its request, so they are looked up once for all of them
+        """
+        uid = api.get_uid(analysis)
+        siblings = self._siblings.get(uid)
+        if siblings is not None:
+            return siblings
+        siblings = analysis.getSiblings()
+        self._siblings[uid] = siblings
+        if api.get_portal_type(analysis) != "Analysis":
+            return siblings
+        if in_state(analysis, [STATE_RETRACTED, STATE_REJECTED]):
+            return siblings
+        group = [analysis] + siblings
+        for member in siblings:
+            member_uid = api.get_uid(member)
+            if member_uid not in self._siblings:
+                self._siblings[member_uid] = filter(
+                    lambda sibling: sibling is not member, group)
+        return siblings
+
+    def get_dependency_keywords(self, calculation):
+        """Returns the keywords of the services the calculation depends on,
+        from the dependency graph
+        """
+        uid = api.get_uid(calculation)
+        keywords = self._keywords.get(uid)
+        if keywords is None:
+            keywords = set(get_dependent_keywords(uid))
+            self._keywords[uid] = keywords
+        return keywords
+
+    def add(self, analysis):
+        """Adds the analysis to the graph, together with the analyses it
+        depends on, and returns its node
+        """
+        uid = api.get_uid(analysis)
+        node = self.nodes.get(uid)
+        if node is not None:
+            return node
+        node = CalculationNode(analysis)
+        self.nodes[uid] = node
+        if not node.calculation or IReferenceAnalysis.providedBy(analysis):
+            return node
+        keywords = self.get_dependency_keywords(node.calculation)
+        for sibling in self.get_siblings(analysis):
+            if sibling.getKeyword() in keywords:
+                node.dependencies.append(self.add(sibling))
+        return node
+
+    def add_dependents(self, node, accept=None):
+        """Adds the analyses that depend on the node passed in, directly or
+        through other analyses. Only the analyses for which accept returns
+        True are added, if accept is set
+        """
+        if IReferenceAnalysis.providedBy(node.analysis):
+            return
+        added = []
+        for sibling in self.get_siblings(node.analysis):
+            if accept is not None and not accept(sibling):
+                continue
+            calculation = sibling.getCalculation()
+            if not calculation:
+                continue
+            if node.keyword not in self.get_dependency_keywords(calculation):
+                continue
+            dependent = self.add(sibling)
+            if dependent in node.dependents:
+                continue
+            node.dependents.append(dependent)
+            added.append(dependent)
+        for dependent in added:
+            self.add_dependents(dependent, accept=accept)
+
+    def sort(self):
+        """Returns the nodes of the graph sorted so that every node comes
+        after the nodes it depends on. Nodes in a circular dependency, or
+        that depend on one, are flagged and excluded
+        """
+        pending = OrderedDict()
+        dependents = dict([(uid, []) for uid in self.nodes.keys()])
+        for uid, node in self.nodes.items():
+            pending[uid] = len(node.dependencies)
+            for dependency in node.dependencies:
+                dependents[dependency.uid].append(node)
+        ready = [uid for uid, count in pending.items() if count == 0]
+        ordered = []
+        while ready:
+            uid = ready.pop(0)
+            del pending[uid]
+            node = self.nodes[uid]
+            ordered.append(node)
+            for dependent in dependents[uid]:
+                dependent.level = max(dependent.level, node.level + 1)
+                pending[dependent.uid] -= 1
+                if pending[dependent.uid] == 0:
+                    ready.append(dependent.uid)
+        for uid in pending.keys():
+            self.nodes[uid].error = CIRCULAR_DEPENDENCY
+        return ordered
+
+    def mark_pending(self, node):
+        """Flags the node as pending of calculation, as well as the
+        dependencies without result if cascade is set
+        """
+        if node.pending or not node.calculation:
+            return
+        if not self.override and node.analysis.getResult():
+            return
+        node.pending = True
+        if not self.cascade:
+            return
+        for dependency in node.dependencies:
+            if not dependency.analysis.getResult():
+                self.mark_pending(dependency)
+
+    def get_interim_values(self, node):
+        """Returns the values of the interim fields of the node's analysis,
+        or None if any of them is not a number
+        """
+        values = {}
+        # Interims' priority order (from low to high):
+        # Calculation < Analysis
+        interims = node.calculation.getInterimFields() + \
+            node.analysis.getInterimFields()
+        for interim in interims:
+            if 'keyword' not in interim:
+                continue
+            try:
+                values[interim['keyword']] = float(interim['value'])
+            except (TypeError, ValueError):
+                return None
+        return values
+
+    def get_dependency_values(self, node):
+        """Returns the values of the node's analysis used by the formulas of
+        the analyses that depend on it, or None if it has no result. Raises
+        a ValueError if the result is not a number
+        """
+        values = self._values.get(node.uid)
+        if values is not None:
+            return values
+        analysis = node.analysis
+        result = analysis.getResult()
+        if not result:
+            return None
+        try:
+            result = float(str(result))
+        except (TypeError, ValueError):
+            raise ValueError("Result is not a number: {}".format(result))
+        key = node.keyword
+        values = {
+            key: result,
+            '%s.%s' % (key, 'RESULT'): result,
+            '%s.%s' % (key, 'LDL'): analysis.getLowerDetectionLimit(),
+            '%s.%s' % (key, 'UDL'): analysis.getUpperDetectionLimit(),
+            '%s.%s' % (key, 'BELOWLDL'):
+                int(analysis.isBelowLowerDetectionLimit()),
+            '%s.%s' % (key, 'ABOVEUDL'):
+                int(analysis.isAboveUpperDetectionLimit()),
+        }
+        self._values[node.uid] = values
+        return values
+
+    def get_mapping(self, node):
+        """Returns the mapping of keyword -> value for the formula of the
+        node, or None if the formula can't be evaluated, with the error set
+        """
+        mapping = self.get_interim_values(node)
+        if mapping is None:
+            node.error = INVALID_INTERIM
+            return None
+        for dependency in node.dependencies:
+            try:
+                values = self.get_dependency_values(dependency)
+            except ValueError:
+                node.error = INVALID_DEPENDENCY
+                return None
+            if values is None:
+                if self.cascade:
+                    # Dependency calculated already, but without result
+                    continue
+                node.error = MISSING_DEPENDENCY
+                return None
+            mapping.update(values)
+        return mapping
+
+    def set_result(self, node, result):
+        """Sets the result of the evaluation of the formula to the node. If
+        the result is an error, the error is set and the result is "NA" or
+        "0/0"
+        """
+        if isinstance(result, Exception):
+            node.error = result.__class__.__name__
+            node.exception = result
+            node.result = get_error_result(result)
+        else:
+            node.result = result
+        return node.result
+
+    def evaluate(self, node, mapping):
+        """Evaluates the formula of the node with the mapping passed in and
+        returns the result. If the formula raises an error, the error is set
+        and the result is "NA" or "0/0"
+        """
+        try:
+            result = node.calculation.calculateFormula(mapping)
+        except tuple(FORMULA_ERRORS.keys()) as e:
+            result = e
+        return self.set_result(node, result)
+
+    def evaluate_batch(self, nodes, mappings):
+        """Evaluates the formula, the same for all the nodes passed in, with
+        the mapping of each node
+        """
+        calculation = nodes[0].calculation
+        results = calculation.calculateFormulas(
+            mappings, errors=tuple(FORMULA_ERRORS.keys()))
+        for node, result in zip(nodes, results):
+            self.set_result(node, result)
+
+    def store(self, node):
+        """Sets the calculated result to the node's analysis
+        """
+        node.analysis.setResult(str(node.result))
+        node.calculated = True
+        self._values.pop(node.uid, None)
+
+    def get_batches(self):
+        """Returns the lists of pending nodes to be evaluated together, in
+        dependency order. Unless vectorize is set, each node is evaluated
+        alone
+        """
+        nodes = filter(lambda node: node.pending and not node.error,
+                       self.sort())
+        if not self.vectorize:
+            return map(lambda node: [node], nodes)
+        batches = OrderedDict()
+        for node in sorted(nodes, key=lambda node: node.level):
+            key = (node.level, api.get_uid(node.calculation))
+            batches.setdefault(key, []).append(node)
+        return batches.values()
+
+    def run(self):
+        """Calculates the pending nodes, in dependency order
+        """
+        for batch in self.get_batches():
+            nodes = []
+            mappings = []
+            for node in batch:
+                mapping = self.get_mapping(node)
+                if mapping is None:
+                    continue
+                nodes.append(node)
+                mappings.append(mapping)
+            if len(nodes) > 1:
+                self.evaluate_batch(nodes, mappings)
+            else:
+                for node, mapping in zip(nodes, mappings):
+                    self.evaluate(node, mapping)
+            for node in nodes:
+                self.store(node)
+        return self.nodes
+
+    def calculate(self, analyses):
+        """Calculates the results of the analyses passed in. Returns a dict
+        of UID -> node with the analyses of the graph
+        """
+        for analysis in analyses:
+            self.mark_pending(self.add(analysis))
+        return self.run()
+
+    def calculate_dependents(self, analyses, accept=None):
+        """Calculates the results of the analyses that depend on the analyses
+        passed in, directly or through other analyses. Returns a dict of
+        UID -> node with the analyses of the graph
+        """
+        for analysis in analyses:
+            self.add_dependents(self.add(analysis), accept=accept)
+        for node in self.nodes.values():
+            for dependent in node.dependents:
+                self.mark_pending(dependent)
+        return self.run()
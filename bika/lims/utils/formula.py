@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Evaluation of calculation formulas.
+
+Formulas refer to values with keywords between brackets, e.g.
+"[Ca] + [Mg.LDL] * 2". They were evaluated by replacing each keyword with
+its value formatted as "%f", then evaluating the resulting string.
+
+Here, formulas are parsed once into a code object where each keyword is a
+variable, and the code object is cached by the text of the formula, so a
+new formula text is parsed again. Values are still converted through "%f",
+so results are identical to the string interpolation. The few cases where
+the textual substitution gives a different result or formulas that can't be
+safely parsed (quotes, "%" or unbalanced brackets) are evaluated as before.
+
+The textual substitution gives a different result for non-finite values and
+for negative values followed by an operator that binds tighter than the
+unary minus: "-2.000000**2" is -4.0 and "-2.000000.is_integer()" is -1,
+while the variable would give 4.0 and True. Formulas with negative values in
+these positions are evaluated through string interpolation too, instead of
+parenthesizing the values, so their results do not change.
+
+If NumPy is installed, a formula can also be evaluated once for a batch of
+mappings, with an array of values per keyword (see evaluate_formula_batch).
+"""
+
+import math
+import re
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Maximum number of compiled formulas kept in the cache
+MAX_CACHED_FORMULAS = 1000
+
+# Keywords between brackets, e.g. [Ca] or [Ca.LDL]
+KEYWORD_RX = re.compile(r"\[([^\[\]]+)\]")
+
+# Keywords followed by an operator that binds tighter than the unary minus:
+# power, attribute, call or subscription, e.g. [Ca]**2 or [Ca].is_integer()
+TIGHT_RX = re.compile(r"\[([^\[\]]+)\]\s*(?:\*\*|\.|\(|\[)")
+
+# Characters that have a special meaning in the string interpolation
+UNSAFE_CHARS = ("'", '"', "\\", "%")
+
+# Minimum number of mappings to evaluate a formula over arrays
+MIN_BATCH_SIZE = 8
+
+_formulas = {}
+
+
+class CompiledFormula(object):
+    """A formula parsed into a code object, with a variable per keyword
+    """
+
+    def __init__(self, formula):
+        self.formula = formula
+        self.keywords = []
+        self.variables = {}
+        self.tight = set(TIGHT_RX.findall(formula))
+
+        def replace(match):
+            keyword = match.group(1)
+            if keyword not in self.variables:
+                self.variables[keyword] = "_v{}".format(len(self.keywords))
+                self.keywords.append(keyword)
+            return self.variables[keyword]
+
+        expression = KEYWORD_RX.sub(replace, formula)
+        if "[" in expression or "]" in expression:
+            raise SyntaxError("Unbalanced brackets in formula")
+        self.code = compile(expression, "<formula>", "eval")
+
+    def get_locals(self, mapping):
+        """Returns the variables for the mapping passed in, or None if the
+        formula must be evaluated through string interpolation
+        """
+        values = {}
+        for keyword in self.keywords:
+            # Same behavior as the string interpolation
+            text = "%f" % mapping[keyword]
+            value = float(text)
+            if math.isinf(value) or math.isnan(value):
+                return None
+            if text.startswith("-") and keyword in self.tight:
+                # "-2.000000**2" is -4.0, while a variable would give 4.0.
+                # Also for "-0.000000": "-0.000000.is_integer()" is -1
+                return None
+            values[self.variables[keyword]] = value
+        return values
+
+    def evaluate(self, mapping, globs):
+        values = self.get_locals(mapping)
+        if values is None:
+            return interpolate_and_evaluate(self.formula, mapping, globs)
+        return eval(self.code, globs, values)
+
+    def evaluate_arrays(self, mappings, globs, results):
+        """Evaluates the formula once, with an array of values per keyword,
+        and sets the result of each mapping in results. Returns the indexes
+        of the mappings that must be evaluated one by one: the ones with
+        values that can't be used as variables, or that give a result that
+        is not finite (e.g. a division by zero, that raises an error when
+        evaluated alone)
+        """
+        pending = []
+        rows = []
+        columns = dict([(name, []) for name in self.variables.values()])
+        for index, mapping in enumerate(mappings):
+            try:
+                values = self.get_locals(mapping)
+            except (KeyError, TypeError, ValueError):
+                # Raises the same error when evaluated alone
+                values = None
+            if values is None:
+                pending.append(index)
+                continue
+            rows.append(index)
+            for name, value in values.items():
+                columns[name].append(value)
+        if not rows:
+            return pending
+
+        arrays = dict([(name, numpy.array(values, dtype=float))
+                       for name, values in columns.items()])
+        try:
+            with numpy.errstate(all="ignore"):
+                vector = numpy.asarray(eval(self.code, globs, arrays))
+        except Exception:
+            # Not all formulas can be evaluated over arrays, e.g. the ones
+            # with functions of the math module or conditionals
+            return range(len(mappings))
+        if vector.shape != (len(rows),) or vector.dtype.kind not in "bf":
+            return range(len(mappings))
+
+        finite = numpy.isfinite(vector).tolist()
+        for index, value, is_finite in zip(rows, vector.tolist(), finite):
+            if is_finite:
+                results[index] = value
+            else:
+                pending.append(index)
+        return sorted(pending)
+
+
+def interpolate_formula(formula, mapping):
+    """Returns the formula with the keywords replaced by their values
+    """
+    formula = formula.replace("[", "%(").replace("]", ")f")
+    return eval("'%s'%%mapping" % formula,
+                {"__builtins__": None, "math": math},
+                {"mapping": mapping})
+
+
+def interpolate_and_evaluate(formula, mapping, globs):
+    """Evaluates the formula through string interpolation
+    """
+    return eval(interpolate_formula(formula, mapping), globs)
+
+
+def get_compiled_formula(formula):
+    """Returns the compiled formula for the formula text passed in, or None
+    if it must be evaluated through string interpolation
+    """
+    try:
+        return _formulas[formula]
+    except KeyError:
+        pass
+    compiled = None
+    if not filter(lambda char: char in formula, UNSAFE_CHARS):
+        try:
+            compiled = CompiledFormula(formula)
+        except SyntaxError:
+            compiled = None
+    if len(_formulas) >= MAX_CACHED_FORMULAS:
+        _formulas.clear()
+    _formulas[formula] = compiled
+    return compiled
+
+
+def evaluate_formula(formula, mapping, globs):
+    """Evaluates the formula with the values from the mapping passed in.
+    Raises the same errors as the string interpolation: KeyError for missing
+    keywords, TypeError for non numeric values, ZeroDivisionError...
+    :param formula: the minified formula, e.g. "[Ca] + [Mg]"
+    :param mapping: dict of keyword -> value
+    :param globs: globals for the evaluation (see Calculation._getGlobals)
+    """
+    compiled = get_compiled_formula(formula)
+    if compiled is None:
+        return interpolate_and_evaluate(formula, mapping, globs)
+    return compiled.evaluate(mapping, globs)
+
+
+def evaluate_formula_batch(formula, mappings, globs, errors=()):
+    """Evaluates the formula for each one of the mappings passed in. Returns
+    a list with the result for each mapping or, if evaluating it raised one
+    of the errors passed in, the error. Other errors are raised.
+    If NumPy is installed, the formula is evaluated once over arrays with the
+    values of all the mappings. Formulas that can't be evaluated over arrays
+    and mappings that would give a different result are evaluated one by one
+    :param formula: the minified formula, e.g. "[Ca] + [Mg]"
+    :param mappings: list of dicts of keyword -> value
+    :param globs: globals for the evaluation (see Calculation._getGlobals)
+    :param errors: tuple of exception classes to return instead of raising
+    """
+    results = [None] * len(mappings)
+    pending = range(len(mappings))
+    compiled = get_compiled_formula(formula)
+    if numpy is not None and compiled is not None \
+            and len(mappings) >= MIN_BATCH_SIZE:
+        pending = compiled.evaluate_arrays(mappings, globs, results)
+    for index in pending:
+        try:
+            results[index] = evaluate_formula(formula, mappings[index], globs)
+        except errors as e:
+            results[index] = e
+    return results
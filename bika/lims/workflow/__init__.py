@@ -5,9 +5,15 @@
 # Copyright 2018 by it's authors.
 # Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
 
+from Acquisition import aq_base
 from bika.lims import enum
 from bika.lims import PMF
 from bika.lims.browser import ulocalized_time
+from bika.lims.catalog.catalog_utilities import partial_reindex
+from bika.lims.catalog.reindex_queue import unqueue_reindex
+from bika.lims.workflow.indexes import get_transition_indexes
+from bika.lims.workflow import trace
+from bika.lims.workflow.skiplist import get_skiplist
 from bika.lims.interfaces import IJSONReadExtender
 from bika.lims.jsonapi import get_include_fields
 from bika.lims.utils import changeWorkflowState
@@ -19,12 +25,19 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFPlone.interfaces import IWorkflowChain
 from Products.CMFPlone.workflow import ToolWorkflowChain
 from Products.DCWorkflow.Transitions import TRIGGER_USER_ACTION
+from zope.annotation.interfaces import IAnnotations
 from zope.component import adapts
+from zope.globalrequest import getRequest
 from zope.interface import implementer
 from zope.interface import implements
 from zope.interface import Interface
+import functools
 import traceback
 
+# Annotation of the request, set while the guards that depend on the object
+# itself are deferred (see bika.lims.workflow.listing)
+DEFERRED_GUARDS_KEY = "bika.lims.workflow.deferred_guards"
+
 
 def skip(instance, action, peek=False, unskip=False):
     """Returns True if the transition is to be SKIPPED
@@ -34,22 +47,27 @@ def skip(instance, action, peek=False, unskip=False):
 
     called with only (instance, action_id), this will set the request variable preventing the
     cascade's from re-transitioning the object and return None.
+
+    The keys are kept in a SkipList (see bika.lims.workflow.skiplist), so
+    each call takes constant time, whatever the number of keys.
     """
 
     uid = callable(instance.UID) and instance.UID() or instance.UID
-    skipkey = "%s_%s" % (uid, action)
-    if 'workflow_skiplist' not in instance.REQUEST:
-        if not peek and not unskip:
-            instance.REQUEST['workflow_skiplist'] = [skipkey, ]
-    else:
-        if skipkey in instance.REQUEST['workflow_skiplist']:
-            if unskip:
-                instance.REQUEST['workflow_skiplist'].remove(skipkey)
-            else:
-                return True
+    skipkey = (uid, action)
+    create = not peek and not unskip
+    skiplist = get_skiplist(instance.REQUEST, create=create)
+    if skiplist is None:
+        return None
+    if skipkey in skiplist:
+        if unskip:
+            skiplist.remove(skipkey)
         else:
-            if not peek and not unskip:
-                instance.REQUEST["workflow_skiplist"].append(skipkey)
+            if not peek:
+                # Peeks only check the key, the caller suppresses nothing
+                skiplist.count_suppressed(skipkey)
+            return True
+    elif create:
+        skiplist.append(skipkey)
 
 
 def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
@@ -68,8 +86,6 @@ def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
     :returns: true if the transition has been performed and message
     :rtype: list
     """
-    actionperformed = False
-    message = ''
     if isinstance(instance, list):
         # This check is here because sometimes Plone creates a list
         # from submitted form elements.
@@ -81,11 +97,31 @@ def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
             )
         instance = instance[0]
     if not instance:
+        return False, ''
+
+    # Time the transition, along with the transitions cascaded from it (see
+    # bika.lims.workflow.trace)
+    node = trace.begin(instance, action_id)
+    actionperformed = False
+    try:
+        actionperformed, message = _doActionFor(
+            instance, action_id, active_only, allowed_transition)
         return actionperformed, message
+    finally:
+        trace.end(node, performed=actionperformed)
+
 
+def _doActionFor(instance, action_id, active_only, allowed_transition):
+    """Performs the transition (action_id) to the instance. See doActionFor
+    """
+    actionperformed = False
+    message = ''
     workflow = getToolByName(instance, "portal_workflow")
     skipaction = skip(instance, action_id, peek=True)
     if skipaction:
+        # The transition is not performed, so it counts as suppressed
+        skiplist = get_skiplist(instance.REQUEST, create=False)
+        skiplist.count_suppressed((instance.UID(), action_id))
         #clazzname = instance.__class__.__name__
         #msg = "Skipping transition '{0}': {1} '{2}'".format(action_id,
         #                                                    clazzname,
@@ -94,7 +130,8 @@ def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
         return actionperformed, message
 
     if allowed_transition:
-        allowed = isTransitionAllowed(instance, action_id, active_only)
+        with trace.timed("guard"):
+            allowed = isTransitionAllowed(instance, action_id, active_only)
         if not allowed:
             transitions = workflow.getTransitionsFor(instance)
             transitions = [trans['id'] for trans in transitions]
@@ -113,6 +150,8 @@ def doActionFor(instance, action_id, active_only=True, allowed_transition=True):
             "doActionFor should never (ever) be called with allowed_transition"
             "set to True as it avoids permission checks.")
     try:
+        # portal_workflow evaluates the guard again, timed as guard too
+        trace.dispatch()
         workflow.doActionFor(instance, action_id)
         actionperformed = True
     except WorkflowException as e:
@@ -178,6 +217,8 @@ def BeforeTransitionEventHandler(instance, event):
     if not event.transition:
         return
 
+    trace.transition_started(instance, event.transition.id)
+
     clazzname = instance.__class__.__name__
     currstate = getCurrentState(instance)
     msg = "Transition '{0}' started: {1} '{2}' ({3})".format(
@@ -222,8 +263,22 @@ def AfterTransitionEventHandler(instance, event):
     if not event.transition:
         return
 
+    # Time the after transition event (see bika.lims.workflow.trace)
+    node = trace.transition_finished(instance, event.transition.id)
+    try:
+        _after_transition(instance, event, node)
+    finally:
+        trace.release(node)
+
+
+def _after_transition(instance, event, node=None):
+    """Delegates to the 'after_x_transition_event' function of the instance
+    passed in. See AfterTransitionEventHandler
+    """
     # Set the request variable preventing cascade's from re-transitioning.
     if skip(instance, event.transition.id):
+        if node:
+            node["skipped"] = True
         return
 
     clazzname = instance.__class__.__name__
@@ -235,7 +290,8 @@ def AfterTransitionEventHandler(instance, event):
     # Because at this point, the object has been transitioned already, but
     # further actions are probably needed still, so be sure is reindexed
     # before going forward.
-    instance.reindexObject()
+    with trace.timed("reindex", node):
+        reindex_after_transition(instance, event)
 
     key = 'after_{0}_transition_event'.format(event.transition.id)
     after_event = getattr(instance, key, False)
@@ -251,7 +307,31 @@ def AfterTransitionEventHandler(instance, event):
 
     msg = "AfterTransition: '{0}.{1}'".format(clazzname, key)
     logger.info(msg)
-    after_event()
+    with trace.timed("after", node):
+        after_event()
+
+
+def reindex_after_transition(instance, event):
+    """Reindexes the instance after the transition of the event passed in has
+    been performed. If the transition has been declared in
+    bika.lims.workflow.indexes, only the indexes and metadata columns that
+    can be affected by the transition are reindexed. Otherwise, a full
+    reindex of the instance is done
+    """
+    workflow_id = event.workflow.getId()
+    declared = get_transition_indexes(workflow_id, event.transition.id)
+    if declared is None:
+        instance.reindexObject()
+        # A full reindex has been done, so there is no need to reindex the
+        # object again on commit, unless it gets queued again afterwards
+        unqueue_reindex(instance)
+        return
+
+    # Keep the modification date up-to-date, as reindexObject does
+    if hasattr(aq_base(instance), 'notifyModified'):
+        instance.notifyModified()
+    idxs, columns = declared
+    partial_reindex(instance, idxs, columns)
 
 
 def get_workflow_actions(obj):
@@ -282,6 +362,33 @@ def isBasicTransitionAllowed(context, permission=None):
     return True
 
 
+def guards_deferred():
+    """Returns whether the guards that depend on the object itself are
+    deferred in the current request
+    """
+    request = getRequest()
+    if request is None:
+        return False
+    return IAnnotations(request).get(DEFERRED_GUARDS_KEY, False)
+
+
+def deferrable_guard(guard):
+    """Decorator for guards that depend on the object itself (its children,
+    attachments...) and not only on its state and the permissions of the
+    user. While guards are deferred, the guard only checks the object is
+    active, and the whole guard is evaluated when the transition is done.
+    Guards that decide whether the user can act on the object (e.g. verify)
+    must not be deferred, or listings would offer transitions that are
+    refused afterwards
+    """
+    @functools.wraps(guard)
+    def wrapper(obj):
+        if guards_deferred():
+            return isBasicTransitionAllowed(obj)
+        return guard(obj)
+    return wrapper
+
+
 def isTransitionAllowed(instance, transition_id, active_only=True):
     """Checks if the object can perform the transition passed in.
     If active_only is set to true, the function will always return false if the
@@ -8,11 +8,13 @@
 import transaction
 from Products.CMFCore.utils import getToolByName
 
+from bika.lims.catalog.reindex_queue import queue_reindex
 from bika.lims.interfaces import IRoutineAnalysis
 from bika.lims.utils import changeWorkflowState
 from bika.lims.utils.analysis import create_analysis
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import skip
+from bika.lims.workflow.bulk import promote
 
 
 def after_submit(obj):
@@ -24,9 +26,7 @@ def after_submit(obj):
     This function is called automatically by
     bika.lims.workfow.AfterTransitionEventHandler
     """
-    ws = obj.getWorksheet()
-    if ws:
-        doActionFor(ws, 'submit')
+    promote(obj.getWorksheet(), 'submit')
     _reindex_request(obj)
 
 
@@ -100,23 +100,21 @@ def after_verify(obj):
     for dependency in obj.getDependencies():
         doActionFor(dependency, 'verify')
 
-    # Do all the reflex rules process
+    # Do all the reflex rules process. Always done before the promotion, so
+    # the analyses added by the rules prevent the verification of the AR
     obj._reflex_rule_process('verify')
 
     # Escalate to Analysis Request. Note that the guard for verify transition
     # from Analysis Request will check if the AR can be transitioned, so there
     # is no need to check here if all analyses within the AR have been
     # transitioned already.
-    ar = obj.getRequest()
-    doActionFor(ar, 'verify')
+    promote(obj.getRequest(), 'verify')
 
     # Ecalate to Worksheet. Note that the guard for verify transition from
     # Worksheet will check if the Worksheet can be transitioned, so there is no
     # need to check here if all analyses within the WS have been transitioned
     # already
-    ws = obj.getWorksheet()
-    if ws:
-        doActionFor(ws, 'verify')
+    promote(obj.getWorksheet(), 'verify')
     _reindex_request(obj)
 
 
@@ -188,7 +186,15 @@ def after_attach(obj):
 
 
 def _reindex_request(obj):
+    """Reindexes the Analysis Request the analysis passed in belongs to. The
+    reindex is deferred until the transaction is committed, so the Analysis
+    Request is reindexed only once, regardless of the number of its analyses
+    transitioned within the same transaction. Searches of Bika catalogs
+    reindex the queued Analysis Requests first, so they are never stale.
+    Searches of other catalogs must call flush_reindex_queue before (see
+    bika.lims.catalog.reindex_queue)
+    """
     if IRoutineAnalysis.providedBy(obj):
         request = obj.getRequest()
         if request:
-            request.reindexObject()
+            queue_reindex(request)
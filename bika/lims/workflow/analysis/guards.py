@@ -7,6 +7,7 @@
 
 from Products.CMFCore.utils import getToolByName
 from bika.lims import logger
+from bika.lims.workflow import deferrable_guard
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import isBasicTransitionAllowed
 from bika.lims.permissions import Unassign
@@ -56,6 +57,7 @@ def import_transition(obj):
     return isBasicTransitionAllowed(obj)
 
 
+@deferrable_guard
 def attach(obj):
     if not isBasicTransitionAllowed(obj):
         return False
@@ -68,6 +70,7 @@ def assign(obj):
     return isBasicTransitionAllowed(obj)
 
 
+@deferrable_guard
 def unassign(obj):
     """Check permission against parent worksheet
     """
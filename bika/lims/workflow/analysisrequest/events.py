@@ -9,6 +9,7 @@ from DateTime import DateTime
 
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getCurrentState
+from bika.lims.workflow.bulk import promote
 
 
 def _promote_transition(obj, transition_id):
@@ -16,9 +17,7 @@ def _promote_transition(obj, transition_id):
     :param obj: Analysis Request for which the transition has to be promoted
     :param transition_id: Unique id of the transition
     """
-    sample = obj.getSample()
-    if sample:
-        doActionFor(sample, transition_id)
+    promote(obj.getSample(), transition_id)
 
 
 def after_no_sampling_workflow(obj):
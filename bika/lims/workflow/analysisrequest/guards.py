@@ -8,6 +8,7 @@
 from Products.CMFCore.utils import getToolByName
 
 from bika.lims import logger
+from bika.lims.workflow import deferrable_guard
 from bika.lims.workflow import doActionFor
 from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import isActive
@@ -17,6 +18,7 @@ from bika.lims.workflow import wasTransitionPerformed
 from bika.lims.workflow.analysis import guards as analysis_guards
 
 
+@deferrable_guard
 def to_be_preserved(obj):
     """ Returns True if the Sample from this AR needs to be preserved
     Returns false if the Analysis Request has no Sample assigned yet or
@@ -45,11 +47,13 @@ def receive(obj):
     return isBasicTransitionAllowed(obj)
 
 
+@deferrable_guard
 def sample_prep(obj):
     sample = obj.getSample()
     return sample.guard_sample_prep_transition()
 
 
+@deferrable_guard
 def sample_prep_complete(obj):
     sample = obj.getSample()
     return sample.guard_sample_prep_complete_transition()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Transitions of several objects at once.
+
+When an object is transitioned, the transition is promoted to its parents
+(e.g. the worksheet and the Analysis Request of a submitted or verified
+analysis), whose guards then check all their children. Transitioning the
+objects of a worksheet one by one promotes the transition to the same parents
+once per object, and each promotion evaluates a guard that iterates over all
+the children of the parent, although only the last one can succeed.
+
+While the promotions are deferred (see defer_promotions), they are collected
+instead, once per parent and transition, and performed when all the objects
+have been transitioned, in the same order they were first requested.
+"""
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from bika.lims import api
+from bika.lims.workflow import doActionFor
+from zope.annotation.interfaces import IAnnotations
+from zope.globalrequest import getRequest
+
+# Annotation of the request with the promotions deferred so far
+DEFERRED_PROMOTIONS_KEY = "bika.lims.workflow.deferred_promotions"
+
+
+def get_deferred_promotions():
+    """Returns the promotions deferred in the current request, as an ordered
+    dict of (uid, transition) -> object, or None if promotions are not being
+    deferred
+    """
+    request = getRequest()
+    if request is None:
+        return None
+    return IAnnotations(request).get(DEFERRED_PROMOTIONS_KEY, None)
+
+
+def promote(obj, transition_id):
+    """Promotes the transition passed in to the object (usually the parent of
+    the object that has been transitioned). The transition is performed
+    straight away, unless promotions are being deferred
+    """
+    if not obj:
+        return
+    promotions = get_deferred_promotions()
+    if promotions is None:
+        doActionFor(obj, transition_id)
+        return
+    key = (api.get_uid(obj), transition_id)
+    if key not in promotions:
+        promotions[key] = obj
+
+
+@contextmanager
+def defer_promotions():
+    """Context manager that defers the promotions requested within, and
+    performs them on exit, once per object and transition. If promotions are
+    already being deferred, they are left to the outermost context
+    """
+    request = getRequest()
+    if request is None or get_deferred_promotions() is not None:
+        yield
+        return
+
+    annotations = IAnnotations(request)
+    promotions = OrderedDict()
+    annotations[DEFERRED_PROMOTIONS_KEY] = promotions
+    try:
+        yield
+    finally:
+        del annotations[DEFERRED_PROMOTIONS_KEY]
+
+    # Promotions are performed without deferral, so the promotions requested
+    # by them (e.g. from the Analysis Request to the Sample) take place too
+    for (uid, transition_id), obj in promotions.items():
+        doActionFor(obj, transition_id)
+
+
+def do_transitions(objects, transition_id):
+    """Performs the transition passed in to all the objects, and the
+    promotions to their parents once per parent. Returns the list of objects
+    that have been transitioned
+    """
+    transitioned = []
+    with defer_promotions():
+        for obj in filter(None, objects):
+            performed, message = doActionFor(obj, transition_id)
+            if performed:
+                transitioned.append(obj)
+    return transitioned
@@ -15,6 +15,7 @@ from bika.lims.workflow import getCurrentState
 from bika.lims.workflow import isBasicTransitionAllowed
 from bika.lims.workflow import wasTransitionPerformed
 from bika.lims.workflow.analysis import events as analysis_events
+from bika.lims.workflow.bulk import promote
 
 
 def after_submit(obj):
@@ -40,9 +41,7 @@ def after_verify(obj):
     # Worksheet will check if the Worksheet can be transitioned, so there is no
     # need to check here if all analyses within the WS have been transitioned
     # already
-    ws = obj.getWorksheet()
-    if ws:
-        doActionFor(ws, 'verify')
+    promote(obj.getWorksheet(), 'verify')
 
 
 def after_retract(obj):
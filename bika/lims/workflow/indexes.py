@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Declaration of the catalog indexes and metadata columns a workflow
+transition can change.
+
+After a transition, bika.lims.workflow.AfterTransitionEventHandler only
+reindexes the indexes and columns declared here for the workflow and
+transition. Transitions from workflows that are not declared here trigger a
+full reindex of the object, as usual.
+
+Only the object itself is considered here, before the after_<transition>
+event is triggered. Changes done in after events must be reindexed by the
+events themselves.
+"""
+
+# Indexes that depend on the workflow state of the object, so they are
+# reindexed after every transition. Note the role mappings of the object
+# are updated on each state change too (allowedRolesAndUsers)
+WORKFLOW_STATE_INDEXES = [
+    'review_state',
+    'worksheetanalysis_review_state',
+    'cancellation_state',
+    'inactive_state',
+    'allowedRolesAndUsers',
+    'modified',
+]
+
+# Metadata columns that depend on the workflow state of the object
+WORKFLOW_STATE_COLUMNS = [
+    'review_state',
+    'worksheetanalysis_review_state',
+    'cancellation_state',
+    'inactive_state',
+    'state_title',
+    'getObjectWorkflowStates',
+    'allowedRolesAndUsers',
+    'modified',
+    'ModificationDate',
+]
+
+# Declaration of the additional indexes and columns each transition changes,
+# grouped by workflow id. Values are (indexes, columns) tuples. Transitions
+# that only change the workflow state of the object must be declared with
+# empty tuples, otherwise a full reindex will take place
+_transition_indexes = {
+    'bika_analysis_workflow': {
+        'sampling_workflow': ((), ()),
+        'no_sampling_workflow': ((), ()),
+        'to_be_preserved': ((), ()),
+        'sample_due': ((), ()),
+        'preserve': ((), ()),
+        'sample': (('getDateSampled', ), ('getDateSampled', )),
+        'receive': (('getDateReceived', 'getDueDate'),
+                    ('getDateReceived', 'getDueDate', 'getExpiryDate')),
+        'attach': ((), ()),
+        'submit': ((), ('getSubmittedBy', )),
+        'retract': ((), ()),
+        'verify': ((), ()),
+        'publish': (('getDateAnalysisPublished', ), ()),
+        'reject': ((), ()),
+        'import': ((), ()),
+        'sample_prep': ((), ()),
+        'sample_prep_complete': ((), ()),
+    },
+    'bika_duplicateanalysis_workflow': {
+        'assign': ((), ()),
+        'unassign': ((), ()),
+        'reject': ((), ()),
+        'attach': ((), ()),
+        'submit': ((), ('getSubmittedBy', )),
+        'retract': ((), ()),
+        'verify': ((), ()),
+    },
+    'bika_referenceanalysis_workflow': {
+        'assign': ((), ()),
+        'unassign': ((), ()),
+        'reject': ((), ()),
+        'attach': ((), ()),
+        'submit': ((), ('getSubmittedBy', )),
+        'retract': ((), ()),
+        'verify': ((), ()),
+    },
+    'bika_worksheetanalysis_workflow': {
+        'assign': ((), ()),
+        'unassign': ((), ()),
+    },
+    'bika_cancellation_workflow': {
+        'cancel': ((), ()),
+        'reinstate': ((), ()),
+    },
+    'bika_inactive_workflow': {
+        'activate': ((), ()),
+        'deactivate': ((), ()),
+    },
+}
+
+
+def register_transition_indexes(workflow_id, transition_id, indexes=(),
+                                columns=()):
+    """Declares the indexes and columns the transition from the workflow
+    passed in changes, apart from those that depend on the workflow state.
+    Add-ons can use this function to declare their own workflows
+    """
+    transitions = _transition_indexes.setdefault(workflow_id, {})
+    transitions[transition_id] = (tuple(indexes), tuple(columns))
+
+
+def get_transition_indexes(workflow_id, transition_id):
+    """Returns a tuple (indexes, columns) with the indexes and metadata columns
+    that might change after the transition passed in is performed. Returns
+    None if the transition is not declared, so a full reindex is required
+    """
+    transitions = _transition_indexes.get(workflow_id, {})
+    declared = transitions.get(transition_id, None)
+    if declared is None:
+        return None
+    indexes, columns = declared
+    return (WORKFLOW_STATE_INDEXES + list(indexes),
+            WORKFLOW_STATE_COLUMNS + list(columns))
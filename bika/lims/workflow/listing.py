@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Transitions available for the items of a listing.
+
+Getting the transitions of each item of a listing wakes up its object and
+evaluates all the guards of the transitions from its current state. Most of
+these guards only depend on the state of the object and the permissions of
+the user, which are the same for the objects of the same type, in the same
+states, created by the same user (owner) and stored in the same client or
+container (local roles). Items are grouped by these, and by the values some
+guards that cannot be deferred depend on (see GROUP_KEY_NAMES), all read from
+the catalogs, and the transitions of each group are resolved once, from one
+of its objects.
+
+Some guards that depend on the object itself, but do not decide whether the
+user can act on it (e.g. the attach guard of the analyses, that checks the
+attachments required), are deferred meanwhile (see
+bika.lims.workflow.deferrable_guard): they only check the object is active,
+and are fully evaluated for each object when the transition is done. The
+rest (e.g. the verify guard of the analyses, that checks who submitted the
+result) are not deferred, so the objects in the states these guards are
+evaluated from are resolved alone (see UNGROUPED_TYPE_STATES).
+"""
+
+from zope.annotation.interfaces import IAnnotations
+
+from bika.lims import api
+from bika.lims.workflow import DEFERRED_GUARDS_KEY
+
+# Portal types whose guards that depend on the object are deferrable, so the
+# transitions of their objects can be resolved together
+GROUPED_TYPES = (
+    "Analysis",
+    "AnalysisRequest",
+    "DuplicateAnalysis",
+    "ReferenceAnalysis",
+    "Sample",
+)
+
+# States in which the workflows of the object depend on the object itself,
+# e.g. the sample preparation workflow
+UNGROUPED_STATES = ("sample_prep", )
+
+# States, by portal type, with transitions whose guards depend on the object
+# itself and are not deferred, e.g. analyses in to_be_verified can only be
+# verified by users other than the one who submitted them, and Analysis
+# Requests can only be submitted, attached, prepublished and verified
+# depending on the states of their analyses
+UNGROUPED_TYPE_STATES = {
+    "Analysis": ("not_requested", "to_be_verified"),
+    "AnalysisRequest": ("attachment_due", "sample_due", "sample_received",
+                        "to_be_sampled", "to_be_verified"),
+    "DuplicateAnalysis": ("to_be_verified", ),
+    "ReferenceAnalysis": ("to_be_verified", ),
+}
+
+# Catalog values, by portal type, the guards that are not deferred depend on,
+# in addition to the states, e.g. analyses in sample_due can only be submitted
+# if their point of capture is "field" (see guard_submit_transition)
+GROUP_KEY_NAMES = {
+    "Analysis": ["getPointOfCapture"],
+}
+
+# Catalog values, by portal type, of the object the local roles of the user
+# come from when it is not the container, e.g. the analyses of all the
+# Analysis Requests of a client share the local roles from the client
+LOCAL_ROLES_KEY_NAMES = {
+    "Analysis": "getClientUID",
+}
+
+
+def get_catalog_values(brain, names):
+    """Returns a dict with the values for the brain of the metadata columns
+    or indexes passed in, read from the brain or from the catalogs of its
+    portal type. Names without value are not included
+    """
+    values = {}
+    for name in names:
+        value = getattr(brain, name, None)
+        if isinstance(value, basestring):
+            values[name] = value
+    missing = filter(lambda name: name not in values, names)
+    if not missing:
+        return values
+
+    path = api.get_path(brain)
+    for catalog in api.get_catalogs_for(api.get_portal_type(brain)):
+        rid = catalog.getrid(path)
+        if rid is None:
+            continue
+        metadata = catalog.getMetadataForRID(rid) or {}
+        for name in missing:
+            value = metadata.get(name)
+            if not isinstance(value, basestring):
+                index = catalog._catalog.indexes.get(name)
+                value = index and index.getEntryForObject(rid, None)
+            if isinstance(value, basestring):
+                values[name] = value
+        missing = filter(lambda name: name not in values, missing)
+        if not missing:
+            break
+    return values
+
+
+def get_group_key(brain_or_object):
+    """Returns the key of the group of items whose transitions are resolved
+    together with the transitions of the item passed in, or None if the
+    transitions of the item have to be resolved alone
+    """
+    portal_type = api.safe_getattr(brain_or_object, "portal_type", None)
+    if portal_type not in GROUPED_TYPES:
+        return None
+
+    wftool = api.get_tool("portal_workflow")
+    state_vars = []
+    for workflow_id in wftool.getChainForPortalType(portal_type):
+        workflow = wftool.getWorkflowById(workflow_id)
+        if workflow is not None:
+            state_vars.append(workflow.state_var)
+    extra_names = list(GROUP_KEY_NAMES.get(portal_type, []))
+    local_roles_name = LOCAL_ROLES_KEY_NAMES.get(portal_type)
+    if local_roles_name:
+        extra_names.append(local_roles_name)
+    names = state_vars + extra_names + ["Creator"]
+
+    if api.is_brain(brain_or_object):
+        values = get_catalog_values(brain_or_object, names)
+        if filter(lambda name: name not in values, names):
+            # Not in the catalogs, the object is needed
+            return get_group_key(api.get_object(brain_or_object))
+    else:
+        values = {"Creator": brain_or_object.Creator()}
+        for state_var in state_vars:
+            values[state_var] = wftool.getInfoFor(
+                brain_or_object, state_var, None)
+        for name in extra_names:
+            values[name] = api.safe_getattr(brain_or_object, name, None)
+
+    states = tuple(map(values.get, state_vars))
+    ungrouped = UNGROUPED_STATES + UNGROUPED_TYPE_STATES.get(portal_type, ())
+    if filter(lambda state: state in ungrouped, states):
+        return None
+    extras = tuple(map(values.get, extra_names))
+    if not local_roles_name:
+        extras += (api.get_parent_path(brain_or_object), )
+    return (portal_type, states, extras, values["Creator"])
+
+
+def get_transitions_with_deferred_guards(brain_or_object):
+    """Returns the transitions available for the object, with the guards that
+    depend on the object deferred
+    """
+    request = api.get_request()
+    if request is None:
+        return api.get_transitions_for(brain_or_object)
+    annotations = IAnnotations(request)
+    annotations[DEFERRED_GUARDS_KEY] = True
+    try:
+        return api.get_transitions_for(brain_or_object)
+    finally:
+        del annotations[DEFERRED_GUARDS_KEY]
+
+
+def resolve_transitions(brains_or_objects):
+    """Returns a dict of UID -> list of the transitions available for each
+    one of the brains or objects passed in. The objects of the same group
+    (see get_group_key) get the transitions resolved from the first one
+    """
+    transitions = {}
+    groups = {}
+    for brain_or_object in brains_or_objects:
+        if not brain_or_object:
+            continue
+        uid = api.get_uid(brain_or_object)
+        key = get_group_key(brain_or_object)
+        if key is None:
+            transitions[uid] = api.get_transitions_for(brain_or_object)
+            continue
+        if key not in groups:
+            groups[key] = get_transitions_with_deferred_guards(
+                api.get_object(brain_or_object))
+        transitions[uid] = groups[key]
+    return transitions
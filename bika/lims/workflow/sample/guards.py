@@ -9,6 +9,7 @@ from Products.CMFCore.utils import getToolByName
 from Products.CMFCore.WorkflowCore import WorkflowException
 
 from bika.lims import logger
+from bika.lims.workflow import deferrable_guard
 from bika.lims.workflow import isBasicTransitionAllowed
 
 
@@ -30,6 +31,7 @@ def receive(obj):
     return isBasicTransitionAllowed(obj)
 
 
+@deferrable_guard
 def sample_prep(obj):
     """Allow the sampleprep automatic transition to fire.
     """
@@ -38,6 +40,7 @@ def sample_prep(obj):
     return obj.getPreparationWorkflow()
 
 
+@deferrable_guard
 def sample_prep_complete(obj):
     """ This relies on user created workflow.  This function must
     defend against user errors.
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Transitions to be skipped in the current request.
+
+Cascades of transitions (e.g. an analysis promoting its Analysis Request and
+worksheet) flag the objects they transitioned in the request, so they are not
+transitioned again (see bika.lims.workflow.skip). The flags were kept in a
+list, so each check was a scan of all the flags set so far in the request,
+which grows with the number of objects transitioned.
+
+The flags are kept in a set instead, by (uid, action), together with the
+number of flags of each object, so all the checks take constant time. Plain
+string flags are still supported, for the code that sets them directly. The
+registry also counts the transitions that were skipped, by action. Only the
+transitions actually not performed are counted, not the checks done with
+skip(peek=True), e.g. to list the transitions available.
+"""
+
+from collections import defaultdict
+
+# Key of the request where the registry is stored
+SKIPLIST_KEY = "workflow_skiplist"
+
+
+class SkipList(object):
+    """Registry of the transitions to be skipped. Supports the operations of
+    the list it replaces: in, append, remove, iteration and len
+    """
+
+    def __init__(self, keys=None):
+        # keys (uid, action)
+        self._keys = set()
+        # number of keys by uid
+        self._uids = defaultdict(int)
+        # plain string keys
+        self._names = set()
+        # number of transitions skipped, by action
+        self.suppressed = defaultdict(int)
+        for key in keys or []:
+            self.append(key)
+
+    def __contains__(self, key):
+        if isinstance(key, tuple):
+            return key in self._keys
+        return key in self._names
+
+    def __iter__(self):
+        return iter(list(self._keys) + list(self._names))
+
+    def __len__(self):
+        return len(self._keys) + len(self._names)
+
+    def __repr__(self):
+        return "<SkipList {} keys, suppressed={}>".format(
+            len(self), dict(self.suppressed))
+
+    def append(self, key):
+        if key in self:
+            return
+        if isinstance(key, tuple):
+            self._keys.add(key)
+            self._uids[key[0]] += 1
+        else:
+            self._names.add(key)
+
+    def remove(self, key):
+        if key not in self:
+            raise ValueError("{} not in skip list".format(repr(key)))
+        if isinstance(key, tuple):
+            self._keys.remove(key)
+            self._uids[key[0]] -= 1
+            if not self._uids[key[0]]:
+                del self._uids[key[0]]
+        else:
+            self._names.remove(key)
+
+    def has_uid(self, uid):
+        """Returns whether there is any key for the object with the UID
+        passed in
+        """
+        if uid in self._uids:
+            return True
+        return any(map(lambda name: uid in name, self._names))
+
+    def count_suppressed(self, key):
+        """Counts a transition skipped because of the key passed in
+        """
+        action = isinstance(key, tuple) and key[1] or key
+        self.suppressed[action] += 1
+
+    def get_stats(self):
+        """Returns a dict with the number of keys and the number of
+        transitions skipped, by action
+        """
+        return {
+            "keys": len(self),
+            "suppressed": dict(self.suppressed),
+            "total_suppressed": sum(self.suppressed.values()),
+        }
+
+
+def get_skiplist(request, create=True):
+    """Returns the registry of the request, converting the list set by former
+    code if needed. Returns None if there is no registry and create is False
+    """
+    if request is None:
+        return None
+    skiplist = request.get(SKIPLIST_KEY, None)
+    if isinstance(skiplist, SkipList):
+        return skiplist
+    if isinstance(skiplist, list):
+        skiplist = SkipList(skiplist)
+    elif create:
+        skiplist = SkipList()
+    else:
+        return None
+    request[SKIPLIST_KEY] = skiplist
+    return skiplist
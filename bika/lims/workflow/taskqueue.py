@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Persistent queue of the work that follows the transitions.
+
+Some of the work triggered by the transitions is not needed for the user to
+go on, e.g. the digestion of the Analysis Requests for publication. When the
+queue is enabled in the registry, this work is stored in the database as
+tasks instead, and is done later by a worker, usually a separate ZEO client:
+
+    bin/instance run bika/lims/scripts/task-queue-worker.py <ploneSiteId>
+
+Each task is the dotted name of a function (the handler) and the UID of the
+object the handler has to be called with. A task is only queued once per
+transaction. If it is queued again in a later transaction while still pending
+(or being run by the worker, with the object as it was before), the task is
+rewritten, so the commit of the worker conflicts and the task is run again
+with the latest changes. Tasks that fail are retried on the next runs of the
+worker, until MAX_ATTEMPTS is reached, and are then kept apart with their
+error, to be retried by hand from the @@task_queue view.
+
+If the queue is disabled, the handlers are called straight away.
+"""
+
+import time
+import traceback
+
+import transaction
+from BTrees.Length import Length
+from BTrees.OOBTree import OOBTree
+from plone import api as ploneapi
+from plone.registry.interfaces import IRegistry
+from ZODB.POSException import ConflictError
+from zope.annotation.interfaces import IAnnotations
+from zope.component import queryUtility
+from zope.dottedname.resolve import resolve
+
+from bika.lims import api
+from bika.lims import logger
+
+# Registry record that enables/disables the queue
+TASK_QUEUE_REGISTRY_KEY = "bika.lims.workflow.task_queue"
+
+# Annotations of the portal where the tasks are stored
+PENDING_KEY = "bika.lims.workflow.task_queue.pending"
+FAILED_KEY = "bika.lims.workflow.task_queue.failed"
+PROCESSED_KEY = "bika.lims.workflow.task_queue.processed"
+
+# Number of times a task is tried before it is given up
+MAX_ATTEMPTS = 3
+
+# Name of the attribute of the current transaction with the keys of the tasks
+# queued within the transaction
+_QUEUED_ATTR = "_bika_queued_tasks"
+
+
+def is_task_queue_enabled():
+    """Returns whether the work that follows the transitions is queued, as
+    set in the registry
+    """
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return False
+    return registry.get(TASK_QUEUE_REGISTRY_KEY, False)
+
+
+def get_storage(key, create=True):
+    """Returns the storage of the portal for the key passed in, an OOBTree
+    of (handler, uid) -> task, or a Length for the processed tasks. If the
+    storage does not exist yet and create is False, an empty storage that is
+    not stored is returned
+    """
+    annotations = IAnnotations(api.get_portal())
+    storage = annotations.get(key)
+    if storage is None:
+        storage = key == PROCESSED_KEY and Length() or OOBTree()
+        if create:
+            annotations[key] = storage
+    return storage
+
+
+def get_handler_name(handler):
+    """Returns the dotted name of the function passed in
+    """
+    return "{}.{}".format(handler.__module__, handler.__name__)
+
+
+def queue_task(obj, handler):
+    """Queues the call of the handler (a function that takes the object as
+    its only argument) with the object passed in. If the same call is already
+    queued within the current transaction, nothing is done. If the queue is
+    disabled, the handler is called straight away
+    :returns: True if the task has been queued
+    """
+    if not is_task_queue_enabled():
+        handler(obj)
+        return False
+    key = (get_handler_name(handler), api.get_uid(obj))
+    txn = transaction.get()
+    queued = getattr(txn, _QUEUED_ATTR, None)
+    if queued is None:
+        queued = set()
+        setattr(txn, _QUEUED_ATTR, queued)
+    if key in queued:
+        return False
+    queued.add(key)
+
+    # Rewrite the task even if already pending: the worker might be running
+    # it with the object as it was before the changes of this transaction
+    pending = get_storage(PENDING_KEY)
+    task = pending.get(key)
+    user = api.get_current_user()
+    pending[key] = {
+        "handler": key[0],
+        "uid": key[1],
+        "path": api.get_path(obj),
+        "user": user and user.getUserName() or None,
+        "queued": task and task["queued"] or time.time(),
+        "requested": time.time(),
+        "attempts": 0,
+        "error": None,
+    }
+    return True
+
+
+def run_task(task):
+    """Calls the handler of the task with its object, as the user who queued
+    the task. Tasks whose object no longer exists are discarded
+    """
+    obj = api.get_object_by_uid(task["uid"], default=None)
+    if obj is None:
+        logger.warn("Task queue: object {} no longer exists, discarding {}"
+                    .format(task["path"], task["handler"]))
+        return
+    handler = resolve(task["handler"])
+    username = task["user"]
+    if not username or ploneapi.user.get(username=username) is None:
+        handler(obj)
+        return
+    with ploneapi.env.adopt_user(username=username):
+        handler(obj)
+
+
+def process_task(key, max_attempts=MAX_ATTEMPTS):
+    """Runs the pending task with the key passed in and commits. Failed tasks
+    are kept for a retry, or moved to the failed ones once the number of
+    attempts reaches max_attempts
+    :returns: True if the task has been done
+    """
+    pending = get_storage(PENDING_KEY)
+    task = pending.get(key)
+    if task is None:
+        # Done by another worker meanwhile
+        return False
+    try:
+        run_task(task)
+        del pending[key]
+        get_storage(PROCESSED_KEY).change(1)
+        transaction.commit()
+        return True
+    except ConflictError:
+        # Not the task's fault, retry on the next run
+        transaction.abort()
+        logger.warn("Task queue: conflict while running {handler} for "
+                    "{path}".format(**task))
+        return False
+    except Exception:
+        transaction.abort()
+        error = traceback.format_exc()
+        logger.error("Task queue: {handler} failed for {path}:\n{error}"
+                     .format(error=error, **task))
+
+    task = dict(task, attempts=task["attempts"] + 1, error=error,
+                failed=time.time())
+    if task["attempts"] < max_attempts:
+        pending[key] = task
+    else:
+        del pending[key]
+        get_storage(FAILED_KEY)[key] = task
+    transaction.commit()
+    return False
+
+
+def process_queue(limit=None, max_attempts=MAX_ATTEMPTS):
+    """Runs the pending tasks, oldest first, committing after each one
+    :param limit: maximum number of tasks to run
+    :returns: the number of tasks done
+    """
+    pending = get_storage(PENDING_KEY, create=False)
+    tasks = sorted(pending.items(), key=lambda item: item[1]["queued"])
+    if limit:
+        tasks = tasks[:limit]
+    processed = 0
+    for key, task in tasks:
+        if process_task(key, max_attempts=max_attempts):
+            processed += 1
+    return processed
+
+
+def retry_failed():
+    """Moves the failed tasks back to the pending ones, with their attempts
+    reset
+    :returns: the number of tasks moved
+    """
+    pending = get_storage(PENDING_KEY)
+    failed = get_storage(FAILED_KEY)
+    keys = list(failed.keys())
+    for key in keys:
+        pending[key] = dict(failed[key], attempts=0, queued=time.time())
+        del failed[key]
+    return len(keys)
+
+
+def clear_failed():
+    """Discards the failed tasks
+    :returns: the number of tasks discarded
+    """
+    failed = get_storage(FAILED_KEY)
+    count = len(failed)
+    failed.clear()
+    return count
+
+
+def get_stats():
+    """Returns the number of pending, failed and processed tasks, and the
+    number of pending tasks by handler
+    """
+    pending = get_storage(PENDING_KEY, create=False)
+    handlers = {}
+    for handler, uid in pending.keys():
+        handlers[handler] = handlers.get(handler, 0) + 1
+    oldest = None
+    if handlers:
+        oldest = min(map(lambda task: task["queued"], pending.values()))
+    return {
+        "pending": len(pending),
+        "failed": len(get_storage(FAILED_KEY, create=False)),
+        "processed": get_storage(PROCESSED_KEY, create=False)(),
+        "handlers": handlers,
+        "oldest": oldest,
+    }
+
+
+def get_tasks(key, limit=None):
+    """Returns the tasks of the storage passed in (PENDING_KEY or FAILED_KEY),
+    oldest first
+    """
+    tasks = sorted(get_storage(key, create=False).values(),
+                   key=lambda task: task["queued"])
+    return limit and tasks[:limit] or tasks
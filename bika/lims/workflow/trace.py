@@ -0,0 +1,415 @@
+# -*- coding: utf-8 -*-
+#
+# This file is part of SENAITE.CORE
+#
+# Copyright 2018 by it's authors.
+# Some rights reserved. See LICENSE.rst, CONTRIBUTORS.rst.
+
+"""Timing of the transitions done within a request.
+
+When enabled in the registry, each transition done within a request is
+recorded as a node of a tree, together with the time spent in each phase:
+
+- guard: evaluation of the guard, both in bika.lims.workflow.doActionFor
+  and again in portal_workflow.doActionFor, until the transition starts
+- workflow: the DCWorkflow transition itself, from the before transition
+  event to the after transition event
+- reindex: reindex of the object after the transition
+- after: the after transition event handler of the object ("after_*")
+- total: all the above, plus the transitions cascaded from this one, which
+  are the children of the node
+
+At the end of the request the tree is stored in memory (per Zope process),
+the statistics of the transitions are aggregated by portal type and
+transition, and the tree is dumped to a JSON file if a directory is set in
+the registry, where only the newest MAX_DUMPS files are kept. The slowest
+transitions and the most recent trees are listed at @@slow_transitions and
+@@slow_transitions_json.
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from plone.registry.interfaces import IRegistry
+from zope.annotation.interfaces import IAnnotations
+from zope.component import queryUtility
+from zope.globalrequest import getRequest
+
+from bika.lims import api
+from bika.lims import logger
+from bika.lims.catalog.query_log import get_caller
+from bika.lims.workflow.skiplist import get_skiplist
+
+# Registry record that enables/disables the timing of the transitions
+TRANSITION_TRACE_REGISTRY_KEY = "bika.lims.workflow.transition_trace"
+
+# Registry record with the directory where the trees are dumped as JSON
+# files. Trees are not dumped if empty
+TRANSITION_TRACE_DIR_REGISTRY_KEY = "bika.lims.workflow.transition_trace_dir"
+
+# Annotation of the request where its trace is stored
+TRACE_KEY = "bika.lims.workflow.trace"
+
+# Phases of a transition whose time is recorded
+PHASES = ["guard", "workflow", "reindex", "after"]
+
+# Maximum number of trees kept in memory
+MAX_TRACES = 50
+
+# Maximum number of JSON files kept in the dump directory
+MAX_DUMPS = 1000
+
+_lock = threading.Lock()
+_traces = deque(maxlen=MAX_TRACES)
+_stats = {}
+
+
+def get_registry_value(key, default):
+    registry = queryUtility(IRegistry)
+    if registry is None:
+        return default
+    value = registry.get(key, None)
+    if value is None:
+        return default
+    return value
+
+
+class RequestTrace(object):
+    """Tree of the transitions done within a request
+    """
+
+    def __init__(self):
+        self.roots = []
+        self.stack = []
+        self.max_depth = 0
+        self.timings = {}
+        self.started = time.time()
+
+    def current(self):
+        return self.stack and self.stack[-1] or None
+
+    def begin(self, obj, transition_id, owned=False):
+        """Adds a node for the transition of the object passed in, as a child
+        of the transition being done, if any, and makes it the current one
+        """
+        node = {
+            "portal_type": api.get_portal_type(obj),
+            "id": api.get_id(obj),
+            "path": api.get_path(obj),
+            "uid": api.get_uid(obj),
+            "transition": transition_id,
+            "depth": len(self.stack),
+            "performed": False,
+            "skipped": False,
+            "children": [],
+            "_start": time.time(),
+            "_owned": owned,
+        }
+        for phase in PHASES:
+            node[phase] = 0.0
+        parent = self.current()
+        if parent is None:
+            self.roots.append(node)
+        else:
+            parent["children"].append(node)
+        self.stack.append(node)
+        self.max_depth = max(self.max_depth, len(self.stack))
+        return node
+
+    def end(self, node):
+        """Closes the node passed in, along with the nodes opened after it
+        that have not been closed (e.g. transitions that raised)
+        """
+        if not filter(lambda opened: opened is node, self.stack):
+            return
+        while self.stack:
+            closing = self.stack.pop()
+            now = time.time()
+            closing["total"] = now - closing.pop("_start")
+            # The guard of portal_workflow failed, the transition never began
+            dispatched = closing.pop("_dispatch_start", None)
+            if dispatched is not None:
+                closing["guard"] += now - dispatched
+            closing.pop("_owned", None)
+            closing.pop("_workflow_start", None)
+            if closing is node:
+                break
+
+    def find(self, obj, transition_id):
+        """Returns the current node if it is for the transition of the object
+        passed in and the DCWorkflow transition has not started yet
+        """
+        node = self.current()
+        if node is None or "_workflow_start" in node:
+            return None
+        if node["transition"] != transition_id:
+            return None
+        if node["uid"] != api.get_uid(obj):
+            return None
+        return node
+
+    def count(self, nodes=None):
+        nodes = self.roots if nodes is None else nodes
+        return sum(map(lambda node: 1 + self.count(node["children"]), nodes))
+
+    def to_dict(self, request=None):
+        view, url = get_caller()
+        skiplist = get_skiplist(request, create=False)
+        return {
+            "time": self.started,
+            "view": view,
+            "url": url,
+            "total": sum(map(lambda node: node["total"], self.roots)),
+            "transitions": self.count(),
+            "max_depth": self.max_depth,
+            "timings": self.timings,
+            "skiplist": skiplist and skiplist.get_stats() or None,
+            "tree": self.roots,
+        }
+
+
+def get_trace(request=None):
+    """Returns the trace of the request passed in (or the current request),
+    or None if the timing of the transitions is disabled
+    """
+    request = request or getRequest()
+    if request is None:
+        return None
+    annotations = IAnnotations(request)
+    trace = annotations.get(TRACE_KEY, None)
+    if trace is None:
+        enabled = get_registry_value(TRANSITION_TRACE_REGISTRY_KEY, False)
+        trace = enabled and RequestTrace() or False
+        annotations[TRACE_KEY] = trace
+    return trace or None
+
+
+def begin(obj, transition_id):
+    """Starts the node of the transition of the object passed in. Returns
+    the node, or None if the timing of the transitions is disabled
+    """
+    trace = get_trace()
+    if trace is None:
+        return None
+    return trace.begin(obj, transition_id)
+
+
+def end(node, performed=None):
+    """Closes the node passed in
+    """
+    trace = node and get_trace()
+    if trace is None:
+        return
+    if performed is not None:
+        node["performed"] = performed
+    trace.end(node)
+
+
+@contextmanager
+def timed(phase, node=None):
+    """Adds the time spent within to the phase of the node passed in, or of
+    the current node
+    """
+    trace = get_trace()
+    node = node or trace and trace.current()
+    if not node:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        node[phase] += time.time() - start
+
+
+def dispatch():
+    """Called right before the transition of the current node is passed to
+    portal_workflow, which evaluates the guard again before the transition
+    starts. That time is added to the guard phase
+    """
+    trace = get_trace()
+    node = trace and trace.current()
+    if node:
+        node["_dispatch_start"] = time.time()
+
+
+def transition_started(obj, transition_id):
+    """Called when the DCWorkflow transition of the object passed in starts.
+    Starts a new node if the transition was not started from doActionFor
+    """
+    trace = get_trace()
+    if trace is None:
+        return
+    now = time.time()
+    node = trace.find(obj, transition_id)
+    if node is None:
+        node = trace.begin(obj, transition_id, owned=True)
+    dispatched = node.pop("_dispatch_start", None)
+    if dispatched is not None:
+        node["guard"] += now - dispatched
+    node["_workflow_start"] = now
+
+
+def transition_finished(obj, transition_id):
+    """Called when the DCWorkflow transition of the object passed in has
+    finished. Returns the node of the transition
+    """
+    trace = get_trace()
+    node = trace and trace.current()
+    if not node or node["transition"] != transition_id:
+        return None
+    if node["uid"] != api.get_uid(obj):
+        return None
+    start = node.get("_workflow_start")
+    if start is not None:
+        node["workflow"] = time.time() - start
+    node["performed"] = True
+    return node
+
+
+def release(node):
+    """Closes the node passed in if it was started from the transition
+    events instead of doActionFor
+    """
+    if node and node.get("_owned"):
+        end(node)
+
+
+def add_timing(name, elapsed):
+    """Adds the time passed in to the timings of the request that are not
+    bound to a transition, e.g. the deferred reindex on commit
+    """
+    trace = get_trace()
+    if trace is None:
+        return
+    trace.timings[name] = trace.timings.get(name, 0.0) + elapsed
+
+
+def aggregate(nodes, entry):
+    """Adds the nodes passed in, and their children, to the statistics of
+    the transitions by portal type and transition
+    """
+    for node in nodes:
+        if not node["performed"]:
+            aggregate(node["children"], entry)
+            continue
+        key = (node["portal_type"], node["transition"])
+        stats = _stats.get(key, None)
+        if stats is None:
+            stats = {
+                "portal_type": key[0],
+                "transition": key[1],
+                "count": 0,
+                "total": 0.0,
+                "max": 0.0,
+                "max_depth": 0,
+                "cascaded": 0,
+            }
+            for phase in PHASES:
+                stats[phase] = 0.0
+            _stats[key] = stats
+        stats["count"] += 1
+        stats["total"] += node["total"]
+        stats["cascaded"] += len(node["children"])
+        stats["max_depth"] = max(stats["max_depth"], node["depth"])
+        for phase in PHASES:
+            stats[phase] += node[phase]
+        if node["total"] >= stats["max"]:
+            stats["max"] = node["total"]
+            stats["slowest"] = {
+                "path": node["path"],
+                "url": entry["url"],
+                "time": entry["time"],
+            }
+        aggregate(node["children"], entry)
+
+
+def dump(entry):
+    """Writes the trace passed in as a JSON file, in the directory set in the
+    registry, if any
+    """
+    directory = get_registry_value(TRANSITION_TRACE_DIR_REGISTRY_KEY, "")
+    if not directory:
+        return
+    filename = "transitions-{:.6f}-{}.json".format(
+        entry["time"], threading.current_thread().ident)
+    path = os.path.join(directory, filename)
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(path, "w") as f:
+            json.dump(entry, f, indent=2, default=repr)
+        rotate_dumps(directory)
+    except (IOError, OSError) as e:
+        logger.error("Cannot dump the transitions trace to {}: {}"
+                     .format(path, e))
+
+
+def rotate_dumps(directory, max_dumps=MAX_DUMPS):
+    """Removes the oldest JSON files of the directory passed in, so only the
+    newest max_dumps files are kept
+    """
+    # The names start with the time of the request, so they sort by age
+    filenames = sorted(filter(
+        lambda name: name.startswith("transitions-") and
+        name.endswith(".json"), os.listdir(directory)))
+    for filename in filenames[:-max_dumps]:
+        try:
+            os.remove(os.path.join(directory, filename))
+        except OSError:
+            # Removed by another thread or process meanwhile
+            pass
+
+
+def EndRequestHandler(event):
+    """Stores the trace of the request, if any transition was done
+    """
+    request = event.request
+    trace = get_trace(request)
+    if trace is None or not trace.roots:
+        return
+    # Close the nodes of transitions that did not finish
+    if trace.stack:
+        trace.end(trace.stack[0])
+    entry = trace.to_dict(request)
+    with _lock:
+        _traces.append(entry)
+        aggregate(entry["tree"], entry)
+    dump(entry)
+    logger.info("Transitions trace: {transitions} transitions in "
+                "{total:.3f}s (max depth {max_depth}) from '{view}'"
+                .format(**entry))
+
+
+def get_traces(limit=None):
+    """Returns the most recent traces, newest first
+    """
+    with _lock:
+        traces = list(_traces)
+    traces.reverse()
+    return traces[:limit]
+
+
+def get_slowest_transitions(limit=None, sort_on="total"):
+    """Returns the statistics of the transitions, aggregated by portal type
+    and transition
+    :param sort_on: 'total', 'max', 'count', 'average' or a phase
+    """
+    with _lock:
+        stats = [dict(item) for item in _stats.values()]
+    for item in stats:
+        item["average"] = item["total"] / item["count"]
+    stats.sort(key=lambda item: item.get(sort_on, 0), reverse=True)
+    return stats[:limit]
+
+
+def clear_traces():
+    """Removes all the traces and statistics recorded so far
+    """
+    with _lock:
+        _traces.clear()
+        _stats.clear()